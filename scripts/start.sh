@@ -0,0 +1,18 @@
+#!/bin/sh
+# Entry point of the container: applies the migrations and starts the production server.
+# The server is configured by store_rest/gunicorn.conf.py (SERVER_WORKER=uvicorn serves the ASGI application).
+# Set RUN_MIGRATIONS=false when the migrations are applied by a separate release step.
+set -e
+
+cd "$(dirname "$0")/../store_rest"
+
+export DJANGO_SETTINGS_MODULE="${DJANGO_SETTINGS_MODULE:-store_rest.settings}"
+export DJANGO_DEBUG="${DJANGO_DEBUG:-false}"
+# The sampled request measures are logged (see store_api.instrumentation)
+export STORE_API_LOG_LEVEL="${STORE_API_LOG_LEVEL:-INFO}"
+
+if [ "${RUN_MIGRATIONS:-true}" = "true" ]; then
+    python manage.py migrate --noinput
+fi
+
+exec gunicorn --config gunicorn.conf.py
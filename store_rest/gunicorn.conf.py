@@ -0,0 +1,82 @@
+"""
+Gunicorn configuration of the production server (see scripts/start.sh)
+
+Every value can be changed with the environment:
+    SERVER_WORKER: gthread (WSGI, threaded workers, the default) or uvicorn (ASGI, see store_rest/asgi.py)
+    GUNICORN_BIND: Address listened to (default 0.0.0.0:$PORT, PORT 8080)
+    GUNICORN_WORKERS: Worker processes (default 2 per CPU + 1)
+    GUNICORN_THREADS: Threads per gthread worker (default 4)
+    GUNICORN_PRELOAD: Load the application before forking the workers (default true)
+    GUNICORN_MAX_REQUESTS: Requests served by a worker before it is replaced (default 2000, 0 disables)
+    GUNICORN_KEEPALIVE: Seconds a connection waits for the next request (default 5)
+    GUNICORN_TIMEOUT: Seconds a request may run before its worker is restarted (default 30)
+    METRICS_DIR: Directory of the metric files of the workers (default store_rest_metrics in /dev/shm)
+"""
+import glob
+import multiprocessing
+import os
+
+
+def env_flag(name, default):
+    return os.environ.get(name, default).lower() in ('1', 'true', 'yes')
+
+
+server_worker = os.environ.get('SERVER_WORKER', 'gthread')
+if server_worker == 'uvicorn':
+    wsgi_app = 'store_rest.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'store_rest.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8080')}")
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+# The application is imported once by the master: the workers share its memory pages (copy-on-write)
+# and start faster. Code changes then need a restart of the master, not only of the workers
+preload_app = env_flag('GUNICORN_PRELOAD', 'true')
+
+# Replacing the workers periodically bounds the memory they leak or fragment. The jitter spreads the
+# restarts, so the workers are not replaced all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+# The worker heartbeat files in memory: a container's /tmp may be on a slow overlay file system
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# The workers write their metrics in files of this directory, summed by the /metrics endpoint (see
+# store_api.metrics). Set before the application is loaded, which reads it from the settings
+os.environ.setdefault('METRICS_DIR', os.path.join(worker_tmp_dir or '/tmp', 'store_rest_metrics'))
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def pre_fork(server, worker):
+    # The connections opened by the master while preloading are closed before forking: a connection
+    # used by two processes gets corrupted
+    if preload_app:
+        from django.db import connections
+        for connection in connections.all():
+            connection.close()
+
+
+def on_starting(server):
+    # The counters start from zero with the server: the metric files of a previous run are removed
+    # (only those: the directory may hold other files)
+    from store_api.metrics import SUFFIX
+    os.makedirs(os.environ['METRICS_DIR'], exist_ok=True)
+    for pattern in (f'*{SUFFIX}', f'*{SUFFIX}.tmp'):
+        for path in glob.glob(os.path.join(os.environ['METRICS_DIR'], pattern)):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    # The counts of a replaced worker are kept, merged into a single file
+    from store_api.metrics import merge_process_values
+    merge_process_values(os.environ['METRICS_DIR'], worker.pid)
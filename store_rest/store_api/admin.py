@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.utils.translation import ugettext_lazy as _
 
-from .models import User, Product, Order, OrderItem
+from .models import User, Product, Order, OrderItem, ProductSales, UserSales, DailySales
 
 
 # Register your models here.
@@ -28,16 +28,43 @@ class UserAdmin(DjangoUserAdmin):
     ordering = ('email',)
 
 
+class AllObjectsAdmin(admin.ModelAdmin):
+    """Admin of the models with logical deletion: lists the logically deleted rows too"""
+    list_filter = ('active',)
+
+    def get_queryset(self, request):
+        queryset = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        return queryset
+
+
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'description', 'price')
+class ProductAdmin(AllObjectsAdmin):
+    list_display = ('name', 'description', 'price', 'active')
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ('order_id', 'product', 'quantity')
+class OrderItemAdmin(AllObjectsAdmin):
+    list_display = ('order_id', 'product', 'quantity', 'active')
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user')
+class OrderAdmin(AllObjectsAdmin):
+    list_display = ('id', 'user', 'order_total', 'item_count', 'active')
+
+
+@admin.register(ProductSales)
+class ProductSalesAdmin(admin.ModelAdmin):
+    list_display = ('product', 'units', 'revenue', 'item_count')
+
+
+@admin.register(UserSales)
+class UserSalesAdmin(admin.ModelAdmin):
+    list_display = ('user', 'units', 'revenue', 'item_count')
+
+
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    list_display = ('day', 'units', 'revenue', 'item_count')
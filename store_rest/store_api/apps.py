@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class StoreApiConfig(AppConfig):
     name = 'store_api'
+
+    def ready(self):
+        # Connects the receivers keeping the search index, the catalog cache, the cached tokens
+        # and the sales rollups in sync, and setting up the database connections
+        from . import authentication, caching, database, rollups, search  # noqa: F401
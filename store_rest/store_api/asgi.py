@@ -0,0 +1,83 @@
+"""ASGI handler running the catalog reads in a dedicated thread pool
+
+Django's ASGIHandler runs each synchronous request with sync_to_async, in the default executor of the event
+loop, shared by all the requests (sized by ASGI_THREADS, or by the CPU count). A burst of slow requests
+(exports, bulk order creations) takes all its threads and the product reads queue behind them.
+The catalog reads (the product list, detail, search and high_orders endpoints) only read the database and
+the cache: CatalogASGIHandler runs them in their own pool of ASGI_CATALOG_THREADS threads instead, so they
+keep being served concurrently, while the event loop keeps receiving the requests and sending the responses.
+The other requests (writes and the remaining endpoints) keep the default behaviour.
+
+This is only the isolation of the catalog reads in their own pool: the views stay synchronous, as Django 3.0
+has neither async views nor an async ORM, and they run concurrently under the stock handler as well.
+The views, middleware, authentication, permissions and caching are the same of the WSGI application.
+
+The handler overrides the coroutine get_response that Django 3.0 awaits: from Django 3.1 the requests go
+through get_response_async and an async middleware chain, so get_asgi_application serves them with
+Django's handler instead.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from rest_framework.permissions import SAFE_METHODS
+
+# The url names of the catalog read endpoints (see urls.py)
+CATALOG_ROUTES = ('store_api:products', 'store_api:product', 'store_api:product_search', 'store_api:high_orders')
+
+
+def is_catalog_read(request):
+    """
+    :return: Whether the request reads the product catalog
+    """
+    if request.method not in SAFE_METHODS:
+        return False
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return False
+    return match.view_name in CATALOG_ROUTES
+
+
+def get_asgi_application():
+    """
+    :return: The ASGI application: CatalogASGIHandler on Django 3.0, Django's handler on later versions.
+    Django must be set up first (see store_rest.asgi)
+    """
+    if django.VERSION >= (3, 1):
+        return ASGIHandler()
+    return CatalogASGIHandler()
+
+
+class CatalogASGIHandler(ASGIHandler):
+    """
+    Class responsible to handle the ASGI requests, running the catalog reads concurrently in a thread pool
+    """
+
+    def __init__(self):
+        if django.VERSION >= (3, 1):
+            raise ImproperlyConfigured('CatalogASGIHandler handles the requests of Django 3.0: use '
+                                       'store_api.asgi.get_asgi_application with Django >= 3.1')
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASGI_CATALOG_THREADS', 32),
+                                           thread_name_prefix='catalog')
+
+    async def get_response(self, request):
+        if not is_catalog_read(request):
+            return await sync_to_async(super().get_response)(request)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.get_catalog_response, request)
+
+    def get_catalog_response(self, request):
+        # The request_started/finished signals (closing the expired connections) are sent by the other thread:
+        # the connections of the pool threads are checked here, following CONN_MAX_AGE
+        close_old_connections()
+        try:
+            return super().get_response(request)
+        finally:
+            close_old_connections()
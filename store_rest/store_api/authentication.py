@@ -0,0 +1,142 @@
+"""Cached token authentication
+
+TokenAuthentication queries the token joined with its user on every request. CachedTokenAuthentication
+keeps the resolved (user, token) pairs in an in-process LRU cache with a TTL, so hot clients are
+authenticated without a query.
+
+Revocations (token deleted, user deactivated or changed) must reach every process: they bump an epoch
+counter in the shared cache backend (see CACHES in the settings), and the local entries of a previous
+epoch are discarded. Reading the epoch costs a cache lookup per request, not a database query.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .metrics import TOKEN_CACHE_LOOKUPS
+from .models import User
+
+AUTH_EPOCH_KEY = 'store_api:auth:epoch'
+
+
+class TokenCache:
+    """
+    Class responsible to keep the resolved tokens in memory, with a maximum size (least recently used
+    entries are evicted first) and a time to live. Also counts hits, misses and evictions.
+    """
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, epoch):
+        """
+        :return: The value cached for the key in this epoch, or None
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] != epoch or entry[2] < now:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, epoch):
+        with self.lock:
+            self.entries[key] = (value, epoch, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        :return: The cache counters and the hit rate since the process started
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def auth_epoch():
+    """
+    :return: The current authentication epoch, starting it when not in the cache
+    """
+    epoch = cache.get(AUTH_EPOCH_KEY)
+    if epoch is None:
+        cache.add(AUTH_EPOCH_KEY, 1, timeout=None)
+        epoch = cache.get(AUTH_EPOCH_KEY, 1)
+    return epoch
+
+
+def invalidate_cached_tokens():
+    """Discards the cached tokens of all the processes sharing the cache backend"""
+    CachedTokenAuthentication.token_cache.clear()
+    try:
+        cache.incr(AUTH_EPOCH_KEY)
+    except ValueError:
+        cache.add(AUTH_EPOCH_KEY, int(time.time()), timeout=None)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication resolving the tokens from an in-process LRU+TTL cache before the database.
+    The cache is configured by AUTH_TOKEN_CACHE_SIZE (entries) and AUTH_TOKEN_CACHE_TTL (seconds).
+    Invalid tokens are not cached: they always reach the database.
+    """
+    token_cache = TokenCache(
+        max_size=getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 10000),
+        ttl=getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 60))
+
+    def authenticate_credentials(self, key):
+        epoch = auth_epoch()
+        cached = self.token_cache.get(key, epoch)
+        TOKEN_CACHE_LOOKUPS.inc(result='miss' if cached is None else 'hit')
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            self.token_cache.set(key, cached, epoch)
+        user, token = cached
+        # Each request gets its own user instance: the cached one is shared by the threads
+        return copy.copy(user), token
+
+
+# These receivers revoke the cached tokens when a token deletion or a user change is committed: revoked
+# before, a concurrent request could cache the token again from the rows not yet changed
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, using='default', **kwargs):
+    transaction.on_commit(invalidate_cached_tokens, using=using)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, created=False, update_fields=None, using='default', **kwargs):
+    # New users have no cached token, and logins only update last_login
+    if created or (update_fields is not None and set(update_fields) == {'last_login'}):
+        return
+    transaction.on_commit(invalidate_cached_tokens, using=using)
@@ -0,0 +1,99 @@
+"""PostgreSQL database backend with a process-wide connection pool
+
+Selected with ENGINE 'store_api.backends.postgresql_pool' (see DATABASE_POOL_SIZE in the settings).
+Django opens a connection per thread and closes it at the end of the requests (CONN_MAX_AGE 0) or when it
+gets older than CONN_MAX_AGE. With this backend, closing returns the connection to a pool shared by the
+threads of the process, and opening takes one from the pool, so the connections are not established per
+request and the number of connections of the process is bounded.
+
+OPTIONS:
+    pool_min_size: Connections opened with the pool (default 1)
+    pool_max_size: Maximum connections of the process (default 10)
+    pool_timeout: Seconds to wait for a free connection before failing (default 10)
+"""
+import threading
+
+from django.db.backends.postgresql import base
+from psycopg2 import pool
+
+Database = base.Database
+
+POOL_OPTIONS = ('pool_min_size', 'pool_max_size', 'pool_timeout')
+
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """
+    Class responsible to wait for a free connection when all of them are in use,
+    instead of failing immediately as ThreadedConnectionPool does
+    """
+
+    def __init__(self, minconn, maxconn, timeout, *args, **kwargs):
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise Database.OperationalError(
+                f'No database connection available in the pool after {self.timeout} seconds')
+        try:
+            connection = super().getconn(key)
+            if connection.closed:
+                # Closed by the server while idle in the pool: replace it
+                super().putconn(connection, close=True)
+                connection = super().getconn(key)
+            return connection
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            # The pool rolls back the connections returned inside a transaction
+            super().putconn(conn, key, close=close or conn.closed)
+        finally:
+            self.slots.release()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        for option in POOL_OPTIONS:
+            conn_params.pop(option, None)
+        return conn_params
+
+    @property
+    def pool(self):
+        """The connection pool of this database alias in the process, created on the first use"""
+        with _pools_lock:
+            connection_pool = _pools.get(self.alias)
+            if connection_pool is None:
+                options = self.settings_dict['OPTIONS']
+                connection_pool = BlockingConnectionPool(
+                    int(options.get('pool_min_size', 1)), int(options.get('pool_max_size', 10)),
+                    float(options.get('pool_timeout', 10)), **self.get_connection_params())
+                _pools[self.alias] = connection_pool
+            return connection_pool
+
+    def get_new_connection(self, conn_params):
+        connection = self.pool.getconn()
+        # The same session setup of the regular backend
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,218 @@
+"""Query-count and latency benchmarks of the store_api routes
+
+Every route of store_api/urls.py is requested through the test client over a synthetic dataset, recording
+the number of queries of the first (cold cache) request, the p50/p95 latency and the payload bytes.
+Used by `manage.py benchmark_routes` (baseline and regressions) and by the tests (the query counts
+must not grow with the data).
+
+The routes are requested as real clients do: token authenticated (the metrics with a bearer token set as
+METRICS_TOKEN during the run), with the throttles disabled.
+"""
+import itertools
+import random
+import statistics
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.reverse import reverse
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from .authentication import CachedTokenAuthentication
+from .caching import bump_catalog_version
+from .models import Order, OrderItem, Product, User
+from .search import get_search_backend
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+BENCHMARK_DOMAIN = 'benchmark.invalid'
+BENCHMARK_METRICS_TOKEN = 'benchmark-metrics-token'
+
+# The route of a url name of store_api/urls.py: the method, the client (anon, scraper, owner or staff),
+# and functions of the probe objects and the iteration returning the url kwargs and the request data
+Route = namedtuple('Route', ('name', 'method', 'client', 'kwargs', 'data'))
+
+
+def no_kwargs(probe, iteration):
+    return {}
+
+
+no_data = no_kwargs
+
+ROUTES = (
+    Route('register', 'post', 'anon', no_kwargs, lambda probe, iteration: {
+        'email': f'register{next(probe.registered)}.{probe.key}@{BENCHMARK_DOMAIN}', 'password': BENCHMARK_PASSWORD,
+        'password_confirmation': BENCHMARK_PASSWORD}),
+    Route('get_token', 'post', 'anon', no_kwargs, lambda probe, iteration: {
+        'username': probe.user.email, 'password': BENCHMARK_PASSWORD}),
+    Route('health', 'get', 'anon', no_kwargs, no_data),
+    Route('metrics', 'get', 'scraper', no_kwargs, no_data),
+    Route('users', 'get', 'staff', no_kwargs, no_data),
+    Route('user', 'get', 'owner', lambda probe, iteration: {'pk': probe.user.pk}, no_data),
+    Route('user_orders', 'get', 'owner', lambda probe, iteration: {'pk': probe.user.pk}, no_data),
+    Route('user_sales', 'get', 'owner', lambda probe, iteration: {'pk': probe.user.pk}, no_data),
+    Route('orders', 'get', 'staff', no_kwargs, no_data),
+    Route('orders_create', 'post', 'staff', no_kwargs, lambda probe, iteration: {
+        'user': probe.user.pk, 'items': [{'product': product.pk, 'quantity': 2} for product in probe.products]}),
+    Route('orders_bulk_create', 'post', 'owner', no_kwargs, lambda probe, iteration: [
+        {'user': probe.user.pk, 'items': [{'product': product.pk} for product in probe.products]}
+        for _ in range(5)]),
+    Route('orders_export', 'get', 'staff', no_kwargs, no_data),
+    Route('orders_daily_sales', 'get', 'staff', no_kwargs, no_data),
+    Route('order', 'get', 'owner', lambda probe, iteration: {'pk': probe.order.pk}, no_data),
+    Route('order_items', 'get', 'staff', no_kwargs, no_data),
+    Route('order_item', 'get', 'owner', lambda probe, iteration: {'pk': probe.item.pk}, no_data),
+    Route('products', 'get', 'owner', no_kwargs, no_data),
+    Route('products_create', 'post', 'staff', no_kwargs, lambda probe, iteration: {
+        'name': f'benchmark product {iteration}', 'description': 'benchmark', 'price': '12.50'}),
+    Route('product', 'get', 'owner', lambda probe, iteration: {'pk': probe.products[0].pk}, no_data),
+    Route('high_orders', 'get', 'owner', no_kwargs, no_data),
+    Route('products_top', 'get', 'staff', no_kwargs, no_data),
+    Route('product_search', 'get', 'anon', lambda probe, iteration: {'payload': 'benchmark'}, no_data),
+)
+
+
+class Probe:
+    """
+    Class responsible to create the objects the routes are requested for (the owner and its order,
+    a staff user, products), along with the synthetic dataset
+    """
+
+    def __init__(self, key='probe'):
+        self.key = key
+        # Numbers the users registered by the benchmark, which must have distinct emails
+        self.registered = itertools.count()
+        self.user = User.objects.create_user(email=f'owner.{key}@{BENCHMARK_DOMAIN}', password=BENCHMARK_PASSWORD)
+        self.staff = User.objects.create_user(email=f'staff.{key}@{BENCHMARK_DOMAIN}', password=BENCHMARK_PASSWORD,
+                                              is_staff=True)
+        self.products = [Product.objects.create(name=f'benchmark probe {number}', description='benchmark',
+                                                price=Decimal('60.00')) for number in range(3)]
+        self.order = Order.objects.create(user=self.user)
+        self.item = OrderItem.objects.create(order=self.order, product=self.products[0], quantity=2)
+        for product in self.products[1:]:
+            OrderItem.objects.create(order=self.order, product=product)
+
+    def client(self, kind):
+        client = APIClient()
+        if kind == 'scraper':
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {BENCHMARK_METRICS_TOKEN}')
+        elif kind != 'anon':
+            user = self.staff if kind == 'staff' else self.user
+            client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=user).key}')
+        return client
+
+
+def seed_dataset(users, products, orders, items_per_order, seed=0, owner=None, key='data'):
+    """
+    Inserts a synthetic dataset with bulk_create: users (with tokens), products, and orders of random users
+    with distinct random products
+
+    :param owner: Optional user receiving a share of the orders, as the other users
+    :param key: Distinguishes the emails of the datasets inserted in the same database
+    """
+    rng = random.Random(seed)
+    password = make_password(BENCHMARK_PASSWORD)
+    User.objects.bulk_create(User(email=f'user{number}.{key}@{BENCHMARK_DOMAIN}', password=password)
+                             for number in range(users))
+    created_users = list(User.objects.filter(email__endswith=f'.{key}@{BENCHMARK_DOMAIN}'))
+    Token.objects.bulk_create(Token(key=Token().generate_key(), user=user) for user in created_users)
+    Product.objects.bulk_create(
+        Product(name=f'benchmark {key} {number}', description=f'benchmark product {number}',
+                price=Decimal(rng.randint(100, 20000)) / 100)
+        for number in range(max(products, items_per_order)))
+    created_products = list(Product.objects.filter(name__startswith=f'benchmark {key} '))
+    buyers = created_users + ([owner] if owner is not None else [])
+    Order.objects.bulk_create_with_items([
+        (Order(user=rng.choice(buyers)), [OrderItem(product=product, quantity=rng.randint(1, 4))
+                                          for product in rng.sample(created_products, items_per_order)])
+        for _ in range(orders)])
+    # The products inserted in bulk are not indexed nor invalidate the cached catalog through the receivers
+    get_search_backend().rebuild()
+    bump_catalog_version()
+
+
+@contextmanager
+def throttles_disabled():
+    """Context manager disabling the default throttles, which would answer 429 to most of the requests"""
+    throttle_classes = APIView.throttle_classes
+    APIView.throttle_classes = ()
+    try:
+        yield
+    finally:
+        APIView.throttle_classes = throttle_classes
+
+
+def percentile(timings, fraction):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def benchmark_route(route, probe, iterations=1):
+    """
+    :return: The status, the queries of the first (cold cache) request, p50/p95 latency and payload bytes
+    """
+    client = probe.client(route.client)
+    cache.clear()
+    CachedTokenAuthentication.token_cache.clear()
+    timings, queries, statuses, size = [], None, set(), 0
+    for iteration in range(iterations):
+        url = reverse(f'store_api:{route.name}', kwargs=route.kwargs(probe, iteration))
+        # The log keeps the last 9000 queries: a full log would not count the new ones
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = getattr(client, route.method)(url, data=route.data(probe, iteration), format='json')
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            timings.append((time.perf_counter() - started) * 1000)
+        if queries is None:
+            queries = len(captured.captured_queries)
+        statuses.add(response.status_code)
+        size = len(content)
+    return {
+        'method': route.method.upper(),
+        'status': sorted(statuses),
+        'queries': queries,
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'bytes': size,
+    }
+
+
+def benchmark_routes(probe, iterations=1, routes=ROUTES):
+    """
+    :return: The results of benchmark_route by url name
+    """
+    with throttles_disabled(), override_settings(METRICS_TOKEN=BENCHMARK_METRICS_TOKEN):
+        return {route.name: benchmark_route(route, probe, iterations) for route in routes}
+
+
+def query_growth(small, large):
+    """
+    :return: The routes whose query count is higher over the large dataset, with both counts
+    """
+    return {name: (small[name]['queries'], result['queries']) for name, result in large.items()
+            if name in small and result['queries'] > small[name]['queries']}
+
+
+def regressions(results, baseline, threshold=1.5, slack_ms=2.0):
+    """
+    :param threshold: Ratio of the baseline p95 latency above which a route regressed
+    :param slack_ms: Milliseconds always tolerated above the threshold (timer noise of the fast routes)
+    :return: Descriptions of the routes with more queries or slower than in the baseline
+    """
+    found = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            found.append(f"{name}: {result['queries']} queries (baseline {expected['queries']})")
+        if result['p95_ms'] > expected['p95_ms'] * threshold + slack_ms:
+            found.append(f"{name}: p95 {result['p95_ms']:.2f}ms (baseline {expected['p95_ms']:.2f}ms)")
+    return found
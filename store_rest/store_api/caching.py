@@ -0,0 +1,138 @@
+"""Read-through cache of the product catalog responses
+
+The serialized product pages and details are stored in the default cache (see CACHES in the settings)
+under keys containing the catalog version. The version is a counter in the cache, bumped by every committed
+Product save or delete, so a change invalidates all the cached catalog responses at once, in every process
+sharing the cache backend.
+
+The cached responses carry an ETag (derived from the catalog version and the request) and a Last-Modified
+header, so clients revalidating with If-None-Match/If-Modified-Since get a 304 without the payload.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .metrics import CATALOG_CACHE_LOOKUPS
+from .models import Product
+from .routers import use_primary, written_recently
+
+CATALOG_VERSION_KEY = 'store_api:catalog:version'
+CATALOG_CHANGED_KEY = 'store_api:catalog:changed'
+
+
+def catalog_version():
+    """
+    :return: The current catalog version, starting it when not in the cache
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidates all the cached catalog responses"""
+    cache.set(CATALOG_CHANGED_KEY, timezone.now(), timeout=None)
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # Not in the cache (evicted or never read): any new version invalidates the previous keys
+        cache.add(CATALOG_VERSION_KEY, int(timezone.now().timestamp()), timeout=None)
+
+
+# These receivers invalidate the cached catalog when a product change is committed: bumped before,
+# a concurrent request could cache the previous rows under the new version
+@receiver(post_save, sender=Product)
+def product_saved(sender, using='default', **kwargs):
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, using='default', **kwargs):
+    transaction.on_commit(bump_catalog_version, using=using)
+
+
+class CatalogCacheMixin:
+    """
+    Viewset mixin caching the list and retrieve responses of the product catalog.
+
+    The handlers run after the authentication, permission and throttling checks, so the cache
+    does not bypass them. The time the catalog entries remain cached is CATALOG_CACHE_TIMEOUT seconds.
+    """
+    # The most recent `updated` of the products loaded by the handler, used as Last-Modified
+    last_modified = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            self.track_modified(page)
+        return page
+
+    def get_object(self):
+        obj = super().get_object()
+        self.track_modified([obj])
+        return obj
+
+    def track_modified(self, products):
+        for product in products:
+            # Model instances, or .values() rows (see ValuesSerializer)
+            updated = product['updated'] if isinstance(product, dict) else product.updated
+            if self.last_modified is None or updated > self.last_modified:
+                self.last_modified = updated
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        """
+        Returns the response from the cache, or from the handler (caching it).
+        Answers 304 Not Modified when the request validators match the cached response.
+        """
+        version = catalog_version()
+        # The representation depends on the URL (page, host) and on the negotiated media type
+        variant = f'{version}:{request.build_absolute_uri()}:{request.accepted_media_type}'
+        digest = hashlib.sha1(variant.encode()).hexdigest()
+        etag = quote_etag(digest)
+        key = f'store_api:catalog:response:{digest}'
+
+        entry = cache.get(key)
+        CATALOG_CACHE_LOOKUPS.inc(result='miss' if entry is None else 'hit')
+        if entry is None:
+            changed = cache.get(CATALOG_CHANGED_KEY)
+            # Filled from the primary database while the replicas may be missing the last product change
+            with use_primary(written_recently(changed)):
+                response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            last_modified = self.last_modified
+            if getattr(self, 'action', None) == 'list':
+                # Removed products do not change the `updated` of the listed ones
+                if changed is not None and (last_modified is None or changed > last_modified):
+                    last_modified = changed
+            entry = {'data': response.data, 'last_modified': last_modified}
+            cache.set(key, entry, timeout=getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+        else:
+            response = Response(entry['data'])
+
+        last_modified = entry['last_modified']
+        timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if not_modified is not None:
+            # An empty 304 response, not rendered by the DRF renderers
+            response = not_modified
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
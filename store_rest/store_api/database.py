@@ -0,0 +1,73 @@
+"""Database connection setup and health check
+
+The SQLite connections run the SQLITE_PRAGMAS of the settings when they are opened: the write-ahead log
+(journal_mode=wal) lets the reads run along with a write instead of waiting for it.
+
+The health check is public: the errors are logged, and only reported as the failed check.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.utils import Error
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection=None, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            # The in-memory databases (tests) have no write-ahead log
+            if name == 'journal_mode' and connection.is_in_memory_db():
+                continue
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def check_database(alias):
+    """
+    :param alias: The database alias
+    :return: The status of the database: ok, with the latency of a query in milliseconds, or not ok
+    """
+    started = time.perf_counter()
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+    except Error:
+        logger.exception('Health check of the database %s failed', alias)
+        return {'ok': False}
+    return {'ok': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+def check_cache():
+    """
+    :return: The status of the default cache, as check_database
+    """
+    started = time.perf_counter()
+    try:
+        cache.set('health_check', 1, 10)
+        ok = cache.get('health_check') == 1
+    except Exception:
+        # Each cache backend raises its own errors
+        logger.exception('Health check of the cache failed')
+        return {'ok': False}
+    if not ok:
+        logger.error('Health check of the cache failed: the cached value was not read back')
+        return {'ok': False}
+    return {'ok': True, 'latency_ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+def health():
+    """
+    :return: Whether all the databases and the cache are available, and the status of each one
+    """
+    checks = {f'database:{alias}': check_database(alias) for alias in connections}
+    checks['cache'] = check_cache()
+    return all(check['ok'] for check in checks.values()), checks
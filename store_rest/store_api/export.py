@@ -0,0 +1,176 @@
+"""Streaming export of the orders with their items, for reporting jobs
+
+The orders and the order items are read with two iterators (server-side cursors where the database
+supports them), both ordered by order id, and merged while the rows are written. Only the items of the
+current order are kept in memory, so the memory used does not depend on the number of orders exported.
+"""
+import csv
+import datetime
+import logging
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .models import OrderItem
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+# The lookups of the range filters, by query parameter (or command option) name
+EXPORT_FILTERS = {
+    'created_after': 'created__gte',
+    'created_before': 'created__lt',
+    'updated_after': 'updated__gte',
+    'updated_before': 'updated__lt',
+}
+ORDER_FIELDS = ('id', 'user_id', 'created', 'updated', 'order_total', 'item_count')
+ITEM_FIELDS = ('id', 'order_id', 'product_id', 'product__name', 'product__price', 'quantity')
+CSV_COLUMNS = ('order_id', 'user_id', 'order_created', 'order_updated', 'order_total', 'item_count',
+               'item_id', 'product_id', 'product_name', 'price', 'quantity', 'item_total')
+
+
+def parse_export_filters(params):
+    """
+    Parses the range filters of an export. Dates are read as midnight in the current time zone.
+    Raises a ValueError if a value is not a date or a datetime.
+
+    :param params: Mapping with the filter values by name (see EXPORT_FILTERS), such as the query parameters
+    :return: The queryset lookups
+    """
+    lookups = {}
+    for name, lookup in EXPORT_FILTERS.items():
+        value = params.get(name)
+        if not value:
+            continue
+        moment = parse_datetime(value)
+        if moment is None:
+            date = parse_date(value)
+            if date is None:
+                raise ValueError(f'{name}: "{value}" is not a date or a datetime')
+            moment = datetime.datetime.combine(date, datetime.time())
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        lookups[lookup] = moment
+    return lookups
+
+
+def iter_orders(orders, chunk_size=2000):
+    """
+    Yields the orders of the queryset along with their items, as dictionaries
+
+    :param orders: The orders to be exported
+    :param chunk_size: Number of rows fetched per database round trip
+    :return: A generator of (order, items) pairs, ordered by order id
+    """
+    orders = orders.order_by('id')
+    order_rows = orders.values(*ORDER_FIELDS).iterator(chunk_size=chunk_size)
+    item_rows = OrderItem.objects.filter(order__in=orders.values('id')).order_by('order_id', 'id') \
+        .values(*ITEM_FIELDS).iterator(chunk_size=chunk_size)
+
+    item = next(item_rows, None)
+    for order in order_rows:
+        # Items of orders not read by the first cursor (created meanwhile) are skipped
+        while item is not None and item['order_id'] < order['id']:
+            item = next(item_rows, None)
+        items = []
+        while item is not None and item['order_id'] == order['id']:
+            item['item_total'] = item['product__price'] * item['quantity']
+            items.append(item)
+            item = next(item_rows, None)
+        yield order, items
+
+
+def ndjson_lines(orders):
+    """One JSON document per order, with its items nested"""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for order, items in orders:
+        document = {
+            'id': order['id'],
+            'user': order['user_id'],
+            'created': order['created'],
+            'updated': order['updated'],
+            'order_total': order['order_total'],
+            'item_count': order['item_count'],
+            'items': [{
+                'id': item['id'],
+                'product': item['product_id'],
+                'product_name': item['product__name'],
+                'price': item['product__price'],
+                'quantity': item['quantity'],
+                'item_total': item['item_total'],
+            } for item in items],
+        }
+        yield encoder.encode(document) + '\n'
+
+
+class Echo:
+    """File-like object returning what is written, so the csv writer produces the lines one by one"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(orders):
+    """One CSV row per order item. Orders without items have a row with the item columns empty"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for order, items in orders:
+        order_columns = [order['id'], order['user_id'], order['created'].isoformat(),
+                         order['updated'].isoformat(), order['order_total'], order['item_count']]
+        if not items:
+            yield writer.writerow(order_columns + [''] * 6)
+        for item in items:
+            yield writer.writerow(order_columns + [
+                item['id'], item['product_id'], item['product__name'], item['product__price'],
+                item['quantity'], item['item_total']])
+
+
+def export_orders(orders, output='ndjson', chunk_size=2000, stats=None):
+    """
+    Streams the orders with their items in the output format, logging the throughput at the end
+
+    :param orders: The orders to be exported
+    :param output: One of EXPORT_FORMATS
+    :param chunk_size: Number of rows fetched per database round trip
+    :param stats: Optional dictionary filled with the orders, rows and seconds of the export when it ends
+    :return: A generator of text lines
+    """
+    counts = {'orders': 0, 'items': 0}
+
+    def counted():
+        for order, items in iter_orders(orders, chunk_size):
+            counts['orders'] += 1
+            counts['items'] += len(items)
+            yield order, items
+
+    lines = ndjson_lines(counted()) if output == 'ndjson' else csv_lines(counted())
+    started = time.perf_counter()
+    rows = 0
+    for line in lines:
+        rows += 1
+        yield line
+    elapsed = time.perf_counter() - started
+    rate = rows / elapsed if elapsed else 0.0
+    logger.info('Exported %d orders (%d items) as %s: %d rows in %.2fs (%.0f rows/s)',
+                counts['orders'], counts['items'], output, rows, elapsed, rate)
+    if stats is not None:
+        stats.update(counts, rows=rows, seconds=elapsed, rows_per_second=rate)
+
+
+class ExportContentNegotiation(BaseContentNegotiation):
+    """
+    The exports are streamed as they are, not rendered by the API renderers: the Accept header
+    of the reporting clients (e.g. text/csv) is not negotiated
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
@@ -0,0 +1,154 @@
+"""Per-request SQL and timing instrumentation
+
+InstrumentationMiddleware measures a sample of the requests (INSTRUMENTATION_SAMPLE_RATE): the number of
+queries and the database time (recorded by a connection.execute_wrapper, on every database of the request
+thread) and the total time. InstrumentedViewMixin adds the time of the DRF views:
+    - serialize: the handler time outside the database (mostly the serialization of the responses);
+    - render: the rendering of the response by the DRF renderer.
+
+The measures are sent as a Server-Timing response header (shown by the browsers developer tools) and logged
+as a logfmt line on the store_api.instrumentation logger. SQL executed INSTRUMENTATION_DUPLICATE_QUERIES times
+or more in a request (e.g. a query per row, N+1) is logged as a warning.
+
+The requests not sampled only cost a random number. The queries of streamed responses (e.g. the orders
+export) run after the middleware returns and are not counted.
+"""
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+# The metrics of the request being measured, None when it is not sampled
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Class responsible to collect the measures of a request. It is the execute wrapper of the connections
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        # Executions by SQL (with the parameters placeholders: a query per row repeats the same SQL)
+        self.statements = Counter()
+        # Seconds by Server-Timing metric name, besides db and total
+        self.timings = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    @contextmanager
+    def timed(self, name):
+        """Adds the time of the block to the metric name"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def duplicates(self, threshold):
+        """
+        :return: The SQL executed at least threshold times, with the number of executions
+        """
+        return {sql: count for sql, count in self.statements.items() if count >= threshold}
+
+    def server_timing(self, total):
+        metrics = [f'db;dur={self.db_seconds * 1000:.2f};desc="{self.queries} queries"']
+        metrics += [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.timings.items()]
+        metrics.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def wrapped_connections(metrics):
+    """Installs the metrics as the execute wrapper of the connections of every database in the block"""
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(metrics))
+        yield
+
+
+class InstrumentationMiddleware:
+    """
+    Middleware measuring a sample of the requests (see the module documentation).
+    It is the first middleware, so the total time includes the other ones.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 0.0):
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with wrapped_connections(metrics):
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+        total = time.perf_counter() - metrics.started
+
+        response['Server-Timing'] = metrics.server_timing(total)
+        route = request.resolver_match.view_name if request.resolver_match is not None else '-'
+        fields = {
+            'method': request.method, 'path': request.path, 'route': route, 'status': response.status_code,
+            'total_ms': f'{total * 1000:.2f}', 'db_ms': f'{metrics.db_seconds * 1000:.2f}',
+            'queries': metrics.queries,
+            **{f'{name}_ms': f'{seconds * 1000:.2f}' for name, seconds in metrics.timings.items()},
+        }
+        duplicates = metrics.duplicates(getattr(settings, 'INSTRUMENTATION_DUPLICATE_QUERIES', 5))
+        fields['duplicated_queries'] = len(duplicates)
+        logger.info(' '.join(f'{name}={value}' for name, value in fields.items()))
+        for sql, count in duplicates.items():
+            logger.warning('Duplicated query (N+1?) on %s %s, executed %d times: %s',
+                           request.method, request.path, count, sql)
+        return response
+
+
+class InstrumentedViewMixin:
+    """
+    DRF view mixin measuring the serialization and rendering time of the requests measured by
+    InstrumentationMiddleware
+    """
+    # The handler start time and the database time at that moment, when measured
+    instrumentation_started = None
+
+    def initial(self, request, *args, **kwargs):
+        # The authentication, permissions and throttling checks run first: they are not part of the handler
+        super().initial(request, *args, **kwargs)
+        metrics = current_metrics.get()
+        if metrics is not None:
+            self.instrumentation_started = (time.perf_counter(), metrics.db_seconds)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        metrics = current_metrics.get()
+        if metrics is None:
+            return response
+        if self.instrumentation_started is not None:
+            started, db_seconds = self.instrumentation_started
+            metrics.timings['serialize'] = max(
+                0.0, time.perf_counter() - started - (metrics.db_seconds - db_seconds))
+        if isinstance(response, Response):
+            # Rendered here, rather than by the handler afterwards, to be measured
+            with metrics.timed('render'):
+                response.render()
+        return response
@@ -0,0 +1,151 @@
+import asyncio
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from store_api.asgi import CatalogASGIHandler
+from store_api.benchmarks import throttles_disabled
+from store_api.models import Product, User
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to benchmark the catalog reads under the WSGI and the ASGI handlers, at high concurrency
+
+    The handlers are called in process, without a server or the network, so the numbers compare how each
+    handler runs concurrent requests:
+        - wsgi: a threaded WSGI server, one thread per concurrent client;
+        - asgi: Django's ASGIHandler, one event loop (the views run in the loop's default executor);
+        - asgi-catalog: CatalogASGIHandler, the catalog reads run in its own thread pool (see store_api.asgi).
+
+    The requests are authenticated with the token of --email, or of a temporary user removed at the end.
+    The throttles are disabled during the run: they would answer 429 to most of the requests.
+    """
+    help = 'Benchmark the throughput and latency of the catalog reads under WSGI and ASGI'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Number of requests per handler')
+        parser.add_argument('--concurrency', type=int, default=64, help='Number of concurrent clients')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path requested (repeatable). Defaults to the catalog endpoints')
+        parser.add_argument('--email', help='User whose token authenticates the requests')
+        parser.add_argument('--handler', action='append', dest='handlers',
+                            choices=('wsgi', 'asgi', 'asgi-catalog'), help='Handler benchmarked (repeatable)')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive numbers')
+        paths = options['paths'] or self.default_paths()
+        handlers = options['handlers'] or ['wsgi', 'asgi', 'asgi-catalog']
+
+        temporary = None
+        if options['email']:
+            user = User.objects.filter(email=options['email']).first()
+            if user is None:
+                raise CommandError(f"User {options['email']} does not exist")
+        else:
+            temporary = user = User.objects.create_user(email='benchmark-catalog@store.invalid',
+                                                        password=None)
+        token, _ = Token.objects.get_or_create(user=user)
+        host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*', '') and host[0] != '.'),
+                    'localhost')
+        self.headers = {'HTTP_AUTHORIZATION': f'Token {token.key}', 'HTTP_HOST': host}
+
+        try:
+            requests = [paths[number % len(paths)] for number in range(options['requests'])]
+            self.stdout.write(f"{options['requests']} requests to {', '.join(paths)} "
+                              f"with {options['concurrency']} concurrent clients")
+            for name in handlers:
+                run = self.run_wsgi if name == 'wsgi' else self.run_asgi
+                handler = {'wsgi': WSGIHandler, 'asgi': ASGIHandler, 'asgi-catalog': CatalogASGIHandler}[name]()
+                # Untimed requests: the connections, caches and lazy setup are warm for every handler
+                with throttles_disabled():
+                    run(handler, paths, min(options['concurrency'], len(paths)))
+                    started = time.perf_counter()
+                    results = run(handler, requests, options['concurrency'])
+                self.report(name, results, time.perf_counter() - started)
+        finally:
+            if temporary is not None:
+                temporary.delete()
+
+    @staticmethod
+    def default_paths():
+        paths = ['/products/', '/products/high_orders', '/products/search/a']
+        product = Product.objects.order_by('pk').first()
+        if product is not None:
+            paths.append(f'/product/{product.pk}')
+        return paths
+
+    def wsgi_request(self, handler, path):
+        environ = {
+            'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(),
+            'wsgi.errors': self.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False, **self.headers,
+        }
+        statuses = []
+        started = time.perf_counter()
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return int(statuses[0].split()[0]), time.perf_counter() - started
+
+    def run_wsgi(self, handler, requests, concurrency):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(lambda path: self.wsgi_request(handler, path), requests))
+
+    async def asgi_request(self, handler, path):
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+            'scheme': 'http', 'server': ('localhost', 80), 'client': ('127.0.0.1', 0),
+            'headers': [(name[5:].lower().replace('_', '-').encode(), value.encode())
+                        for name, value in self.headers.items()],
+        }
+        statuses = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        started = time.perf_counter()
+        await handler(scope, receive, send)
+        return statuses[0], time.perf_counter() - started
+
+    def run_asgi(self, handler, requests, concurrency):
+        async def client(queue, results):
+            while queue:
+                results.append(await self.asgi_request(handler, queue.pop()))
+
+        async def main():
+            queue, results = list(requests), []
+            await asyncio.gather(*(client(queue, results) for _ in range(concurrency)))
+            return results
+
+        return asyncio.run(main())
+
+    def report(self, name, results, elapsed):
+        statuses = Counter(status for status, _ in results)
+        timings = sorted(seconds * 1000 for _, seconds in results)
+
+        def percentile(fraction):
+            return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+        self.stdout.write(
+            f'{name}: {len(results) / elapsed:.0f} requests/s, mean {statistics.mean(timings):.2f}ms, '
+            f'p50 {percentile(0.5):.2f}ms, p95 {percentile(0.95):.2f}ms, p99 {percentile(0.99):.2f}ms '
+            f"(statuses: {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))})")
@@ -0,0 +1,79 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from store_api.models import Order, OrderItem, Product, User
+from store_api.renderers import FastJSONParser, FastJSONRenderer, orjson
+from store_api.serializers import OrderSerializer
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to benchmark the JSON rendering and parsing of large order payloads,
+    DRF's JSONRenderer/JSONParser against FastJSONRenderer/FastJSONParser (orjson when installed)
+
+    The payload is the OrderSerializer data of synthetic orders. They are inserted in a transaction
+    rolled back at the end, so the database is left as it was.
+    """
+    help = 'Benchmark the JSON renderers and parsers over a large OrderSerializer payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=2000, help='Number of orders in the payload')
+        parser.add_argument('--items', type=int, default=5, help='Number of items per order')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of times each payload is rendered')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+
+    def handle(self, *args, **options):
+        if min(options['orders'], options['items'], options['repeat']) < 1:
+            raise CommandError('--orders, --items and --repeat must be positive numbers')
+        data = self.payload(random.Random(options['seed']), options['orders'], options['items'])
+        self.stdout.write(f"Payload: {options['orders']} orders with {options['items']} items "
+                          f"(orjson {'installed' if orjson is not None else 'not installed: DRF fallback'})")
+
+        body = JSONRenderer().render(data)
+        if FastJSONRenderer().render(data) != body:
+            raise CommandError('The renderers output differ')
+        for name, renderer, parser in (('DRF JSONRenderer/JSONParser', JSONRenderer(), JSONParser()),
+                                       ('FastJSONRenderer/FastJSONParser', FastJSONRenderer(), FastJSONParser())):
+            render = self.measure(lambda: renderer.render(data), options['repeat'])
+            parse = self.measure(lambda: parser.parse(BytesIO(body), parser_context={}), options['repeat'])
+            self.stdout.write(f'{name}: render {self.rate(render, len(body))}, parse {self.rate(parse, len(body))}')
+
+    def payload(self, rng, total_orders, items_per_order):
+        with transaction.atomic():
+            user = User.objects.create_user(email='benchmark-json@store.invalid', password=None)
+            products = Product.objects.bulk_create(
+                Product(name=f'product {number} é', description='benchmark',
+                        price=Decimal(rng.randint(100, 99999)) / 100)
+                for number in range(max(items_per_order, 50)))
+            if products[0].pk is None:
+                # The database does not return the inserted primary keys
+                products = list(Product.objects.filter(description='benchmark', name__startswith='product '))
+            Order.objects.bulk_create_with_items([
+                (Order(user=user), [OrderItem(product=product, quantity=rng.randint(1, 5))
+                                    for product in rng.sample(products, items_per_order)])
+                for _ in range(total_orders)])
+            data = OrderSerializer(Order.objects.filter(user=user).with_items(), many=True).data
+            transaction.set_rollback(True)
+        return data
+
+    @staticmethod
+    def measure(function, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    @staticmethod
+    def rate(timings, size):
+        median = statistics.median(timings)
+        return f'{median * 1000:.2f}ms ({size / median / 2 ** 20:.0f}MB/s)'
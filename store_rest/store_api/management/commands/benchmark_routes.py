@@ -0,0 +1,91 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from store_api.benchmarks import Probe, benchmark_routes, query_growth, regressions, seed_dataset
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to benchmark every store_api route over synthetic datasets (see store_api.benchmarks)
+
+    The routes are requested over a dataset, then again over a dataset --scale times larger. It fails when:
+        - the query count of a route grows with the data (e.g. queries per row);
+        - a route runs more queries than in the baseline, or its p95 latency regressed beyond --threshold.
+    The results over the larger dataset are the ones compared with (and written to) the JSON baseline.
+
+    Everything runs in a transaction rolled back at the end, so the database is left as it was.
+    """
+    help = 'Benchmark the query count, latency and payload size of every route against a JSON baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of users of the dataset')
+        parser.add_argument('--products', type=int, default=500, help='Number of products of the dataset')
+        parser.add_argument('--orders', type=int, default=1000, help='Number of orders of the dataset')
+        parser.add_argument('--items', type=int, default=3, help='Number of items per order')
+        parser.add_argument('--scale', type=int, default=4, help='Size of the larger dataset, relative to the first')
+        parser.add_argument('--iterations', type=int, default=20, help='Number of requests per route')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmark_baseline.json'),
+                            help='JSON baseline file')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Write the results to the baseline instead of comparing them')
+        parser.add_argument('--threshold', type=float, default=1.5,
+                            help='Ratio of the baseline p95 latency above which a route regressed')
+
+    def handle(self, *args, **options):
+        sizes = {name: options[name] for name in ('users', 'products', 'orders', 'items')}
+        if min(sizes.values()) < 1 or options['scale'] < 2 or options['iterations'] < 1:
+            raise CommandError('The dataset sizes and --iterations must be positive numbers, --scale at least 2')
+
+        # The test client requests are served as in the tests (e.g. the testserver host is allowed)
+        setup_test_environment()
+        try:
+            with transaction.atomic():
+                probe = Probe()
+                seed_dataset(sizes['users'], sizes['products'], sizes['orders'], sizes['items'],
+                             seed=options['seed'], owner=probe.user, key='small')
+                small = benchmark_routes(probe, options['iterations'])
+                # The larger dataset adds (scale - 1) times the first one
+                extra = options['scale'] - 1
+                seed_dataset(sizes['users'] * extra, sizes['products'] * extra, sizes['orders'] * extra,
+                             sizes['items'], seed=options['seed'] + 1, owner=probe.user, key='large')
+                large = benchmark_routes(probe, options['iterations'])
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+
+        self.stdout.write(f"{'route':<20} {'method':<6} {'status':<8} {'queries':>7} {'p50 ms':>9} "
+                          f"{'p95 ms':>9} {'bytes':>9}")
+        for name, result in large.items():
+            self.stdout.write(
+                f"{name:<20} {result['method']:<6} {','.join(map(str, result['status'])):<8} "
+                f"{result['queries']:>7} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} {result['bytes']:>9}")
+
+        failures = [f'{name}: {small_queries} queries over the dataset, {large_queries} over the {options["scale"]}x '
+                    f'dataset' for name, (small_queries, large_queries) in query_growth(small, large).items()]
+        failures += [f'{name}: status {result["status"]}' for name, result in large.items()
+                     if any(code >= 400 for code in result['status'])]
+
+        if options['update_baseline']:
+            with open(options['baseline'], 'w') as baseline_file:
+                json.dump({'dataset': dict(sizes, scale=options['scale'], iterations=options['iterations']),
+                           'routes': large}, baseline_file, indent=2)
+                baseline_file.write('\n')
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+        elif os.path.exists(options['baseline']):
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline['dataset'] != dict(sizes, scale=options['scale'], iterations=options['iterations']):
+                self.stderr.write(f"The baseline was recorded with another dataset: {baseline['dataset']}")
+            failures += regressions(large, baseline['routes'], threshold=options['threshold'])
+        else:
+            self.stderr.write(f"No baseline at {options['baseline']}: use --update-baseline to record one")
+
+        if failures:
+            raise CommandError('Performance regressions:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS('No regressions'))
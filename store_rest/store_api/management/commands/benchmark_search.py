@@ -0,0 +1,91 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+
+from store_api.models import Product
+from store_api.search import DatabaseSearchBackend, get_search_backend
+
+SYLLABLES = ('ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'po', 'da', 'fi', 'gu', 'he', 'ju', 'be')
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to benchmark the product search backend against the `icontains` fallback.
+
+    Synthetic products are inserted with bulk_create (so the search index is rebuilt once, at the end),
+    then each query is run as the product_search endpoint does: the first page and the total count.
+    The products are inserted in the configured database: use a scratch database.
+    They are removed at the end, unless --keep is informed.
+    """
+    help = 'Benchmark the product search backend over synthetic products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000, help='Number of products to be inserted')
+        parser.add_argument('--queries', type=int, default=50, help='Number of queries per backend')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Products inserted per transaction')
+        parser.add_argument('--page-size', type=int, default=10, help='Products fetched per query')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+        parser.add_argument('--keep', action='store_true', help='Keep the inserted products')
+
+    def handle(self, *args, **options):
+        if options['products'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--products and --chunk-size must be positive numbers')
+        rng = random.Random(options['seed'])
+        vocabulary = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(5000)]
+        last_pk = Product.objects.aggregate(last=Max('pk'))['last'] or 0
+        backend = get_search_backend()
+
+        started = time.perf_counter()
+        self.insert_products(rng, vocabulary, options['products'], options['chunk_size'])
+        with transaction.atomic():
+            backend.rebuild()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Inserted and indexed {options['products']} products in {elapsed:.1f}s")
+
+        # Whole words and substrings of words, as typed by the users
+        queries = [rng.choice(vocabulary) for _ in range(options['queries'])]
+        queries = [query if index % 2 else query[1:] for index, query in enumerate(queries)]
+        try:
+            for name, search_backend in ((type(backend).__name__, backend),
+                                         ('icontains fallback', DatabaseSearchBackend())):
+                self.report(name, self.run_queries(search_backend, queries, options['page_size']))
+        finally:
+            if not options['keep']:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute('DELETE FROM store_api_product WHERE id > %s', [last_pk])
+                    backend.rebuild()
+
+    def insert_products(self, rng, vocabulary, total, chunk_size):
+        for start in range(0, total, chunk_size):
+            products = []
+            for number in range(start, min(start + chunk_size, total)):
+                name = ' '.join(rng.choice(vocabulary) for _ in range(3))
+                description = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(10, 40)))
+                products.append(Product(name=f'{name} {number}', description=description,
+                                        price=Decimal(rng.randint(100, 99999)) / 100))
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+
+    @staticmethod
+    def run_queries(backend, queries, page_size):
+        # Untimed query, so backends building their index lazily are measured warm
+        backend.search(Product.objects.all(), queries[0]).count()
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            result = backend.search(Product.objects.all(), query)
+            list(result[:page_size])
+            result.count()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+
+    def report(self, name, timings):
+        timings = sorted(timings)
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(f'{name}: mean {statistics.mean(timings):.2f}ms, '
+                          f'p50 {statistics.median(timings):.2f}ms, p95 {p95:.2f}ms')
@@ -0,0 +1,72 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from store_api.models import Order, OrderItem, Product, User
+from store_api.serializers import OrderSerializer, OrderValuesSerializer, ProductSerializer, ProductValuesSerializer
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to benchmark the listing serializers: the model serializers against the
+    serializers of .values() rows (see ValuesSerializer), reading and serializing the same rows
+
+    The CPU time is reported per 1000 rows. The rows are synthetic, inserted in a transaction
+    rolled back at the end, so the database is left as it was.
+    """
+    help = 'Benchmark the CPU time of the model serializers against the .values() serializers per 1k rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help='Number of products and of orders')
+        parser.add_argument('--items', type=int, default=3, help='Number of items per order')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of times each listing is serialized')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+
+    def handle(self, *args, **options):
+        if min(options['rows'], options['items'], options['repeat']) < 1:
+            raise CommandError('--rows, --items and --repeat must be positive numbers')
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            user = User.objects.create_user(email='benchmark-serializers@store.invalid', password=None)
+            Product.objects.bulk_create(
+                Product(name=f'benchmark {number}', description='benchmark serializers',
+                        price=Decimal(rng.randint(100, 99999)) / 100)
+                for number in range(max(options['rows'], options['items'])))
+            products = list(Product.objects.filter(description='benchmark serializers'))
+            Order.objects.bulk_create_with_items([
+                (Order(user=user), [OrderItem(product=product, quantity=rng.randint(1, 5))
+                                    for product in rng.sample(products, options['items'])])
+                for _ in range(options['rows'])])
+
+            listings = (
+                ('products', Product.objects.filter(description='benchmark serializers').order_by('created', 'id'),
+                 ProductSerializer, ProductValuesSerializer),
+                ('orders', Order.objects.filter(user=user).with_items().order_by('created', 'id'),
+                 OrderSerializer, OrderValuesSerializer),
+            )
+            for name, queryset, model_serializer, values_serializer in listings:
+                model_cpu = self.measure(lambda: model_serializer(queryset.all(), many=True).data, options['repeat'])
+                values_cpu = self.measure(
+                    lambda: values_serializer.serialize(values_serializer.rows(queryset.all())), options['repeat'])
+                per_rows = 1000 / options['rows']
+                self.stdout.write(
+                    f'{name}: {model_serializer.__name__} {model_cpu * per_rows * 1000:.1f}ms CPU per 1k rows, '
+                    f'{values_serializer.__name__} {values_cpu * per_rows * 1000:.1f}ms CPU per 1k rows '
+                    f'({(1 - values_cpu / model_cpu) * 100:.0f}% saved)')
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def measure(function, repeat):
+        """
+        :return: The median CPU seconds (of this process: the database time of in-process databases included)
+        """
+        timings = []
+        for _ in range(repeat):
+            started = time.process_time()
+            function()
+            timings.append(time.process_time() - started)
+        return statistics.median(timings)
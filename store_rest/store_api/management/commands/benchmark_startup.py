@@ -0,0 +1,96 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a new interpreter: imports the application and sends it two requests, timing each step
+STARTUP_SCRIPT = '''
+import asyncio, io, json, sys, time
+started = time.perf_counter()
+import importlib
+application = importlib.import_module(sys.argv[1]).application
+imported = time.perf_counter()
+host = sys.argv[2]
+
+def wsgi_request():
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': '/health/', 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': host,
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+    }
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(response)
+    response.close()
+    return int(statuses[0].split()[0])
+
+def asgi_request():
+    scope = {'type': 'http', 'method': 'GET', 'path': '/health/', 'query_string': b'', 'root_path': '',
+             'scheme': 'http', 'server': (host, 80), 'client': ('127.0.0.1', 0), 'headers': [(b'host', host.encode())]}
+    statuses = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            statuses.append(message['status'])
+
+    asyncio.run(application(scope, receive, send))
+    return statuses[0]
+
+request = asgi_request if sys.argv[1].endswith('asgi') else wsgi_request
+status = request()
+first = time.perf_counter()
+request()
+second = time.perf_counter()
+print(json.dumps({'status': status, 'import': imported - started, 'first': first - imported, 'warm': second - first}))
+'''
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to benchmark the startup of the application, as a server worker starts it
+
+    Each run is a new interpreter (a worker without preload_app) that imports the WSGI or ASGI application
+    and sends it two requests to the health endpoint. The report has the time to import the application
+    (what preload_app saves to each worker), the time of the first request (lazy setup: connections,
+    caches, URL resolvers) and the time of a warm request.
+    """
+    help = 'Benchmark the startup time of the WSGI and ASGI applications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=10, help='Number of interpreters started per application')
+        parser.add_argument('--application', action='append', dest='applications', choices=('wsgi', 'asgi'),
+                            help='Application benchmarked (repeatable). Defaults to both')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be a positive number')
+        host = next((host for host in settings.ALLOWED_HOSTS if host not in ('*', '') and host[0] != '.'),
+                    'localhost')
+        settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'store_rest.settings')
+        environment = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+        for name in options['applications'] or ['wsgi', 'asgi']:
+            runs = []
+            for _ in range(options['runs']):
+                process = subprocess.run(
+                    [sys.executable, '-c', STARTUP_SCRIPT, f'store_rest.{name}', host], cwd=settings.BASE_DIR,
+                    env=environment, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                if process.returncode:
+                    raise CommandError(f'The {name} application failed to start:\n{process.stderr}')
+                runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+            statuses = sorted({run['status'] for run in runs})
+            self.stdout.write(f"{name} ({options['runs']} runs, health status {', '.join(map(str, statuses))}): "
+                              + ', '.join(self.summary(step, [run[step] for run in runs])
+                                          for step in ('import', 'first', 'warm')))
+
+    @staticmethod
+    def summary(step, seconds):
+        timings = [value * 1000 for value in seconds]
+        return f'{step} mean {statistics.mean(timings):.1f}ms (min {min(timings):.1f}ms, max {max(timings):.1f}ms)'
@@ -0,0 +1,73 @@
+import pickle
+import time
+import uuid
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+from rest_framework.views import APIView
+
+from store_api.models import User
+from store_api.throttling import SlidingWindowAnonThrottle, SlidingWindowMixin, SlidingWindowUserThrottle
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to benchmark the overhead of the throttles: DRF's AnonRateThrottle/UserRateThrottle
+    (request history lists) against the sliding window throttles of store_api.throttling (counters)
+
+    The throttles are called directly, for --requests requests spread over --clients clients, against the
+    cache --cache. The keys are prefixed with a random run identifier, and expire with the rate duration.
+    """
+    help = 'Benchmark the time per request and the cache size per client of the throttles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50000, help='Number of requests per throttle')
+        parser.add_argument('--clients', type=int, default=100, help='Number of distinct clients')
+        parser.add_argument('--rate', default='500/minute', help='Rate of the throttles')
+        parser.add_argument('--cache', default=DEFAULT_CACHE_ALIAS, help='The cache alias keeping the throttles')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['clients'] < 1:
+            raise CommandError('--requests and --clients must be positive numbers')
+        run = uuid.uuid4().hex[:8]
+        factory = APIRequestFactory()
+        view = APIView()
+        self.stdout.write(f"{options['requests']} requests from {options['clients']} clients at {options['rate']}")
+
+        for kind, throttle_classes in (('anon', (AnonRateThrottle, SlidingWindowAnonThrottle)),
+                                       ('user', (UserRateThrottle, SlidingWindowUserThrottle))):
+            requests = []
+            for number in range(options['clients']):
+                request = Request(factory.get('/', REMOTE_ADDR=f'10.0.{number // 256}.{number % 256}'))
+                request.user = AnonymousUser() if kind == 'anon' else User(pk=number + 1)
+                requests.append(request)
+            for throttle_class in throttle_classes:
+                throttle_class = type(throttle_class.__name__, (throttle_class,), {
+                    'cache': caches[options['cache']], 'rate': options['rate'],
+                    'cache_format': f'benchmark_{run}_{throttle_class.__name__}_%(ident)s'})
+                self.report(throttle_class, requests, options['requests'], view)
+
+    def report(self, throttle_class, requests, total, view):
+        allowed = 0
+        started = time.perf_counter()
+        for number in range(total):
+            # A new instance per request, as DRF does
+            allowed += throttle_class().allow_request(requests[number % len(requests)], view)
+        elapsed = time.perf_counter() - started
+
+        # The cache entries of the first client: the history list, or the window counters
+        throttle = throttle_class()
+        key = throttle.get_cache_key(requests[0], view)
+        if isinstance(throttle, SlidingWindowMixin):
+            window = int(throttle.timer() // throttle.duration)
+            entries = throttle.cache.get_many([f'{key}:{window - 1}', f'{key}:{window}'])
+        else:
+            entries = throttle.cache.get_many([key])
+        size = sum(len(pickle.dumps(value)) for value in entries.values())
+        self.stdout.write(
+            f'{throttle_class.__name__}: {elapsed / total * 1e6:.1f}us per request, '
+            f'{allowed} allowed, {total - allowed} throttled, {size} bytes cached per client')
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store_api.export import EXPORT_FILTERS, EXPORT_FORMATS, export_orders, parse_export_filters
+from store_api.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to export the orders with their items (the same output of the orders/export endpoint)
+
+    The rows are streamed to the output file (or to the standard output), so the command runs with constant
+    memory over large tables. The throughput is reported at the end.
+    """
+    help = 'Export the orders with their items as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=tuple(EXPORT_FORMATS), default='ndjson', help='Output format')
+        parser.add_argument('--file', help='File to write the export to. Defaults to the standard output')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of rows fetched per database round trip')
+        for name in EXPORT_FILTERS:
+            parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help='Date or datetime')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be a positive number')
+        try:
+            lookups = parse_export_filters(options)
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        stats = {}
+        lines = export_orders(Order.objects.filter(**lookups), options['output'],
+                              chunk_size=options['chunk_size'], stats=stats)
+        if options['file']:
+            with open(options['file'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
+
+        # The report goes to stderr, so it is not mixed with the exported rows
+        self.stderr.write(
+            f"Exported {stats['orders']} orders ({stats['items']} items): {stats['rows']} rows "
+            f"in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s)",
+            style_func=self.style.SUCCESS)
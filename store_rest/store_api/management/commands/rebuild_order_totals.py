@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from store_api.models import Order
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to verify and rebuild the denormalized order totals (order_total and item_count)
+
+    The orders are processed in primary key ranges, each range in its own transaction,
+    so the command can run against large tables without locking all the orders at once.
+    """
+    help = 'Verify or rebuild the stored order totals from the order items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report the orders with stale totals. Fails if any is found.')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of orders (by primary key range) processed per transaction')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be a positive number')
+
+        bounds = Order.objects.aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['first'] is None:
+            self.stdout.write('No orders found')
+            return
+
+        stale = 0
+        refreshed = 0
+        for start in range(bounds['first'], bounds['last'] + 1, chunk_size):
+            orders = Order.objects.filter(pk__gte=start, pk__lt=start + chunk_size)
+            if options['verify']:
+                for order in orders.stale_totals().values('pk', 'order_total', 'total_difference'):
+                    stale += 1
+                    self.stdout.write(
+                        f"Order {order['pk']}: stored total {order['order_total']} "
+                        f"differs by {order['total_difference']}")
+            else:
+                with transaction.atomic():
+                    refreshed += orders.refresh_totals()
+
+        if options['verify']:
+            if stale:
+                raise CommandError(f'{stale} order(s) with stale totals')
+            self.stdout.write(self.style.SUCCESS('All order totals are consistent'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{refreshed} order total(s) rebuilt'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from store_api.rollups import refresh_rollups, stale_rollups
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to verify and rebuild the sales rollups (product, user and daily sales)
+    from the order items.
+
+    The rollups are rebuilt in a single transaction: readers see either the previous or the rebuilt rows.
+    """
+    help = 'Verify or rebuild the sales rollups from the order items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only report the stale rollup rows. Fails if any is found.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database to be rebuilt')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            stale = stale_rollups(options['database'])
+            for model_name, key in stale:
+                self.stdout.write(f'{model_name} {key}: differs from the order items')
+            if stale:
+                raise CommandError(f'{len(stale)} stale rollup row(s)')
+            self.stdout.write(self.style.SUCCESS('All the rollups are consistent'))
+        else:
+            written = refresh_rollups(options['database'])
+            self.stdout.write(self.style.SUCCESS(f'{written} rollup row(s) rebuilt'))
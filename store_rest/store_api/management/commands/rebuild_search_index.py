@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from store_api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to rebuild the product search index of the configured search backend.
+    Needed after products are written bypassing the model signals (bulk_create, queryset update or raw SQL).
+    """
+    help = 'Rebuild the product search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database to rebuild the index in')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with transaction.atomic(using=options['database']):
+            backend.rebuild(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt by {type(backend).__name__}'))
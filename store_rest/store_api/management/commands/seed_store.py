@@ -0,0 +1,78 @@
+import csv
+import random
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import MD5PasswordHasher, make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.authtoken.models import Token
+
+from store_api.seeding import Seeder
+
+
+class Command(BaseCommand):
+    """
+    Command responsible to populate the store with synthetic users (with tokens), products, orders and order items,
+    at load test volume (see store_api.seeding)
+
+    The rows are inserted in bulk, --chunk-size rows per transaction, and the throughput of each table is reported.
+    All the users share the password --password, hashed once. With --hasher md5 the logins are cheap too, when the
+    server sets FAST_PASSWORD_HASHER=true. --credentials writes the emails and token keys for the load generator.
+    """
+    help = 'Populate the store with synthetic data in bulk, for load tests and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Number of users (each with a token)')
+        parser.add_argument('--products', type=int, default=1000, help='Number of products')
+        parser.add_argument('--orders', type=int, default=50000, help='Number of orders')
+        parser.add_argument('--items', type=int, default=5, help='Maximum number of items per order')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Number of rows inserted per transaction')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data')
+        parser.add_argument('--password', default='store-password', help='Password of all the users')
+        parser.add_argument('--hasher', choices=('default', 'md5'), default='default',
+                            help='Password hasher: the default one of PASSWORD_HASHERS, or MD5 (load tests only)')
+        parser.add_argument('--credentials', help='CSV file receiving the email and token key of the users')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database to be populated')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['products'], options['orders'], options['items'],
+               options['chunk_size']) < 1:
+            raise CommandError('The numbers of rows, --items and --chunk-size must be positive numbers')
+        if options['items'] > options['products']:
+            raise CommandError('--items cannot exceed the number of products')
+        if options['hasher'] == 'md5':
+            # Hashed here even when the hasher is not configured: it is the server that must verify it
+            hasher = MD5PasswordHasher()
+            password_hash = hasher.encode(options['password'], hasher.salt())
+        else:
+            password_hash = make_password(options['password'])
+
+        inserted = Counter()
+        seeder = Seeder(random.Random(options['seed']), password_hash,
+                        chunk_size=options['chunk_size'], using=options['database'],
+                        progress=lambda name, count: inserted.update({name: count}))
+        for name, seed in (('users', lambda: seeder.seed_users(options['users'])),
+                           ('products', lambda: seeder.seed_products(options['products'])),
+                           ('orders', lambda: seeder.seed_orders(options['orders'], options['items']))):
+            started = time.perf_counter()
+            seed()
+            elapsed = time.perf_counter() - started
+            rows = sum(inserted.values())
+            self.stdout.write(f"{name}: {', '.join(f'{count} {table}' for table, count in inserted.items())} "
+                              f'in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)')
+            inserted.clear()
+
+        started = time.perf_counter()
+        seeder.finish()
+        self.stdout.write(f'Sales rollups and search index rebuilt in {time.perf_counter() - started:.1f}s')
+
+        if options['credentials']:
+            with open(options['credentials'], 'w', newline='') as credentials_file:
+                writer = csv.writer(credentials_file)
+                writer.writerow(['email', 'token'])
+                tokens = Token.objects.using(options['database']).filter(
+                    user__gte=seeder.users.start, user__lt=seeder.users.stop).order_by('user')
+                writer.writerows(tokens.values_list('user__email', 'key').iterator())
+            self.stdout.write(f"Credentials written to {options['credentials']}")
+        self.stdout.write(self.style.SUCCESS('Store seeded'))
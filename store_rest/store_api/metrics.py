@@ -0,0 +1,343 @@
+"""In-process metrics registry, exposed in the Prometheus text format on /metrics
+
+Counters and histograms are kept by a value store shared by the metrics of the process:
+    - in memory, when METRICS_DIR is not set (a single process, e.g. the development server);
+    - in a memory-mapped file per process in METRICS_DIR otherwise, so the pre-forked workers each write
+      their own file without locks between processes, and a scrape served by any worker sums the files
+      of all of them. The files of the exited workers are merged into an archive file by the server
+      (see merge_process_values and gunicorn.conf.py), so their counts are kept.
+
+The requests are measured by MetricsMiddleware (latency, status and queries by route), the throttle
+rejections by MetricsViewMixin, and the caches by the authentication and the catalog cache.
+"""
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+from django.conf import settings
+
+from .instrumentation import RequestMetrics, current_metrics, wrapped_connections
+
+# The content type of the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# The suffix of the metric files (only these files of METRICS_DIR are read or removed), the file of the values
+# of the exited processes, and the prefix of its records of the merged process files
+SUFFIX = '.metrics'
+ARCHIVE_FILE = f'archive{SUFFIX}'
+MERGED_PREFIX = 'merged:'
+
+
+class MmapedValues:
+    """
+    Class responsible to keep float values by key in a memory-mapped file, written by a single process.
+
+    Layout: an 8 bytes header with the used size, then the entries: the key length (4 bytes), the UTF-8 key
+    padded to 8 bytes alignment, and the value (8 bytes double). The used size is written after each new
+    entry, so the readers of the file (other processes) only see complete entries.
+    """
+    initial_size = 1 << 16
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a+b')
+        capacity = os.fstat(self.file.fileno()).st_size
+        if capacity < self.initial_size:
+            self.file.truncate(self.initial_size)
+            capacity = self.initial_size
+        self.mmap = mmap.mmap(self.file.fileno(), capacity)
+        self.used = struct.unpack_from('I', self.mmap, 0)[0] or 8
+        # The offset of the value of each key
+        self.positions = {key: offset for key, _, offset in self.entries(self.mmap, self.used)}
+
+    @staticmethod
+    def entries(data, used):
+        """
+        :return: The (key, value, value offset) of the entries of the file data
+        """
+        offset = 8
+        while offset < used:
+            length = struct.unpack_from('I', data, offset)[0]
+            key = bytes(data[offset + 4:offset + 4 + length]).decode()
+            offset += 4 + length + (-(4 + length) % 8)
+            yield key, struct.unpack_from('d', data, offset)[0], offset
+            offset += 8
+
+    @classmethod
+    def read(cls, path):
+        """
+        :return: The values of the file, by key
+        """
+        with open(path, 'rb') as values_file:
+            data = values_file.read()
+        if len(data) < 8:
+            return {}
+        return {key: value for key, value, _ in cls.entries(data, struct.unpack_from('I', data, 0)[0])}
+
+    def add(self, key, amount):
+        offset = self.positions.get(key)
+        if offset is None:
+            offset = self.append(key)
+        struct.pack_into('d', self.mmap, offset, struct.unpack_from('d', self.mmap, offset)[0] + amount)
+
+    def append(self, key):
+        encoded = key.encode()
+        padding = -(4 + len(encoded)) % 8
+        size = 4 + len(encoded) + padding + 8
+        while self.used + size > len(self.mmap):
+            capacity = len(self.mmap) * 2
+            self.mmap.close()
+            self.file.truncate(capacity)
+            self.mmap = mmap.mmap(self.file.fileno(), capacity)
+        struct.pack_into(f'I{len(encoded)}s', self.mmap, self.used, len(encoded), encoded)
+        offset = self.used + size - 8
+        struct.pack_into('d', self.mmap, offset, 0.0)
+        self.used += size
+        struct.pack_into('I', self.mmap, 0, self.used)
+        self.positions[key] = offset
+        return offset
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+
+class ValueStore:
+    """
+    Class responsible to keep the metric values of the process, in memory or in METRICS_DIR (see the module
+    documentation), and to collect the values of all the processes
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Opened on the first write: a process forked from a preloaded application writes its own file
+        self.values = None
+
+    @property
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', None)
+
+    def add(self, key, amount):
+        with self.lock:
+            if self.values is None:
+                if self.directory:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self.values = MmapedValues(os.path.join(self.directory, f'{os.getpid()}{SUFFIX}'))
+                else:
+                    self.values = defaultdict(float)
+            if isinstance(self.values, MmapedValues):
+                self.values.add(key, amount)
+            else:
+                self.values[key] += amount
+
+    def collect(self):
+        """
+        :return: The values of all the processes, summed by key
+        """
+        if not self.directory:
+            with self.lock:
+                return dict(self.values or {})
+        # The process files are read before the archive: a process file merged meanwhile is either
+        # missing, or read along with an archive recording it as merged (see merge_process_values)
+        processes = {}
+        for path in glob.glob(os.path.join(self.directory, f'*{SUFFIX}')):
+            if os.path.basename(path) != ARCHIVE_FILE:
+                try:
+                    processes[os.path.basename(path)] = MmapedValues.read(path)
+                except FileNotFoundError:
+                    continue
+        archive_path = os.path.join(self.directory, ARCHIVE_FILE)
+        archive = MmapedValues.read(archive_path) if os.path.exists(archive_path) else {}
+        totals = defaultdict(float)
+        for name, values in list(processes.items()) + [(ARCHIVE_FILE, archive)]:
+            if name != ARCHIVE_FILE and f'{MERGED_PREFIX}{name}' in archive:
+                continue
+            for key, value in values.items():
+                if not key.startswith(MERGED_PREFIX):
+                    totals[key] += value
+        return totals
+
+
+store = ValueStore()
+os.register_at_fork(after_in_child=store.reset)
+
+
+def merge_process_values(directory, pid):
+    """
+    Adds the values of an exited process to the archive file of the directory, then removes its file.
+    Called by a single process (the server master): the archive has a single writer.
+
+    The archive is replaced atomically, and records the merged process file until the file is removed, so the
+    scrapes never count the process twice, or not at all (a counter decreasing would look like a reset).
+    """
+    name = f'{pid}{SUFFIX}'
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        return
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    values = MmapedValues.read(archive_path) if os.path.exists(archive_path) else {}
+    for key, value in MmapedValues.read(path).items():
+        values[key] = values.get(key, 0.0) + value
+    values[f'{MERGED_PREFIX}{name}'] = 1.0
+    # The records of the files removed by the previous merges are dropped
+    values = {key: value for key, value in values.items() if not key.startswith(MERGED_PREFIX) or
+              os.path.exists(os.path.join(directory, key[len(MERGED_PREFIX):]))}
+    temporary_path = os.path.join(directory, f'{ARCHIVE_FILE}.tmp')
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    archive = MmapedValues(temporary_path)
+    try:
+        for key, value in values.items():
+            archive.add(key, value)
+    finally:
+        archive.close()
+    os.replace(temporary_path, archive_path)
+    os.remove(path)
+
+
+class Metric:
+    """Base class of the metrics: a name, its documentation and the names of its labels"""
+    type = None
+    registry = []
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.keys = {}
+        self.registry.append(self)
+
+    def key(self, sample, labels, extra=()):
+        """
+        :return: The store key of a sample of the metric with the labels
+        """
+        cache_key = (sample, tuple(sorted(labels.items())), extra)
+        key = self.keys.get(cache_key)
+        if key is None:
+            if set(labels) != set(self.labelnames):
+                raise ValueError(f'{self.name} expects the labels {", ".join(self.labelnames)}')
+            values = [[name, str(labels[name])] for name in self.labelnames] + [list(pair) for pair in extra]
+            key = self.keys[cache_key] = json.dumps([self.name, sample, values])
+        return key
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        store.add(self.key(self.name, labels), amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(float(bound) for bound in sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        # Every bucket is written, so the empty ones are exposed too
+        for bound in self.buckets:
+            store.add(self.key(f'{self.name}_bucket', labels, (('le', format_bound(bound)),)), value <= bound)
+        store.add(self.key(f'{self.name}_sum', labels), value)
+        store.add(self.key(f'{self.name}_count', labels), 1)
+
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_metrics():
+    """
+    :return: The metrics of all the processes in the Prometheus text exposition format
+    """
+    samples = defaultdict(list)
+    for key, value in store.collect().items():
+        name, sample, labels = json.loads(key)
+        samples[name].append((sample, labels, value))
+
+    def order(item):
+        sample, labels, _ = item
+        # The buckets of each label set in increasing bounds, then the count and sum
+        bucket = sample.endswith('_bucket')
+        return ([value for name, value in labels if name != 'le'], not bucket, sample,
+                float(labels[-1][1]) if bucket else 0.0)
+
+    lines = []
+    for metric in Metric.registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        for sample, labels, value in sorted(samples.get(metric.name, ()), key=order):
+            label_text = ','.join(f'{name}="{escape_label(value)}"' for name, value in labels)
+            lines.append(f'{sample}{{{label_text}}} {float(value)!r}' if labels else f'{sample} {float(value)!r}')
+    return '\n'.join(lines) + '\n'
+
+
+REQUESTS = Counter('store_http_requests_total', 'HTTP requests by route, method and status',
+                   ('route', 'method', 'status'))
+REQUEST_DURATION = Histogram('store_http_request_duration_seconds', 'HTTP request latency by route and method',
+                             ('route', 'method'))
+REQUEST_QUERIES = Histogram('store_db_queries_per_request', 'Database queries per HTTP request by route',
+                            ('route',), buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+QUERY_DURATION = Counter('store_db_query_seconds_total', 'Time spent in database queries by route', ('route',))
+THROTTLED = Counter('store_throttled_requests_total', 'Requests rejected by the throttles by route', ('route',))
+TOKEN_CACHE_LOOKUPS = Counter('store_auth_token_cache_lookups_total',
+                              'Lookups of the cached token authentication by result (hit or miss)', ('result',))
+CATALOG_CACHE_LOOKUPS = Counter('store_catalog_cache_lookups_total',
+                                'Lookups of the catalog response cache by result (hit or miss)', ('result',))
+
+
+def route_name(request):
+    # Unmatched paths share a label: the paths themselves would make the label values unbounded
+    return request.resolver_match.view_name if request.resolver_match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+    """
+    Middleware measuring every request: count by status, latency and number of queries by route.
+    It follows InstrumentationMiddleware: the queries of the sampled requests are counted by the execute
+    wrapper of the instrumentation, so a single wrapper runs per query.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        metrics = current_metrics.get()
+        if metrics is None:
+            metrics = RequestMetrics()
+            wrapper = wrapped_connections(metrics)
+        else:
+            wrapper = nullcontext()
+        queries, db_seconds = metrics.queries, metrics.db_seconds
+        with wrapper:
+            response = self.get_response(request)
+        route = route_name(request)
+        REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+        REQUEST_DURATION.observe(time.perf_counter() - started, route=route, method=request.method)
+        REQUEST_QUERIES.observe(metrics.queries - queries, route=route)
+        QUERY_DURATION.inc(metrics.db_seconds - db_seconds, route=route)
+        return response
+
+
+class MetricsViewMixin:
+    """
+    DRF view mixin counting the requests rejected by the throttles
+    """
+
+    def throttled(self, request, wait):
+        THROTTLED.inc(route=route_name(request))
+        super().throttled(request, wait)
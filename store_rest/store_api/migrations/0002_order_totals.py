@@ -0,0 +1,44 @@
+# Generated by Django 3.0.7 on 2026-10-18 11:25
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_order_totals(apps, schema_editor):
+    """Fills the new stored totals of the existing orders from their items"""
+    Order = apps.get_model('store_api', 'Order')
+    OrderItem = apps.get_model('store_api', 'OrderItem')
+    total_field = DecimalField(max_digits=12, decimal_places=2)
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    Order.objects.using(schema_editor.connection.alias).update(
+        order_total=Coalesce(
+            Subquery(items.annotate(total=Sum(F('quantity') * F('product__price'),
+                                              output_field=total_field)).values('total')),
+            Value(Decimal('0.00')), output_field=total_field),
+        item_count=Coalesce(
+            Subquery(items.annotate(count=Count('pk')).values('count')),
+            Value(0), output_field=models.IntegerField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='order_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.RunPython(compute_order_totals, migrations.RunPython.noop),
+    ]
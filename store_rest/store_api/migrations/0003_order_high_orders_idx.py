@@ -0,0 +1,17 @@
+# Generated by Django 3.0.7 on 2026-10-18 11:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_api', '0002_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(item_count__gte=2), fields=['order_total'], name='order_high_orders_idx'),
+        ),
+    ]
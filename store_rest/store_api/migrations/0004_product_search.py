@@ -0,0 +1,54 @@
+import sqlite3
+
+from django.db import migrations
+
+
+SQLITE_FTS_TABLE = 'store_api_product_fts'
+POSTGRES_DOCUMENT = "to_tsvector('english', coalesce(\"name\", '') || ' ' || coalesce(\"description\", ''))"
+
+
+def create_search_index(apps, schema_editor):
+    """Creates the search objects used by the search backend of the database vendor (see store_api.search)"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX store_api_product_search_idx ON store_api_product USING GIN ({POSTGRES_DOCUMENT})')
+        schema_editor.execute(
+            'CREATE INDEX store_api_product_name_trgm_idx ON store_api_product USING GIN (name gin_trgm_ops)')
+        schema_editor.execute(
+            'CREATE INDEX store_api_product_description_trgm_idx ON store_api_product '
+            'USING GIN (description gin_trgm_ops)')
+    elif vendor == 'sqlite':
+        # Trigrams keep the substring semantics of the icontains search. Older SQLite versions index words.
+        tokenizer = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5(name, description, tokenize='{tokenizer}')")
+        except Exception:
+            # SQLite built without FTS5: the search backend falls back to icontains
+            return
+        schema_editor.execute(
+            f'INSERT INTO {SQLITE_FTS_TABLE} (rowid, name, description) '
+            f'SELECT id, name, description FROM store_api_product')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS store_api_product_search_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS store_api_product_name_trgm_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS store_api_product_description_trgm_idx')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_api', '0003_order_high_orders_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 3.0.7 on 2026-10-18 11:39
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+
+
+def compute_sales_rollups(apps, schema_editor):
+    """Fills the new sales rollups from the existing order items"""
+    using = schema_editor.connection.alias
+    OrderItem = apps.get_model('store_api', 'OrderItem')
+    revenue_field = DecimalField(max_digits=12, decimal_places=2)
+    for model_name, field, key in (('ProductSales', 'product_id', F('product_id')),
+                                   ('UserSales', 'user_id', F('order__user_id')),
+                                   ('DailySales', 'day', TruncDate('order__created'))):
+        model = apps.get_model('store_api', model_name)
+        summaries = OrderItem.objects.using(using).order_by().values(key=key).annotate(
+            units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('product__price'), output_field=revenue_field),
+            item_count=Count('pk'))
+        model.objects.using(using).bulk_create(
+            [model(**{field: summary.pop('key')}, **summary) for summary in summaries.iterator()],
+            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_api', '0005_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('units', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('item_count', models.BigIntegerField(default=0)),
+                ('day', models.DateField(primary_key=True, serialize=False)),
+            ],
+            options={
+                'verbose_name': 'Daily sales',
+                'verbose_name_plural': 'Daily sales',
+                'ordering': ['day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('units', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('item_count', models.BigIntegerField(default=0)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales', serialize=False, to='store_api.Product')),
+            ],
+            options={
+                'verbose_name': 'Product sales',
+                'verbose_name_plural': 'Product sales',
+            },
+        ),
+        migrations.CreateModel(
+            name='UserSales',
+            fields=[
+                ('units', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('item_count', models.BigIntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales', serialize=False, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User sales',
+                'verbose_name_plural': 'User sales',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productsales',
+            index=models.Index(fields=['-revenue'], name='product_sales_revenue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsales',
+            index=models.Index(fields=['-units'], name='product_sales_units_idx'),
+        ),
+        migrations.RunPython(compute_sales_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.0.7 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_api', '0006_sales_rollups'),
+    ]
+
+    operations = [
+        # The keyset pagination indexes of 0005 are superseded by the partial indexes on the active rows
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='orderitem',
+            name='order_item_created_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_created_id_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(active=True), fields=['created', 'id'], name='order_active_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(active=True), fields=['user', 'created', 'id'], name='order_active_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(condition=models.Q(active=True), fields=['created', 'id'], name='order_item_active_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(active=True), fields=['created', 'id'], name='product_active_created_id_idx'),
+        ),
+    ]
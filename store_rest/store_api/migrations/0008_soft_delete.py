@@ -0,0 +1,21 @@
+# Generated by Django 3.0.7 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store_api', '0007_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='orderitem',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(condition=models.Q(active=True), fields=('order', 'product'), name='order_item_active_product_uniq'),
+        ),
+    ]
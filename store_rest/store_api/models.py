@@ -1,11 +1,15 @@
+import threading
 from decimal import Decimal
 
+from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import connections, models, router, transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db.models import Sum, F, DecimalField
-from django.dispatch import receiver
+from django.db.models import Sum, F, Q, Count, DecimalField, ExpressionWrapper, FloatField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal, receiver
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from rest_framework.authtoken.models import Token
 
@@ -50,6 +54,16 @@ class UserManager(BaseUserManager):
         return self._create_user(email, password, **extra_fields)
 
 
+class ActiveManager(models.Manager):
+    """Define the default manager of the models with logical deletion: only the active rows are queried.
+    The logically deleted rows are still reached through the `all_objects` manager of the models,
+    and through the foreign keys of the rows referencing them.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(active=True)
+
+
 # Create your models here.
 class Base(models.Model):
     """Base class to be inherited by all models of the API
@@ -62,6 +76,11 @@ class Base(models.Model):
     class Meta:
         abstract = True
 
+    def soft_delete(self):
+        """Logically deletes the row: it is kept, flagged as not active"""
+        self.active = False
+        self.save()
+
 
 class User(AbstractUser):
     """An extended user class, expanding from the AbstractUser to be used in the
@@ -82,6 +101,32 @@ class User(AbstractUser):
     objects = UserManager()
 
 
+# Sent after Order.objects.bulk_create_with_items inserts orders and items without the model signals.
+# Arguments: orders (list of (order, items) pairs) and using (the database alias)
+orders_bulk_created = Signal()
+
+
+# An order is a high order when its total is greater than HIGH_ORDER_TOTAL and it has more than 1 product
+HIGH_ORDER_TOTAL = Decimal('100')
+HIGH_ORDER_MIN_PRODUCTS = 2
+
+
+class ProductQuerySet(models.QuerySet):
+    """QuerySet for products"""
+
+    def in_high_orders(self):
+        """
+        The distinct products that are part of a high order, in a single query.
+        The qualifying orders are read from the stored order totals, unless the setting
+        HIGH_ORDERS_USE_STORED_TOTALS is False, in which case they are grouped from the order items.
+        """
+        if getattr(settings, 'HIGH_ORDERS_USE_STORED_TOTALS', True):
+            orders = Order.objects.high_orders()
+        else:
+            orders = Order.objects.high_orders_from_items()
+        return self.filter(orderitem__active=True, orderitem__order__in=orders.values('pk')).distinct()
+
+
 class Product(Base):
     """Class used to represent and persist the products data
 
@@ -99,40 +144,216 @@ class Product(Base):
         decimal_places=2,
         validators=[MinValueValidator(Decimal('0.00'))])
 
+    # The active products. Use all_objects to reach the logically deleted ones
+    objects = ActiveManager.from_queryset(ProductQuerySet)()
+    all_objects = ProductQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
         ordering = ['id']
+        indexes = [
+            # Keyset pagination of the listing of the active products (see KeysetPagination)
+            models.Index(fields=['created', 'id'], condition=Q(active=True), name='product_active_created_id_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name} - {self.price}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the price as loaded, so a price change can be propagated to the order totals
+        instance._loaded_price = instance.__dict__.get('price')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Saves the product and, when the price changes, refreshes the totals of the orders containing it"""
+        using = kwargs.get('using') or router.db_for_write(Product, instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            loaded_price = getattr(self, '_loaded_price', None)
+            if loaded_price is not None and Decimal(loaded_price) != Decimal(self.price):
+                Order.objects.using(using).filter(items__product=self).refresh_totals()
+            self._loaded_price = self.price
+
+
+# Output field used by the order totals expressions
+ORDER_TOTAL_FIELD = DecimalField(max_digits=12, decimal_places=2)
+# Differences below half a cent are rounding, not stale totals
+TOTAL_TOLERANCE = 0.005
+
+
+class OrderQuerySet(models.QuerySet):
+    """QuerySet for orders, responsible to keep the denormalized order totals in sync with the order items.
+
+    The stored totals are maintained incrementally by OrderItem and Product writes. The methods below
+    recompute them from the items table and are used for bulk rebuilds and consistency checks.
+    """
+
+    @staticmethod
+    def computed_total():
+        """Correlated subquery with the total of the order items of the outer order"""
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return Coalesce(
+            Subquery(items.annotate(
+                total=Sum(F('quantity') * F('product__price'), output_field=ORDER_TOTAL_FIELD)).values('total')),
+            Value(Decimal('0.00')),
+            output_field=ORDER_TOTAL_FIELD)
+
+    @staticmethod
+    def computed_item_count():
+        """Correlated subquery with the number of order items of the outer order"""
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return Coalesce(
+            Subquery(items.annotate(count=Count('pk')).values('count')),
+            Value(0),
+            output_field=models.IntegerField())
+
+    def with_items(self):
+        """Loads the user, the items and the items products along with the orders, in a fixed number of queries,
+        so the nested serialization does not query per order or per item.
+        """
+        return self.select_related('user').prefetch_related(self.items_prefetch())
+
+    @staticmethod
+    def items_prefetch():
+        """The prefetch of the order items along with their products"""
+        return models.Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('pk'))
+
+    def high_orders(self):
+        """
+        :return: The orders with total greater than HIGH_ORDER_TOTAL and more than 1 product,
+        filtered on the stored totals (see the order_high_orders partial index)
+        """
+        return self.filter(order_total__gt=HIGH_ORDER_TOTAL, item_count__gte=HIGH_ORDER_MIN_PRODUCTS)
+
+    def high_orders_from_items(self):
+        """
+        :return: The same orders as high_orders, grouped from the order items (totals and distinct products
+        checked in the HAVING clause). It does not depend on the stored totals.
+        """
+        active_items = Q(items__active=True)
+        return self.order_by().annotate(
+            total=Sum(ExpressionWrapper(F('items__quantity') * F('items__product__price'),
+                                        output_field=ORDER_TOTAL_FIELD), filter=active_items),
+            products=Count('items__product', filter=active_items, distinct=True),
+        ).filter(total__gt=HIGH_ORDER_TOTAL, products__gte=HIGH_ORDER_MIN_PRODUCTS)
+
+    def refresh_totals(self):
+        """Recompute the stored totals of the orders in this queryset with a single UPDATE statement
+        :return: The number of orders updated
+        """
+        return self.update(order_total=self.computed_total(), item_count=self.computed_item_count())
+
+    def stale_totals(self):
+        """
+        :return: The orders in this queryset whose stored totals differ from the order items
+        """
+        # Compare the totals with a tolerance: SQLite applies the increments with floating point arithmetic.
+        # The difference is a float, so SQLite compares it with numeric (not text) parameters.
+        return self.annotate(
+            total_difference=ExpressionWrapper(
+                self.computed_total() - F('order_total'), output_field=FloatField()),
+            expected_item_count=self.computed_item_count(),
+        ).filter(
+            Q(total_difference__gte=TOTAL_TOLERANCE) |
+            Q(total_difference__lte=-TOTAL_TOLERANCE) |
+            ~Q(item_count=F('expected_item_count')))
+
+    def add_to_totals(self, amount, count=0):
+        """Increments the stored totals of the orders in this queryset, in the database, by a delta
+        :param amount: The value to be added to order_total (may be negative)
+        :param count: The value to be added to item_count (may be negative)
+        :return: The number of orders updated
+        """
+        return self.update(order_total=F('order_total') + amount, item_count=F('item_count') + count)
+
+    def bulk_create_with_items(self, orders):
+        """Inserts new orders along with their items in a single transaction. The totals are computed from
+        the items before the insert, so the orders are not updated afterwards.
+        The orders are inserted with one statement when the database returns the inserted primary keys
+        (e.g. PostgreSQL), otherwise one by one. The items are always inserted with one statement.
+        :param orders: List of (order, items) pairs, unsaved. The products of the items must be loaded
+        :return: The created orders
+        """
+        using = self._db or router.db_for_write(self.model)
+        instances = []
+        for order, items in orders:
+            order.order_total = sum((item.item_total for item in items), Decimal('0.00'))
+            order.item_count = len(items)
+            instances.append(order)
+        with transaction.atomic(using=using):
+            if connections[using].features.can_return_rows_from_bulk_insert:
+                self.using(using).bulk_create(instances)
+            else:
+                for order in instances:
+                    order.save(using=using)
+            # The orders have their primary keys now
+            for order, items in orders:
+                for item in items:
+                    item.order = order
+            OrderItem.objects.using(using).bulk_create([item for _, items in orders for item in items])
+            orders_bulk_created.send(sender=Order, orders=orders, using=using)
+        return instances
+
 
 class Order(Base):
     """Class used to represent and persist the orders data.
         Order is related to a user. Order items are implemented in separate class.
-        Fields persisted: 1 + Base
+        Fields persisted: 3 + Base
             user: The user related to this order
+            order_total: Decimal. Denormalized sum of quantity * product price of the order items
+            item_count: int. Denormalized number of order items
 
-        Fields Computed: 1
-            order_total: Decimal
+        The denormalized fields are maintained by OrderItem and Product writes, so reading them
+        costs no extra query. Use `manage.py rebuild_order_totals` to verify or rebuild them.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    order_total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # The active orders. Use all_objects to reach the logically deleted ones
+    objects = ActiveManager.from_queryset(OrderQuerySet)()
+    all_objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
         ordering = ['id']
+        indexes = [
+            # Index over the qualifying orders of the high_orders endpoint only
+            models.Index(fields=['order_total'], condition=Q(item_count__gte=HIGH_ORDER_MIN_PRODUCTS),
+                         name='order_high_orders_idx'),
+            # The orders of a user, including the logically deleted ones (e.g. cascades of a user deletion)
+            models.Index(fields=['user', 'created', 'id'], name='order_user_created_id_idx'),
+            # Keyset pagination of the listings of the active orders: all the orders and the orders of a user
+            models.Index(fields=['created', 'id'], condition=Q(active=True), name='order_active_created_id_idx'),
+            models.Index(fields=['user', 'created', 'id'], condition=Q(active=True),
+                         name='order_active_user_created_idx'),
+        ]
 
     def __str__(self):
         return f'Order placed at {self.created} by {self.user}'
 
-    @property
-    def order_total(self):
-        total = self.items.aggregate(
-            order_total=Sum(F('quantity') * F('product__price'),
-                            output_field=DecimalField())).get('order_total')
-        return total
+    def soft_delete(self):
+        """Logically deletes the order and its items, in one transaction. The items are updated in bulk:
+        they leave the totals and the sales rollups along with their order
+        """
+        using = router.db_for_write(Order, instance=self)
+        with transaction.atomic(using=using):
+            super().soft_delete()
+            OrderItem.objects.using(using).filter(order_id=self.pk).update(active=False, updated=timezone.now())
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the values as loaded, so the sales rollups can follow an order moved to another user or deleted
+        instance._loaded_values = {
+            'user_id': instance.__dict__.get('user_id'),
+            'active': instance.__dict__.get('active'),
+        }
+        return instance
 
 
 class OrderItem(Base):
@@ -151,17 +372,188 @@ class OrderItem(Base):
         default=1,
         validators=[MinValueValidator(1)])
 
+    # The active order items. Use all_objects to reach the logically deleted ones
+    objects = ActiveManager()
+    all_objects = models.Manager()
+
     class Meta:
-        unique_together = ('order', 'product')
+        constraints = [
+            # A product is once in an order, but may be added again after its item is logically deleted
+            models.UniqueConstraint(fields=['order', 'product'], condition=Q(active=True),
+                                    name='order_item_active_product_uniq'),
+        ]
+        indexes = [
+            # Keyset pagination of the listing of the active items (see KeysetPagination)
+            models.Index(fields=['created', 'id'], condition=Q(active=True), name='order_item_active_created_idx'),
+        ]
 
     @property
     def item_total(self):
         total = self.product.price * self.quantity
         return total
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Keep the values as loaded, so an update can be applied as a delta to the order totals
+        instance._loaded_values = {
+            'order_id': instance.__dict__.get('order_id'),
+            'product_id': instance.__dict__.get('product_id'),
+            'quantity': instance.__dict__.get('quantity'),
+            'active': instance.__dict__.get('active'),
+        }
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Saves the order item and applies the change to the stored totals of the related order(s)
+        in the same transaction.
+        """
+        using = kwargs.get('using') or router.db_for_write(OrderItem, instance=self)
+        adding = self._state.adding
+        loaded = getattr(self, '_loaded_values', None)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            orders = Order.objects.using(using)
+            if adding:
+                if self.active:
+                    orders.filter(pk=self.order_id).add_to_totals(self.item_total, 1)
+            elif loaded is None or None in loaded.values():
+                # Updated without knowing the previous state: recompute the order from its items
+                orders.filter(pk=self.order_id).refresh_totals()
+            elif loaded['product_id'] != self.product_id or loaded['active'] != self.active:
+                # The previous product price is needed, or the item was (logically) deleted or restored.
+                # Recompute from the active items instead of querying it.
+                orders.filter(pk__in={loaded['order_id'], self.order_id}).refresh_totals()
+            elif not self.active:
+                # Logically deleted items are not part of the totals
+                pass
+            elif loaded['order_id'] != self.order_id:
+                orders.filter(pk=loaded['order_id']).add_to_totals(-self.product.price * loaded['quantity'], -1)
+                orders.filter(pk=self.order_id).add_to_totals(self.item_total, 1)
+            elif loaded['quantity'] != self.quantity:
+                orders.filter(pk=self.order_id).add_to_totals(
+                    self.product.price * (self.quantity - loaded['quantity']))
+        self._loaded_values = {'order_id': self.order_id, 'product_id': self.product_id, 'quantity': self.quantity,
+                               'active': self.active}
+
+
+class SalesRollup(models.Model):
+    """Base class of the sales rollups: order items summarized by a key, maintained incrementally
+    as the order items change (see store_api.rollups), so reports do not scan the order items.
+
+    Fields persisted: 3
+        units: Sum of the items quantities
+        revenue: Sum of the items totals (quantity * current product price, as the order totals)
+        item_count: Number of order items
+    """
+    units = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    item_count = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ProductSales(SalesRollup):
+    """Sales rollup by product"""
+    product = models.OneToOneField(Product, primary_key=True, related_name='sales', on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = 'Product sales'
+        verbose_name_plural = 'Product sales'
+        indexes = [
+            # Top products
+            models.Index(fields=['-revenue'], name='product_sales_revenue_idx'),
+            models.Index(fields=['-units'], name='product_sales_units_idx'),
+        ]
+
+
+class UserSales(SalesRollup):
+    """Sales rollup by user (the lifetime spend of the user)"""
+    user = models.OneToOneField(User, primary_key=True, related_name='sales', on_delete=models.CASCADE)
+
+    class Meta:
+        verbose_name = 'User sales'
+        verbose_name_plural = 'User sales'
+
+
+class DailySales(SalesRollup):
+    """Sales rollup by day of the orders creation (in the TIME_ZONE setting)"""
+    day = models.DateField(primary_key=True)
+
+    class Meta:
+        verbose_name = 'Daily sales'
+        verbose_name_plural = 'Daily sales'
+        ordering = ['day']
+
 
 # This receiver will handle a token creation immediately a new user is created
 @receiver(post_save, sender=User)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         Token.objects.create(user=instance)
+
+
+class PendingDeletions(threading.local):
+    """The orders and products being deleted by the current thread, from their pre_delete to their post_delete.
+    Their items are deleted in between (cascade), and their totals are not updated one item at a time
+    """
+
+    def __init__(self):
+        self.orders = set()
+        self.products = set()
+        # The orders of the items deleted along with a product: refreshed once the items are deleted
+        self.stale_orders = set()
+
+
+pending_deletions = PendingDeletions()
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleting(sender, instance=None, **kwargs):
+    pending_deletions.orders.add(instance.pk)
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance=None, **kwargs):
+    pending_deletions.orders.discard(instance.pk)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance=None, **kwargs):
+    pending_deletions.products.add(instance.pk)
+
+
+# The products are deleted after their items: the totals of the orders of those items are refreshed with one
+# UPDATE statement, instead of one per item
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance=None, using=None, **kwargs):
+    pending_deletions.products.discard(instance.pk)
+    stale_orders = pending_deletions.stale_orders - pending_deletions.orders
+    pending_deletions.stale_orders = set()
+    if stale_orders:
+        Order.objects.using(using).filter(pk__in=stale_orders).refresh_totals()
+
+
+# This receiver removes a deleted order item from the stored order totals.
+# It is also triggered by cascading deletes and runs in the deletion transaction.
+@receiver(post_delete, sender=OrderItem)
+def remove_item_from_order_total(sender, instance=None, using=None, **kwargs):
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if not instance.active and not loaded.get('active'):
+        # Logically deleted items are not part of the totals
+        return
+    order_id = loaded.get('order_id') or instance.order_id
+    if order_id in pending_deletions.orders:
+        # The order is deleted along with its items
+        return
+    if instance.product_id in pending_deletions.products:
+        pending_deletions.stale_orders.add(order_id)
+        return
+    orders = Order.objects.using(using).filter(pk=order_id)
+    # Without the loaded product, refreshing the totals is one query, as loading its price
+    if loaded.get('quantity') is None or loaded.get('product_id') != instance.product_id or \
+            not OrderItem.product.is_cached(instance):
+        orders.refresh_totals()
+    else:
+        orders.add_to_totals(-instance.product.price * loaded['quantity'], -1)
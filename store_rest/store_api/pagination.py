@@ -0,0 +1,136 @@
+"""Keyset (cursor) pagination
+
+PageNumberPagination skips the previous pages with OFFSET, so the deeper the page the more rows the
+database reads and discards. KeysetPagination filters the rows after the last row of the previous page
+on (created, id) instead, so with an index on these columns every page costs the same as the first one.
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Class responsible to paginate the listings by keyset on (created, id), with opaque cursors in the
+    next/previous links.
+
+    The page size is the `page_size` of the view (or PAGE_SIZE), and can be changed by the client with
+    the `page_size` query parameter, up to max_page_size. The total count of rows is included unless the view sets
+    `include_count = False`; clients may also ask for it or opt out with `?count=true/false`.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    include_count = True
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request, view)
+        self.count = queryset.count() if self.get_include_count(request, view) else None
+        created, pk, reverse = self.decode_cursor(request)
+
+        if reverse:
+            queryset = queryset.order_by('-created', '-id')
+            if created is not None:
+                queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+        else:
+            queryset = queryset.order_by('created', 'id')
+            if created is not None:
+                queryset = queryset.filter(Q(created__gt=created) | Q(created=created, id__gt=pk))
+
+        # One row more than the page tells if there is another page in the same direction
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = created is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, created is not None
+        return self.page
+
+    def get_page_size(self, request, view=None):
+        page_size = getattr(view, 'page_size', None) or self.page_size
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(requested, self.max_page_size))
+
+    def get_include_count(self, request, view=None):
+        value = request.query_params.get(self.count_query_param)
+        if value is not None:
+            return value.lower() in ('1', 'true', 'yes')
+        return getattr(view, 'include_count', self.include_count)
+
+    def decode_cursor(self, request):
+        """
+        :return: The (created, id) position and the direction (reverse) of the requested cursor
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, None, False
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('ascii'))
+            created = parse_datetime(position['c'])
+            pk = int(position['i'])
+            reverse = bool(position.get('r', False))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+        if created is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created, pk, reverse
+
+    def encode_cursor(self, row, reverse=False):
+        # Model instances, or .values() rows (see ValuesSerializer)
+        if isinstance(row, dict):
+            created, pk = row['created'], row['id']
+        else:
+            created, pk = row.created, row.pk
+        position = {'c': created.isoformat(), 'i': pk}
+        if reverse:
+            position['r'] = True
+        encoded = base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode('ascii'))
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode('ascii'))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer', 'example': 123},
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
@@ -1,17 +1,73 @@
-from rest_framework.permissions import BasePermission
+import hmac
+
+from django.conf import settings
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.permissions import BasePermission, SAFE_METHODS
 from .models import Order, OrderItem, User
 
 class IsOwner(BasePermission):
     """
     Custom permission class to allow only the proper user to view/update their data and orders/orders items
+
+    The ownership is checked on the foreign keys already loaded with the object, without queries.
+    Order items must be loaded with their order (select_related('order')).
     """
 
     def has_object_permission(self, request, view, obj):
         if isinstance(obj, User):
-            return obj == request.user
+            return obj.pk == request.user.id
         if isinstance(obj, Order):
-            user = User.objects.filter(email=obj.user).first()
-            return user == request.user
+            return obj.user_id == request.user.id
         if isinstance(obj, OrderItem):
-            order = Order.objects.filter(id=obj.order).first()
-            return self.has_object_permission(request, view, order)
+            return obj.order.user_id == request.user.id
+        return False
+
+
+class IsOwnerOrStaff(IsOwner):
+    """
+    Custom permission class to allow the proper user or staff users to view/update the orders/orders items.
+    (Composing `IsOwner | IsAdminUser` is not enough: IsAdminUser does not check objects, so it allows any)
+    """
+
+    def has_object_permission(self, request, view, obj):
+        return request.user.is_staff or super().has_object_permission(request, view, obj)
+
+
+class ReadOnly(BasePermission):
+    """
+    Custom permission class to allow only the safe (read only) methods
+    """
+
+    def has_permission(self, request, view):
+        return request.method in SAFE_METHODS
+
+
+class IsOwnerFilterBackend(BaseFilterBackend):
+    """
+    Filter backend restricting the listings to the rows owned by the request user, so non-staff users
+    never load the rows of other users. Staff users are not restricted.
+
+    It applies to the views declaring `owner_field`: the lookup from the listed model to its user
+    (e.g. 'user' for orders, 'order__user' for order items).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        owner_field = getattr(view, 'owner_field', None)
+        if owner_field is None or getattr(view, 'action', None) != 'list' or request.user.is_staff:
+            return queryset
+        return queryset.filter(**{f'{owner_field}_id': request.user.id})
+
+
+class HasMetricsToken(BasePermission):
+    """
+    Custom permission class to allow the metrics scrapes bearing the METRICS_TOKEN setting
+    (Authorization: Bearer <token>). When the setting is empty, the metrics are only exposed with DEBUG.
+    """
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'METRICS_TOKEN', '')
+        if not token:
+            return settings.DEBUG
+        # Compared as bytes: compare_digest rejects the strings with non-ASCII characters
+        header = request.META.get('HTTP_AUTHORIZATION', '')
+        return hmac.compare_digest(header.encode(), f'Bearer {token}'.encode())
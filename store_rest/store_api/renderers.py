@@ -0,0 +1,59 @@
+"""JSON renderer and parser backed by orjson
+
+orjson (optional package) encodes and decodes in native code, several times faster than the json module
+used by DRF's JSONRenderer and JSONParser. The output is the same of DRF's: compact, UTF-8, decimals
+as numbers, UTC datetimes ending with Z, and U+2028/U+2029 escaped. Values orjson does not support
+natively (decimals, lazy strings, querysets...) go through DRF's JSONEncoder.
+
+Without orjson installed, and for the indented responses (e.g. `Accept: application/json; indent=4`),
+the DRF implementation is used.
+"""
+from django.conf import settings
+from rest_framework import renderers, parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The line and paragraph separators, in UTF-8 and escaped (JSON must be a javascript subset)
+SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'), (b'\xe2\x80\xa9', b'\\u2029'))
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    Class responsible to render the responses as JSON with orjson, falling back to DRF's JSONRenderer
+    """
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii or \
+                self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        ret = orjson.dumps(data, default=self.encoder.default,
+                           option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+        for separator, escaped in SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+        return ret
+
+
+class FastJSONParser(parsers.JSONParser):
+    """
+    Class responsible to parse the JSON request bodies with orjson, falling back to DRF's JSONParser
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,239 @@
+"""Sales rollups: the order items summarized by product, by user and by day
+
+The rollup rows (ProductSales, UserSales and DailySales) are updated incrementally, in the transaction of
+the order item writes, by the receivers below:
+    - items created, deleted or with the quantity changed are applied as deltas (F() increments);
+    - items moved to another order or product, items and orders logically deleted or restored, orders moved
+      to another user and product price changes recompute the rows of the affected keys from the order items;
+    - orders created in bulk (Order.objects.bulk_create_with_items) are applied as deltas summed by key.
+
+Only the active items of active orders are summarized: logically deleted rows are not sales.
+Writes bypassing the model signals (queryset update/delete, raw SQL) are not followed:
+use `manage.py rebuild_rollups` to verify or rebuild the rollups.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    ORDER_TOTAL_FIELD,
+    TOTAL_TOLERANCE,
+    DailySales,
+    Order,
+    OrderItem,
+    Product,
+    ProductSales,
+    UserSales,
+    orders_bulk_created
+)
+
+# The rollups: model, key field and the lookup of the key from the order items
+ROLLUPS = (
+    (ProductSales, 'product_id', 'product_id'),
+    (UserSales, 'user_id', 'order__user_id'),
+    (DailySales, 'day', 'order__created__date'),
+)
+REVENUE_TOLERANCE = Decimal(str(TOTAL_TOLERANCE))
+
+
+def order_day(order):
+    """
+    :return: The day of the order in the DailySales rollup
+    """
+    return timezone.localdate(order.created) if order.created is not None else timezone.localdate()
+
+
+def summarize_items(items, key_lookup):
+    """
+    :param items: The order items to be summarized
+    :param key_lookup: The lookup of the rollup key from the order items (see ROLLUPS)
+    :return: The rollup values of the items grouped by key: dictionaries with key, units, revenue and item_count
+    """
+    if key_lookup == 'order__created__date':
+        key = TruncDate('order__created')
+    else:
+        key = F(key_lookup)
+    return items.order_by().values(key=key).annotate(
+        units=Sum('quantity'),
+        revenue=Sum(F('quantity') * F('product__price'), output_field=ORDER_TOTAL_FIELD),
+        item_count=Count('pk'))
+
+
+def refresh_rollups(using='default', product_ids=None, user_ids=None, days=None, batch_size=1000):
+    """
+    Recomputes rollup rows from the order items.
+    For each rollup, None recomputes all the rows and a collection recomputes only the rows of these keys.
+
+    :param using: The database alias
+    :param product_ids: The ProductSales keys
+    :param user_ids: The UserSales keys
+    :param days: The DailySales keys
+    :param batch_size: Number of rows inserted per statement
+    :return: The number of rollup rows written
+    """
+    written = 0
+    items = OrderItem.objects.using(using).filter(order__active=True)
+    with transaction.atomic(using=using):
+        for (model, field, lookup), keys in zip(ROLLUPS, (product_ids, user_ids, days)):
+            rows = model.objects.using(using)
+            source = items
+            if keys is not None:
+                keys = {key for key in keys if key is not None}
+                if not keys:
+                    continue
+                rows = rows.filter(**{f'{field}__in': keys})
+                source = source.filter(**{f'{lookup}__in': keys})
+            rows.delete()
+            batch = []
+            for summary in summarize_items(source, lookup).iterator():
+                batch.append(model(**{field: summary.pop('key')}, **summary))
+                if len(batch) == batch_size:
+                    written += len(model.objects.using(using).bulk_create(batch))
+                    batch = []
+            written += len(model.objects.using(using).bulk_create(batch))
+    return written
+
+
+def stale_rollups(using='default'):
+    """
+    :return: The rollup rows differing from the order items, as (model name, key) pairs
+    """
+    empty = {'units': 0, 'revenue': Decimal('0.00'), 'item_count': 0}
+    stale = []
+    for model, field, lookup in ROLLUPS:
+        items = OrderItem.objects.using(using).filter(order__active=True)
+        expected = {summary.pop('key'): summary for summary in summarize_items(items, lookup)}
+        stored = {row.pop(field): row
+                  for row in model.objects.using(using).values(field, 'units', 'revenue', 'item_count')}
+        for key in expected.keys() | stored.keys():
+            computed, current = expected.get(key, empty), stored.get(key, empty)
+            # The revenue is compared with a tolerance, as the order totals (see OrderQuerySet.stale_totals)
+            if computed['units'] != current['units'] or computed['item_count'] != current['item_count'] or \
+                    abs(Decimal(computed['revenue']) - Decimal(current['revenue'])) >= REVENUE_TOLERANCE:
+                stale.append((model.__name__, key))
+    return stale
+
+
+def increment(model, using, key, units, revenue, item_count):
+    """
+    Adds the deltas to a rollup row. Rows are created by additions only: removing from a missing row
+    means it was deleted along with its product or user.
+    """
+    deltas = {'units': units, 'revenue': revenue, 'item_count': item_count}
+    rows = model.objects.using(using).filter(pk=key)
+    if rows.update(**{field: F(field) + value for field, value in deltas.items()}) or item_count < 0:
+        return
+    try:
+        with transaction.atomic(using=using):
+            model.objects.using(using).create(pk=key, **deltas)
+    except IntegrityError:
+        # Created by a concurrent transaction
+        rows.update(**{field: F(field) + value for field, value in deltas.items()})
+
+
+def apply_deltas(using, product_id, user_id, day, units, revenue, item_count):
+    """Applies the same deltas to the rows of a product, a user and a day"""
+    for model, key in ((ProductSales, product_id), (UserSales, user_id), (DailySales, day)):
+        increment(model, using, key, units, revenue, item_count)
+
+
+def refresh_order_item_keys(using, order_ids, product_ids):
+    """Recomputes the rollup rows of the products, and of the users and days of the orders"""
+    orders = list(Order.all_objects.using(using).filter(pk__in=order_ids).values_list('user_id', 'created'))
+    refresh_rollups(using, product_ids=product_ids, user_ids={user_id for user_id, _ in orders},
+                    days={timezone.localdate(created) for _, created in orders})
+
+
+# These receivers keep the rollups in sync with the order items
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance=None, created=False, using=None, raw=False, **kwargs):
+    if raw:
+        return
+    # The values as loaded: OrderItem.save updates them after the signal
+    loaded = getattr(instance, '_loaded_values', None)
+    if created:
+        order = instance.order
+        if instance.active and order.active:
+            apply_deltas(using, instance.product_id, order.user_id, order_day(order),
+                         instance.quantity, instance.item_total, 1)
+    elif loaded is None or None in loaded.values():
+        # Updated without knowing the previous state: recompute the rows of the current state
+        refresh_order_item_keys(using, {instance.order_id}, {instance.product_id})
+    elif loaded['order_id'] != instance.order_id or loaded['product_id'] != instance.product_id or \
+            loaded['active'] != instance.active:
+        refresh_order_item_keys(using, {loaded['order_id'], instance.order_id},
+                                {loaded['product_id'], instance.product_id})
+    elif loaded['quantity'] != instance.quantity and instance.active and instance.order.active:
+        order = instance.order
+        units = instance.quantity - loaded['quantity']
+        apply_deltas(using, instance.product_id, order.user_id, order_day(order),
+                     units, instance.product.price * units, 0)
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance=None, using=None, **kwargs):
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if not instance.active and not loaded.get('active'):
+        return
+    if loaded.get('quantity') is None or loaded.get('product_id') != instance.product_id or \
+            loaded.get('order_id') != instance.order_id:
+        refresh_order_item_keys(using, {loaded.get('order_id'), instance.order_id},
+                                {loaded.get('product_id'), instance.product_id})
+        return
+    order = Order.objects.using(using).filter(pk=instance.order_id).values('user_id', 'created').first()
+    if order is None:
+        # Deleted, or logically deleted: its items are not in the rollups
+        return
+    apply_deltas(using, instance.product_id, order['user_id'], timezone.localdate(order['created']),
+                 -loaded['quantity'], -instance.product.price * loaded['quantity'], -1)
+
+
+@receiver(orders_bulk_created, sender=Order)
+def orders_created(sender, orders=(), using=None, **kwargs):
+    # Sum the deltas by key first: one increment per product, user and day
+    deltas = {model: defaultdict(lambda: [0, Decimal('0.00'), 0]) for model, _, _ in ROLLUPS}
+    for order, items in orders:
+        if not order.active:
+            continue
+        for item in items:
+            for model, key in ((ProductSales, item.product_id), (UserSales, order.user_id),
+                               (DailySales, order_day(order))):
+                delta = deltas[model][key]
+                delta[0] += item.quantity
+                delta[1] += item.item_total
+                delta[2] += 1
+    for model, rows in deltas.items():
+        for key, (units, revenue, item_count) in rows.items():
+            increment(model, using, key, units, revenue, item_count)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance=None, created=False, using=None, raw=False, **kwargs):
+    # The values as loaded are updated here, after the rollups follow the change
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    if not created and not raw:
+        if loaded.get('active') is not None and loaded['active'] != instance.active:
+            # Logically deleted or restored: the items of the order leave or join the rollups
+            product_ids = OrderItem.objects.using(using).filter(order=instance).values_list('product_id', flat=True)
+            refresh_rollups(using, product_ids=set(product_ids), user_ids={loaded['user_id'], instance.user_id},
+                            days={order_day(instance)})
+        elif loaded.get('user_id') is not None and loaded['user_id'] != instance.user_id:
+            refresh_rollups(using, product_ids=(), user_ids={loaded['user_id'], instance.user_id}, days=())
+    instance._loaded_values = {'user_id': instance.user_id, 'active': instance.active}
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance=None, created=False, using=None, raw=False, **kwargs):
+    # Product.save updates the loaded price after the signal
+    loaded_price = getattr(instance, '_loaded_price', None)
+    if created or raw or loaded_price is None or Decimal(loaded_price) == Decimal(instance.price):
+        return
+    orders = list(Order.objects.using(using).filter(items__product=instance).values_list('user_id', 'created'))
+    refresh_rollups(using, product_ids={instance.pk}, user_ids={user_id for user_id, _ in orders},
+                    days={timezone.localdate(created) for _, created in orders})
@@ -0,0 +1,212 @@
+"""Routing of the reads to the read replicas
+
+The writes always go to the primary database ('default'). The reads of the safe-method requests (GET, HEAD,
+OPTIONS) go to one of the DATABASE_REPLICAS of the settings, chosen per request by ReplicaRoutingMiddleware:
+    - round_robin: the replicas in turn;
+    - least_latency: the replica answering a probe query the fastest (probed every
+      DATABASE_REPLICA_PROBE_INTERVAL seconds). Replicas failing the probe are skipped until the next one.
+
+Read-your-writes: after a client sends a write (POST, PUT, PATCH or DELETE), its reads go to the primary
+for DATABASE_REPLICA_STICKY_SECONDS, so it does not miss its own change while the replicas catch up.
+The clients are identified by their credentials (the Authorization header or the session cookie), and the
+marks are kept in the default cache, shared by the processes.
+
+Reads outside of the requests (commands, receivers of the signals sent by writes) and inside transactions
+go to the primary.
+"""
+import hashlib
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import Error
+from rest_framework.permissions import SAFE_METHODS
+
+# The replica the reads of the current request go to (None: the primary)
+read_alias = ContextVar('read_alias', default=None)
+
+STICKY_KEY = 'store_api:replica:sticky:{}'
+
+
+def replicas():
+    """
+    :return: The aliases of the read replicas
+    """
+    return tuple(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+@contextmanager
+def use_primary(enabled=True):
+    """
+    Context manager sending the reads to the primary database
+
+    :param enabled: Whether the reads go to the primary. When False, the routing does not change
+    """
+    if not enabled:
+        yield
+        return
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+def written_recently(moment):
+    """
+    :param moment: The datetime of a write, or None
+    :return: Whether the replicas may still be missing the write
+    """
+    sticky_seconds = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+    return moment is not None and bool(replicas()) and time.time() - moment.timestamp() < sticky_seconds
+
+
+class RoundRobinSelector:
+    """
+    Class responsible to choose the replicas in turn
+    """
+
+    def __init__(self):
+        self.counter = itertools.count()
+
+    def select(self, aliases):
+        return aliases[next(self.counter) % len(aliases)]
+
+
+class LeastLatencySelector:
+    """
+    Class responsible to choose the replica with the lowest latency of a probe query (SELECT 1)
+
+    The replicas are probed by the first request after DATABASE_REPLICA_PROBE_INTERVAL seconds, one request
+    at a time: the others keep using the previous latencies meanwhile.
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.probed = None
+        self.lock = threading.Lock()
+
+    def probe(self, alias):
+        """
+        :return: The latency in seconds of the replica, or None if it failed
+        """
+        started = time.perf_counter()
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        except Error:
+            # Reconnected by the next probe
+            connections[alias].close()
+            return None
+        return time.perf_counter() - started
+
+    def select(self, aliases):
+        interval = getattr(settings, 'DATABASE_REPLICA_PROBE_INTERVAL', 10)
+        if self.probed is None or time.monotonic() - self.probed >= interval or \
+                set(aliases) != self.latencies.keys():
+            if self.lock.acquire(blocking=self.probed is None):
+                try:
+                    self.latencies = {alias: self.probe(alias) for alias in aliases}
+                    self.probed = time.monotonic()
+                finally:
+                    self.lock.release()
+        available = [(latency, alias) for alias, latency in self.latencies.items()
+                     if latency is not None and alias in aliases]
+        # All the replicas failing: the primary
+        return min(available)[1] if available else DEFAULT_DB_ALIAS
+
+
+SELECTORS = {
+    'round_robin': RoundRobinSelector,
+    'least_latency': LeastLatencySelector,
+}
+_selectors = {}
+
+
+def select_replica():
+    """
+    :return: The alias of the replica for the reads of a request, following DATABASE_REPLICA_SELECTION
+    """
+    aliases = replicas()
+    if not aliases:
+        return None
+    name = getattr(settings, 'DATABASE_REPLICA_SELECTION', 'round_robin')
+    selector = _selectors.get(name)
+    if selector is None:
+        selector = _selectors.setdefault(name, SELECTORS[name]())
+    alias = selector.select(aliases)
+    return None if alias == DEFAULT_DB_ALIAS else alias
+
+
+class ReplicaRouter:
+    """
+    Database router sending the reads of the safe-method requests to the replica chosen for the request,
+    and the writes to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # Explicit: the instances read from a replica are written to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary
+        aliases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replicas receive the schema from the primary
+        if db in replicas():
+            return False
+        return None
+
+
+def client_key(request):
+    """
+    :return: The key identifying the client of the request in the cache, or None for anonymous clients
+    """
+    credential = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if not credential:
+        return None
+    return STICKY_KEY.format(hashlib.sha1(credential.encode()).hexdigest())
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Middleware choosing the database of the reads of each request: a replica for the safe methods, unless
+    the client has written recently, and the primary otherwise
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+
+        key = client_key(request)
+        alias = None
+        if request.method in SAFE_METHODS and not (key is not None and cache.get(key)):
+            alias = select_replica()
+        token = read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+
+        if request.method not in SAFE_METHODS and key is not None:
+            cache.set(key, True, timeout=getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5))
+        return response
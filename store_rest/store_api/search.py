@@ -0,0 +1,441 @@
+"""Product search backends
+
+The product_search endpoint delegates to a search backend, selected by the PRODUCT_SEARCH_BACKEND setting
+(a dotted path to a backend class). When the setting is not defined, the backend matching the database
+vendor is used:
+    PostgresSearchBackend: full text search over a GIN indexed tsvector expression, plus trigram
+        indexes so the substring match does not scan the table
+    SQLiteSearchBackend: FTS5 shadow table (store_api_product_fts), kept in sync through the Product signals
+    DatabaseSearchBackend: plain `icontains` filter, for any other database
+    InMemorySearchBackend: in-process trigram inverted index, for deployments that cannot change the database.
+        It is only used when configured in PRODUCT_SEARCH_BACKEND.
+
+All the backends return the products ranked by relevance, as a lazy result the paginator can slice.
+Only the active products are indexed: logically deleted products are removed from the indexes.
+The database objects used by the backends are created by the 0004_product_search migration.
+"""
+import logging
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+
+def escape_like(value):
+    """Escapes the LIKE wildcards of a value to be matched as a substring"""
+    return '%{}%'.format(re.sub(r'([\\%_])', r'\\\1', value))
+
+
+class DatabaseSearchBackend:
+    """
+    Class responsible to search products in the database with a case insensitive substring match
+    on name and description. It is the fallback of the other backends.
+
+    The index updates of the database backends are written in the transaction of the product write.
+    The backends keeping their index outside the database set `index_on_commit`: their updates wait
+    for the commit, as a rollback would not undo them.
+    """
+    index_on_commit = False
+
+    def search(self, queryset, query):
+        """
+        :param queryset: The products queryset to be searched
+        :param query: The text searched, as informed in the request
+        :return: The matching products, ranked by relevance
+        """
+        return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
+
+    def index(self, product, using='default'):
+        """Updates the search index of a created or updated product"""
+
+    def remove(self, product_id, using='default'):
+        """Removes a deleted product from the search index"""
+
+    def rebuild(self, using='default'):
+        """Rebuilds the search index from the products table"""
+
+    def warm_up(self, using='default'):
+        """Prepares the search index before the first search, when the application starts"""
+
+
+class PostgresSearchBackend(DatabaseSearchBackend):
+    """
+    Class responsible to search products with PostgreSQL full text search.
+    The document expression is indexed (GIN) by the migration, so it must be kept identical to the index one.
+    Products matching only as substring (served by the trigram indexes) are ranked after the full text matches.
+    """
+    config = 'english'
+    document = ("to_tsvector('english', coalesce(\"store_api_product\".\"name\", '') || ' ' || "
+                "coalesce(\"store_api_product\".\"description\", ''))")
+
+    def search(self, queryset, query):
+        like = escape_like(query)
+        return queryset.extra(
+            select={'search_rank': f"ts_rank({self.document}, plainto_tsquery(%s, %s))"},
+            select_params=[self.config, query],
+            where=[f"({self.document} @@ plainto_tsquery(%s, %s) "
+                   "OR \"store_api_product\".\"name\" ILIKE %s "
+                   "OR \"store_api_product\".\"description\" ILIKE %s)"],
+            params=[self.config, query, like, like],
+            order_by=['-search_rank', 'id'],
+        )
+
+
+class SQLiteSearchBackend(DatabaseSearchBackend):
+    """
+    Class responsible to search products with a SQLite FTS5 shadow table.
+    With the trigram tokenizer (SQLite >= 3.34) the match keeps the substring semantics of the fallback;
+    queries shorter than a trigram use the fallback. The name is weighted over the description in the ranking.
+    """
+    table = 'store_api_product_fts'
+    rank = f'bm25({table}, 10.0, 1.0)'
+
+    def __init__(self):
+        # The tokenizer of the shadow table of each database, or None when the table does not exist
+        self.tokenizers = {}
+
+    def tokenizer(self, using):
+        if using not in self.tokenizers:
+            with connections[using].cursor() as cursor:
+                cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = %s", [self.table])
+                row = cursor.fetchone()
+            self.tokenizers[using] = None if row is None else ('trigram' if 'trigram' in row[0] else 'unicode61')
+        return self.tokenizers[using]
+
+    def search(self, queryset, query):
+        tokenizer = self.tokenizer(queryset.db)
+        if tokenizer is None or (tokenizer == 'trigram' and len(query) < 3):
+            return super().search(queryset, query)
+        # Match the query as a phrase, so the FTS operators it may contain are not interpreted.
+        # Without trigrams, match the last token as a prefix.
+        phrase = '"{}"'.format(query.replace('"', '""'))
+        if tokenizer != 'trigram':
+            phrase += '*'
+        return queryset.extra(
+            select={'search_rank': self.rank},
+            tables=[self.table],
+            where=[f'{self.table}.rowid = "store_api_product"."id"', f'{self.table} MATCH %s'],
+            params=[phrase],
+            order_by=['search_rank', 'id'],
+        )
+
+    def index(self, product, using='default'):
+        if self.tokenizer(using) is None:
+            return
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product.pk])
+            cursor.execute(f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)',
+                           [product.pk, product.name, product.description])
+
+    def remove(self, product_id, using='default'):
+        if self.tokenizer(using) is None:
+            return
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [product_id])
+
+    def rebuild(self, using='default'):
+        if self.tokenizer(using) is None:
+            return
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(f'INSERT INTO {self.table} (rowid, name, description) '
+                           f'SELECT id, name, description FROM store_api_product WHERE active')
+
+
+def trigrams(text):
+    """
+    :return: The set of distinct lower case trigrams of a text
+    """
+    text = ' '.join(text.lower().split())
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def contains(postings, product_id):
+    """Binary search of a product id in a sorted posting list"""
+    position = bisect_left(postings, product_id)
+    return position < len(postings) and postings[position] == product_id
+
+
+class InvertedIndex:
+    """
+    Class responsible to keep a trigram inverted index over the product names and descriptions.
+
+    Each trigram has a posting list per field: a sorted array of unsigned ints (4 bytes per product id).
+    The trigram ids of each product are kept (also as an array), so an updated or deleted
+    product can be removed from the postings without its previous text. The lower case texts are kept
+    too: sharing all the trigrams of a query does not make it a substring, so the candidates are checked.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.terms = {}
+        # Posting lists of the name and description fields, by term id
+        self.postings = ([], [])
+        # Term ids of the name and description of each product, by product id
+        self.documents = {}
+        # Lower case name and description of each product, by product id
+        self.texts = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def product_ids(self):
+        with self.lock:
+            return set(self.documents)
+
+    def term_ids(self, text):
+        ids = array('I')
+        for gram in trigrams(text):
+            term_id = self.terms.get(gram)
+            if term_id is None:
+                term_id = self.terms[gram] = len(self.terms)
+                for field_postings in self.postings:
+                    field_postings.append(array('I'))
+            ids.append(term_id)
+        return ids
+
+    def add(self, product_id, name, description):
+        """Indexes a product, replacing its previous version if already indexed"""
+        with self.lock:
+            self.remove(product_id)
+            document = (self.term_ids(name), self.term_ids(description))
+            for field_postings, term_ids in zip(self.postings, document):
+                for term_id in term_ids:
+                    postings = field_postings[term_id]
+                    if not postings or postings[-1] < product_id:
+                        # Products are mostly indexed in primary key order
+                        postings.append(product_id)
+                    else:
+                        postings.insert(bisect_left(postings, product_id), product_id)
+            self.documents[product_id] = document
+            self.texts[product_id] = (name.lower(), description.lower())
+
+    def remove(self, product_id):
+        with self.lock:
+            document = self.documents.pop(product_id, None)
+            if document is None:
+                return
+            del self.texts[product_id]
+            for field_postings, term_ids in zip(self.postings, document):
+                for term_id in term_ids:
+                    postings = field_postings[term_id]
+                    del postings[bisect_left(postings, product_id)]
+
+    def match(self, field, grams, text):
+        """
+        :return: The set of product ids whose field contains the lower case text
+        """
+        field_postings = self.postings[field]
+        lists = []
+        for gram in grams:
+            term_id = self.terms.get(gram)
+            if term_id is None:
+                return set()
+            lists.append(field_postings[term_id])
+        lists.sort(key=len)
+        # Start from the shortest posting list and binary search the others,
+        # then check the candidates have the text as a substring
+        return {product_id for product_id in lists[0]
+                if all(contains(other, product_id) for other in lists[1:]) and text in self.texts[product_id][field]}
+
+    def search(self, query):
+        """
+        :return: The ids of the products containing the query, case insensitive, ranked: products matching
+        in the name first, then by product id. Queries shorter than a trigram are not supported.
+        """
+        grams = trigrams(query)
+        text = query.lower()
+        with self.lock:
+            in_name = self.match(0, grams, text)
+            in_description = self.match(1, grams, text)
+        return sorted(in_name | in_description, key=lambda product_id: (product_id not in in_name, product_id))
+
+    def memory_usage(self):
+        """
+        :return: The approximate number of bytes held by the posting lists, the product term ids and texts
+        """
+        with self.lock:
+            postings = sum(postings.buffer_info()[1] for field in self.postings for postings in field)
+            documents = sum(ids.buffer_info()[1] for document in self.documents.values() for ids in document)
+            texts = sum(len(name) + len(description) for name, description in self.texts.values())
+        return (postings + documents) * array('I').itemsize + texts
+
+
+class RankedProducts:
+    """
+    Class responsible to hold a ranked list of product ids and to load only the sliced products.
+    It is used by the paginator as a queryset: it can be counted and sliced.
+    """
+    ordered = True
+
+    def __init__(self, queryset, product_ids):
+        self.queryset = queryset
+        self.product_ids = product_ids
+
+    def count(self):
+        return len(self.product_ids)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1 or None][0]
+        product_ids = self.product_ids[index]
+        products = self.queryset.in_bulk(product_ids)
+        return [products[product_id] for product_id in product_ids if product_id in products]
+
+
+class InMemorySearchBackend(DatabaseSearchBackend):
+    """
+    Class responsible to search products in an in-process inverted index, without database changes.
+
+    The index is built from a streamed scan of the products when the application is loaded (see warm_up),
+    or else by the first search, then updated by the Product signals of this process, once committed.
+    Changes made by other processes are caught up (by the `updated` field, and the deleted ids by a scan of
+    the primary keys) every PRODUCT_SEARCH_INDEX_REFRESH seconds. Only the requested page of products is loaded from the database.
+    Queries shorter than a trigram use the fallback.
+    """
+    chunk_size = 2000
+    index_on_commit = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inverted_index = None
+        self.synced_at = 0
+        self.synced_until = None
+
+    def search(self, queryset, query):
+        if len(' '.join(query.split())) < 3:
+            return super().search(queryset, query)
+        return RankedProducts(queryset, self.sync(queryset.db).search(query))
+
+    def sync(self, using):
+        """Builds the index, or catches up with the products updated by other processes
+        :return: The synced index
+        """
+        refresh = getattr(settings, 'PRODUCT_SEARCH_INDEX_REFRESH', 60)
+        index = self.inverted_index
+        if index is not None and time.monotonic() - self.synced_at < refresh:
+            return index
+        with self.lock:
+            products = Product.objects.using(using).order_by('pk')
+            if self.inverted_index is None:
+                index = InvertedIndex()
+                products = products.values_list('pk', 'name', 'description', 'active')
+            elif time.monotonic() - self.synced_at >= refresh:
+                # The clocks of the processes may differ slightly: look back a few seconds
+                index = self.inverted_index
+                # The logically deleted products are read too, to be removed
+                products = Product.all_objects.using(using).order_by('pk').filter(
+                    updated__gte=self.synced_until - timedelta(seconds=5)
+                ).values_list('pk', 'name', 'description', 'active')
+            else:
+                return self.inverted_index
+            started = time.monotonic()
+            synced_until = timezone.now()
+            for product_id, name, description, active in products.iterator(chunk_size=self.chunk_size):
+                if active:
+                    index.add(product_id, name, description)
+                else:
+                    index.remove(product_id)
+            if index is self.inverted_index:
+                # The products deleted by other processes leave no row to catch up with: drop the ids
+                # no longer in the table, so the count of the results does not include them
+                stale = index.product_ids().difference(
+                    Product.objects.using(using).values_list('pk', flat=True).iterator(chunk_size=self.chunk_size))
+                for product_id in stale:
+                    index.remove(product_id)
+            self.inverted_index, self.synced_at, self.synced_until = index, started, synced_until
+        return index
+
+    def warm_up(self, using='default'):
+        # Built when the application is loaded (before the server forks the workers, when preloaded),
+        # so the first searches do not wait for the scan of the products
+        try:
+            self.sync(using)
+        except DatabaseError:
+            logger.exception('The search index could not be built: it is built by the first search')
+
+    def index(self, product, using='default'):
+        if self.inverted_index is not None:
+            self.inverted_index.add(product.pk, product.name, product.description)
+
+    def remove(self, product_id, using='default'):
+        if self.inverted_index is not None:
+            self.inverted_index.remove(product_id)
+
+    def rebuild(self, using='default'):
+        # Discard the index: it is built again on the next search
+        with self.lock:
+            self.inverted_index = None
+
+
+VENDOR_BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    :return: The search backend instance configured in PRODUCT_SEARCH_BACKEND or, when not configured,
+    the backend matching the database vendor
+    """
+    global _backend
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    vendor = connections['default'].vendor
+    backend_class = import_string(path) if path else VENDOR_BACKENDS.get(vendor, DatabaseSearchBackend)
+    if _backend is None or type(_backend) is not backend_class:
+        _backend = backend_class()
+    return _backend
+
+
+def update_index(update, using):
+    """Runs an update of the search index in the transaction of the product write, or after its commit
+    for the backends keeping the index outside the database (see index_on_commit)"""
+    if get_search_backend().index_on_commit:
+        transaction.on_commit(update, using=using)
+    else:
+        update()
+
+
+def warm_up_search_index(using='default'):
+    """Prepares the search index of the configured backend. Called when the application is loaded
+    (see store_rest.wsgi and store_rest.asgi)"""
+    get_search_backend().warm_up(using=using)
+
+
+# These receivers keep the search index in sync with the products
+@receiver(post_save, sender=Product)
+def index_product(sender, instance=None, using='default', **kwargs):
+    if instance.active:
+        update_index(lambda: get_search_backend().index(instance, using=using), using)
+    else:
+        # Logically deleted
+        update_index(lambda: get_search_backend().remove(instance.pk, using=using), using)
+
+
+@receiver(post_delete, sender=Product)
+def remove_product(sender, instance=None, using='default', **kwargs):
+    product_id = instance.pk
+    update_index(lambda: get_search_backend().remove(product_id, using=using), using)
@@ -0,0 +1,132 @@
+"""Synthetic store data inserted in bulk, for load tests and benchmarks (see `manage.py seed_store`)
+
+The rows are inserted with bulk_create in chunks, each chunk in its own transaction, bypassing the model
+signals: the tokens, the order totals, the sales rollups, the search index and the catalog cache version are
+written by the seeder instead of per row. The primary keys are assigned by the seeder, after the highest
+existing ones (logically deleted rows included), so the orders reference their users and products (and the
+items their orders) without reading them back.
+Nothing else should write to the store while it is seeded.
+
+The data only depends on the seed and on the existing rows: the same seed over the same database inserts
+the same users, token keys, products and orders.
+"""
+from array import array
+from hashlib import sha1
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import Max
+from rest_framework.authtoken.models import Token
+
+from .caching import bump_catalog_version
+from .models import Order, OrderItem, Product, User
+from .rollups import refresh_rollups
+from .search import get_search_backend
+
+SEED_DOMAIN = 'seed.invalid'
+
+
+def chunks(start, count, size):
+    """
+    :return: Consecutive ranges of at most size numbers, covering count numbers from start
+    """
+    for first in range(start, start + count, size):
+        yield range(first, min(first + size, start + count))
+
+
+def next_pk(model, using):
+    # The base manager also reaches the logically deleted rows, which keep their primary keys
+    return (model._base_manager.using(using).aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+class Seeder:
+    """
+    Class responsible to insert the synthetic users (with their tokens), products, orders and order items
+
+    :param rng: The random.Random generating the data
+    :param password_hash: The password of all the users, hashed once (see make_password)
+    :param chunk_size: Number of rows inserted per transaction
+    :param progress: Optional function called with the name of the rows and the count inserted, after each chunk
+    """
+
+    def __init__(self, rng, password_hash, chunk_size=10000, using='default', progress=None):
+        self.rng = rng
+        self.password_hash = password_hash
+        self.chunk_size = chunk_size
+        self.using = using
+        self.progress = progress or (lambda name, count: None)
+        self.users = range(0)
+        self.products = range(0)
+        # The prices of the seeded products in cents, by position in self.products
+        self.prices = array('q')
+
+    def insert(self, name, model, rows):
+        model.objects.using(self.using).bulk_create(rows)
+        self.progress(name, len(rows))
+
+    def seed_users(self, count):
+        """
+        Inserts count users, each with a token. The token keys are generated from the seed and the user,
+        so seeding again with the same seed does not repeat them
+        """
+        start = next_pk(User, self.using)
+        self.users = range(start, start + count)
+        for pks in chunks(self.users.start, count, self.chunk_size):
+            with transaction.atomic(using=self.using):
+                self.insert('users', User, [User(pk=pk, email=f'user{pk}@{SEED_DOMAIN}', password=self.password_hash)
+                                            for pk in pks])
+                self.insert('tokens', Token, [Token(key=self.token_key(pk), user_id=pk) for pk in pks])
+
+    def token_key(self, user_pk):
+        return sha1(f'{self.rng.getrandbits(160)}:{user_pk}'.encode()).hexdigest()
+
+    def seed_products(self, count):
+        start = next_pk(Product, self.using)
+        self.products = range(start, start + count)
+        self.prices = array('q', (self.rng.randint(100, 50000) for _ in range(count)))
+        for pks in chunks(self.products.start, count, self.chunk_size):
+            with transaction.atomic(using=self.using):
+                self.insert('products', Product, [
+                    Product(pk=pk, name=f'product {pk}', description=f'synthetic product {pk}',
+                            price=Decimal(self.prices[pk - self.products.start]) / 100)
+                    for pk in pks])
+
+    def seed_orders(self, count, max_items):
+        """
+        Inserts count orders of random seeded users, each with 1 to max_items distinct random seeded products.
+        The order totals are computed along with the items, so the orders are not updated afterwards.
+        """
+        if not self.users or len(self.products) < max_items:
+            raise ValueError('The users and at least max_items products must be seeded before the orders')
+        start = next_pk(Order, self.using)
+        for pks in chunks(start, count, self.chunk_size):
+            orders, items = [], []
+            for pk in pks:
+                total = 0
+                picked = self.rng.sample(range(len(self.products)), self.rng.randint(1, max_items))
+                for position in picked:
+                    quantity = self.rng.randint(1, 5)
+                    total += self.prices[position] * quantity
+                    items.append(OrderItem(order_id=pk, product_id=self.products[position], quantity=quantity))
+                orders.append(Order(pk=pk, user_id=self.rng.choice(self.users), order_total=Decimal(total) / 100,
+                                    item_count=len(picked)))
+            with transaction.atomic(using=self.using):
+                self.insert('orders', Order, orders)
+                self.insert('order items', OrderItem, items)
+
+    def finish(self):
+        """
+        Moves the primary key sequences past the seeded rows, then rebuilds the sales rollups
+        and the search index and invalidates the cached catalog, which the bulk inserts bypass
+        """
+        connection = connections[self.using]
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Product, Order, OrderItem])
+        with transaction.atomic(using=self.using):
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+        refresh_rollups(self.using)
+        with transaction.atomic(using=self.using):
+            get_search_backend().rebuild(using=self.using)
+        bump_catalog_version()
@@ -1,7 +1,12 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.validators import UniqueTogetherValidator
 from django.contrib.auth import password_validation
 
-from .models import User, Product, Order, OrderItem
+from .models import User, Product, Order, OrderItem, OrderQuerySet, ProductSales, UserSales, DailySales
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -76,6 +81,10 @@ class OrderItemSerializer(serializers.ModelSerializer):
             'quantity',
             'item_total'
         )
+        # A product is once in an order, among the active items (see the order_item_active_product constraint)
+        validators = [
+            UniqueTogetherValidator(queryset=OrderItem.objects.all(), fields=('order', 'product')),
+        ]
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -85,6 +94,8 @@ class OrderSerializer(serializers.ModelSerializer):
     # Let's consider a nested relationship.
     # The serializer will bring all the items for this order
     items = OrderItemSerializer(many=True, read_only=True)
+    # The total is stored in the order. Keep it rendered as a number, as when it was computed
+    order_total = serializers.ReadOnlyField()
 
     class Meta:
         # The model related to this serializer
@@ -98,3 +109,234 @@ class OrderSerializer(serializers.ModelSerializer):
             'order_total',
         )
 
+
+class ValuesSerializer:
+    """
+    Class responsible to serialize read-only listings from `.values()` rows: no model instances nor
+    serializer fields are created per row, which is most of the CPU time of the model serializers on
+    the listings. The output is the same of the model serializer it replaces (see the contract tests).
+
+    `values` are the columns read: the output fields and the ones the pagination and caching read
+    (created, id, updated). The subclasses implement the classmethod `serialize(rows)`: it receives the rows
+    (see rows), a page or all of them, at once, so the related rows can be read with one query, and returns
+    the serialized rows.
+    """
+    values = ()
+
+    @classmethod
+    def rows(cls, queryset):
+        """
+        :param queryset: The listed queryset
+        :return: The queryset of the rows to be serialized (dictionaries)
+        """
+        return queryset.select_related(None).prefetch_related(None).values(*cls.values)
+
+
+class ProductValuesSerializer(ValuesSerializer):
+    """
+    Class responsible to serialize the product listings, as ProductSerializer
+    """
+    values = ('id', 'name', 'description', 'price', 'created', 'updated')
+    # The representation of the price of ProductSerializer: a string with the decimal places of the model
+    price = ProductSerializer().fields['price']
+
+    @classmethod
+    def serialize(cls, rows):
+        return [{
+            'id': row['id'],
+            'name': row['name'],
+            'description': row['description'],
+            'price': cls.price.to_representation(row['price']),
+        } for row in rows]
+
+
+class OrderValuesSerializer(ValuesSerializer):
+    """
+    Class responsible to serialize the order listings with their items, as OrderSerializer.
+    The items of all the orders are read with one query. The totals are numbers, as in OrderSerializer.
+    """
+    values = ('id', 'user_id', 'order_total', 'created')
+    item_values = ('order_id', 'product_id', 'quantity', 'product__price')
+
+    @classmethod
+    def serialize(cls, rows):
+        rows = list(rows)
+        items = defaultdict(list)
+        # The active items, in the order of the items prefetch (see OrderQuerySet.items_prefetch)
+        for item in OrderItem.objects.filter(order_id__in=[row['id'] for row in rows]).order_by('pk') \
+                .values_list(*cls.item_values):
+            order_id, product_id, quantity, price = item
+            items[order_id].append({
+                'order': order_id,
+                'product': product_id,
+                'quantity': quantity,
+                'item_total': price * quantity,
+            })
+        return [{
+            'id': row['id'],
+            'user': row['user_id'],
+            'items': items[row['id']],
+            'order_total': row['order_total'],
+        } for row in rows]
+
+
+class OrderItemCreateSerializer(serializers.Serializer):
+    """
+    Class responsible to validate the items nested in the orders being created.
+    The products are resolved afterwards, in batch, by the order serializers
+    """
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+
+def resolve_orders(orders, request):
+    """
+    Resolves the users and products referenced by the orders being created, with one query for all the
+    users and one for all the products. Non-staff users can only create orders for themselves.
+
+    :param orders: The validated data of the orders. On success the ids are replaced by the model instances
+    :param request: The request creating the orders
+    :return: The errors of each order, in the same order (empty dicts for the valid ones)
+    """
+    user_ids = {order['user'] for order in orders}
+    product_ids = {item['product'] for order in orders for item in order.get('items', ())}
+    if user_ids == {request.user.id}:
+        users = {request.user.id: request.user}
+    else:
+        users = User.objects.in_bulk(user_ids)
+    products = Product.objects.in_bulk(product_ids)
+
+    errors = []
+    for order in orders:
+        error = {}
+        if order['user'] not in users:
+            error['user'] = [f'Invalid pk "{order["user"]}" - object does not exist.']
+        elif order['user'] != request.user.id and not request.user.is_staff:
+            error['user'] = ['Orders can only be created for the authenticated user.']
+        item_errors = []
+        ordered_products = set()
+        for item in order.get('items', ()):
+            if item['product'] not in products:
+                item_errors.append({'product': [f'Invalid pk "{item["product"]}" - object does not exist.']})
+            elif item['product'] in ordered_products:
+                item_errors.append({'product': ['The product is already in the order.']})
+            else:
+                item_errors.append({})
+            ordered_products.add(item['product'])
+        if any(item_errors):
+            error['items'] = item_errors
+        errors.append(error)
+
+    if not any(errors):
+        for order in orders:
+            order['user'] = users[order['user']]
+            for item in order.get('items', ()):
+                item['product'] = products[item['product']]
+    return errors
+
+
+def create_orders(orders):
+    """
+    Creates the resolved orders and their items (see resolve_orders) in a single transaction
+    :param orders: The validated data of the orders
+    :return: The created orders, with their items loaded for the representation
+    """
+    instances = Order.objects.bulk_create_with_items([
+        (Order(user=order['user']), [OrderItem(**item) for item in order.get('items', ())])
+        for order in orders
+    ])
+    # The inserted items are loaded in a single query: bulk_create does not return their ids in all databases
+    prefetch_related_objects(instances, OrderQuerySet.items_prefetch())
+    return instances
+
+
+class OrderCreateListSerializer(serializers.ListSerializer):
+    """
+    Class responsible to validate and create many orders at once (bulk creation).
+    The orders are validated in batch and created in a single transaction.
+    The maximum number of orders per request is BULK_ORDERS_MAX_SIZE.
+    """
+
+    def to_internal_value(self, data):
+        max_size = getattr(settings, 'BULK_ORDERS_MAX_SIZE', 1000)
+        if isinstance(data, list) and len(data) > max_size:
+            raise serializers.ValidationError(
+                {'non_field_errors': [f'Ensure there are no more than {max_size} orders.']})
+        orders = super().to_internal_value(data)
+        errors = resolve_orders(orders, self.context['request'])
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return orders
+
+    def create(self, validated_data):
+        return create_orders(validated_data)
+
+
+class OrderCreateSerializer(serializers.Serializer):
+    """
+    Class responsible to create an order along with its items (writable nested serialization)
+    The created order is represented by the OrderSerializer, with the computed totals
+    """
+    user = serializers.IntegerField(min_value=1)
+    items = OrderItemCreateSerializer(many=True, required=False)
+
+    class Meta:
+        list_serializer_class = OrderCreateListSerializer
+
+    def validate(self, attrs):
+        # The orders of a bulk creation are resolved together by the list serializer
+        if self.parent is None:
+            errors = resolve_orders([attrs], self.context['request'])
+            if errors[0]:
+                raise serializers.ValidationError(errors[0])
+        return attrs
+
+    def create(self, validated_data):
+        return create_orders([validated_data])[0]
+
+    def to_representation(self, instance):
+        return OrderSerializer(instance, context=self.context).data
+
+
+class ProductSalesSerializer(serializers.ModelSerializer):
+    """
+    Class responsible to serialize the sales rollup of a product, with the product data
+    """
+    product = ProductSerializer(read_only=True)
+
+    class Meta:
+        model = ProductSales
+        fields = (
+            'product',
+            'units',
+            'revenue',
+            'item_count',
+        )
+
+
+class UserSalesSerializer(serializers.ModelSerializer):
+    """
+    Class responsible to serialize the sales rollup of a user (lifetime spend)
+    """
+    class Meta:
+        model = UserSales
+        fields = (
+            'user',
+            'units',
+            'revenue',
+            'item_count',
+        )
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    """
+    Class responsible to serialize the sales rollup of a day
+    """
+    class Meta:
+        model = DailySales
+        fields = (
+            'day',
+            'units',
+            'revenue',
+            'item_count',
+        )
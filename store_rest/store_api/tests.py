@@ -1,19 +1,72 @@
+import asyncio
+import csv
+import json
 import logging
-from django.test import TestCase
+import os
+import re
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import NoReverseMatch
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
 from rest_framework.reverse import reverse
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIRequestFactory, APIClient
 
+from .asgi import CatalogASGIHandler, get_asgi_application, is_catalog_read
+from .authentication import CachedTokenAuthentication
+from .benchmarks import Probe, benchmark_routes, query_growth, regressions, seed_dataset
+from .instrumentation import RequestMetrics
+from .metrics import MmapedValues, ValueStore, merge_process_values
+from .renderers import FastJSONParser, FastJSONRenderer
+from .routers import client_key, select_replica
+from .search import InvertedIndex, get_search_backend, warm_up_search_index
+from .serializers import OrderSerializer, OrderValuesSerializer, ProductSerializer, ProductValuesSerializer
+from .throttling import RouteRateThrottle, SlidingWindowUserThrottle
+from .urls import urlpatterns
+from .views import ProductsViewSet
 from .models import (
     User,
     Product,
     Order,
-    OrderItem
+    OrderItem,
+    ProductSales,
+    UserSales,
+    DailySales
 )
 
 
+@contextmanager
+def commit_hooks(using='default'):
+    """Runs the transaction.on_commit callbacks registered in the block, as the TestCase transaction is never
+    committed (TestCase.captureOnCommitCallbacks is only available from Django 3.2)"""
+    run_on_commit = connections[using].run_on_commit
+    start = len(run_on_commit)
+    yield
+    callbacks = run_on_commit[start:]
+    del run_on_commit[start:]
+    for _, callback in callbacks:
+        callback()
+
+
 class StoreRestTestCase(TestCase):
 
     def define_users(self):
@@ -533,3 +586,1351 @@ class StoreRestTestCase(TestCase):
         # search products with query
         # retrieve products in high orders with multiple products
         pass
+
+
+class OrderTotalsTestCase(TestCase):
+    """Checks the stored order totals are kept in sync with the order items and product prices"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='totals@test.com', password='wefcwefew2')
+        self.product1 = Product.objects.create(name='product1', description='product1', price=Decimal('5.50'))
+        self.product2 = Product.objects.create(name='product2', description='product2', price=Decimal('10.25'))
+        self.order1 = Order.objects.create(user=self.user)
+        self.order2 = Order.objects.create(user=self.user)
+
+    def assertTotals(self, order, total, count):
+        order.refresh_from_db()
+        self.assertEqual(order.order_total, Decimal(total))
+        self.assertEqual(order.item_count, count)
+
+    def test_item_writes_update_totals(self):
+        item1 = OrderItem.objects.create(order=self.order1, product=self.product1, quantity=2)
+        OrderItem.objects.create(order=self.order1, product=self.product2, quantity=1)
+        self.assertTotals(self.order1, '21.25', 2)
+        # update quantity of a loaded item
+        item1 = OrderItem.objects.get(pk=item1.pk)
+        item1.quantity = 4
+        item1.save()
+        self.assertTotals(self.order1, '32.25', 2)
+        # move the item to another order
+        item1.order = self.order2
+        item1.save()
+        self.assertTotals(self.order1, '10.25', 1)
+        self.assertTotals(self.order2, '22.00', 1)
+        # change the product of the item
+        item1.product = self.product2
+        item1.save()
+        self.assertTotals(self.order2, '41.00', 1)
+        # delete the item
+        item1.delete()
+        self.assertTotals(self.order2, '0.00', 0)
+
+    def test_product_price_and_delete_update_totals(self):
+        OrderItem.objects.create(order=self.order1, product=self.product1, quantity=2)
+        OrderItem.objects.create(order=self.order1, product=self.product2, quantity=2)
+        OrderItem.objects.create(order=self.order2, product=self.product1, quantity=1)
+        product1 = Product.objects.get(pk=self.product1.pk)
+        product1.price = Decimal('6.00')
+        product1.save()
+        self.assertTotals(self.order1, '32.50', 2)
+        self.assertTotals(self.order2, '6.00', 1)
+        # cascading delete of the product items
+        product1.delete()
+        self.assertTotals(self.order1, '20.50', 1)
+        self.assertTotals(self.order2, '0.00', 0)
+
+    def test_cascading_deletes_update_totals_once(self):
+        def totals_updates(delete):
+            with CaptureQueriesContext(connection) as context:
+                delete()
+            return [query['sql'] for query in context.captured_queries
+                    if query['sql'].startswith(f'UPDATE "{Order._meta.db_table}"')]
+
+        orders = [self.order1, self.order2] + [Order.objects.create(user=self.user) for _ in range(3)]
+        for order in orders:
+            OrderItem.objects.create(order=order, product=self.product1, quantity=2)
+        OrderItem.objects.create(order=self.order1, product=self.product2, quantity=1)
+        # One update of the orders of the deleted product items, with their prices from the database
+        self.assertEqual(len(totals_updates(Product.objects.get(pk=self.product1.pk).delete)), 1)
+        self.assertTotals(self.order1, '10.25', 1)
+        for order in orders[1:]:
+            self.assertTotals(order, '0.00', 0)
+        # The items of a deleted order leave it along with the order
+        self.assertEqual(totals_updates(Order.objects.get(pk=self.order1.pk).delete), [])
+        self.assertFalse(OrderItem.all_objects.filter(order_id=self.order1.pk).exists())
+
+    def test_rebuild_order_totals_command(self):
+        OrderItem.objects.create(order=self.order1, product=self.product1, quantity=2)
+        call_command('rebuild_order_totals', '--verify', stdout=StringIO())
+        # Bulk updates bypass the maintenance of the totals
+        OrderItem.objects.filter(order=self.order1).update(quantity=3)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_order_totals', '--verify', stdout=StringIO())
+        call_command('rebuild_order_totals', '--chunk-size', '1', stdout=StringIO())
+        self.assertTotals(self.order1, '16.50', 1)
+        self.assertTotals(self.order2, '0.00', 0)
+        call_command('rebuild_order_totals', '--verify', stdout=StringIO())
+
+
+class OrderListingQueriesTestCase(TestCase):
+    """Checks the order listings issue a fixed number of queries, whatever the page size and number of items"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(email='staff@test.com', password='wefcwefew2', is_staff=True)
+        self.customer = User.objects.create_user(email='customer@test.com', password='wefcwefew2')
+        self.products = [
+            Product.objects.create(name=f'product{i}', description='description', price=Decimal('1.50') + i)
+            for i in range(6)]
+        self.client.force_authenticate(user=self.staff)
+
+    def create_orders(self, orders, items):
+        for _ in range(orders):
+            order = Order.objects.create(user=self.customer)
+            for product in self.products[:items]:
+                OrderItem.objects.create(order=order, product=product, quantity=2)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries), response
+
+    def test_order_listings_query_count(self):
+        urls = (
+            reverse('store_api:orders'),
+            reverse('store_api:user_orders', kwargs={'pk': self.customer.pk}),
+            reverse('store_api:order_items'),
+        )
+        self.create_orders(orders=1, items=1)
+        small = [self.count_queries(url)[0] for url in urls]
+        self.create_orders(orders=15, items=6)
+        large = [self.count_queries(url)[0] for url in urls]
+        self.assertEqual(small, large)
+
+        # Nor with the page size
+        for url, queries in zip(urls, large):
+            for page_size in (2, 15):
+                page_queries, response = self.count_queries(f'{url}?page_size={page_size}')
+                self.assertEqual(page_queries, queries, (url, page_size))
+                self.assertEqual(len(response.data['results']), page_size, (url, page_size))
+
+    def test_order_listing_payload(self):
+        self.create_orders(orders=1, items=2)
+        _, response = self.count_queries(reverse('store_api:orders'))
+        order = response.data['results'][0]
+        self.assertEqual(order['order_total'], Decimal('8.00'))
+        self.assertEqual([item['item_total'] for item in order['items']], [Decimal('3.00'), Decimal('5.00')])
+
+
+class HighOrdersTestCase(TestCase):
+    """Checks the high_orders endpoint returns the distinct products of the qualifying orders in one query"""
+
+    def setUp(self):
+        self.client = APIClient()
+        user = User.objects.create_user(email='high@test.com', password='wefcwefew2')
+        self.client.force_authenticate(user=user)
+        self.p1, self.p2, self.p3, self.p4 = [
+            Product.objects.create(name=f'product{i}', description='description', price=Decimal(price))
+            for i, price in enumerate(('60.00', '50.00', '150.00', '10.00'))]
+        orders = (
+            ((self.p1, 1), (self.p2, 1)),  # 110 with 2 products: qualifies
+            ((self.p3, 1),),  # 150 with 1 product
+            ((self.p1, 1), (self.p4, 1)),  # 70 with 2 products
+            ((self.p2, 2), (self.p4, 1)),  # 110 with 2 products: qualifies
+        )
+        for items in orders:
+            order = Order.objects.create(user=user)
+            for product, quantity in items:
+                OrderItem.objects.create(order=order, product=product, quantity=quantity)
+
+    def get_high_orders(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('store_api:high_orders'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['id'] for product in response.data]
+
+    def test_high_orders_from_stored_totals(self):
+        self.assertEqual(self.get_high_orders(), [self.p1.pk, self.p2.pk, self.p4.pk])
+
+    @override_settings(HIGH_ORDERS_USE_STORED_TOTALS=False)
+    def test_high_orders_from_items(self):
+        self.assertEqual(self.get_high_orders(), [self.p1.pk, self.p2.pk, self.p4.pk])
+
+
+class ProductSearchTestCase(TestCase):
+    """Checks the product search ranks, paginates and follows the product writes"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(email='search@test.com', password='wefcwefew2'))
+        with commit_hooks():
+            self.described = Product.objects.create(name='Chair', description='A blue keyboard stand', price='9.90')
+            self.named = Product.objects.create(name='Blue Keyboard', description='Mechanical', price='59.90')
+            self.other = Product.objects.create(name='Mouse', description='Wireless', price='19.90')
+
+    def search(self, payload):
+        response = self.client.get(reverse('store_api:product_search', kwargs={'payload': payload}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [product['id'] for product in response.data['results']]
+
+    def test_search_ranks_name_matches_first(self):
+        self.assertEqual(self.search('keyboard'), [self.named.pk, self.described.pk])
+        # Substrings match, case insensitive
+        self.assertEqual(self.search('OUS'), [self.other.pk])
+        self.assertEqual(self.search('ir'), [self.described.pk, self.other.pk])
+        self.assertEqual(self.search('nothing'), [])
+
+    def test_search_follows_product_writes(self):
+        self.other.name = 'Keyboard cover'
+        with commit_hooks():
+            self.other.save()
+        self.assertEqual(set(self.search('keyboard')[:2]), {self.named.pk, self.other.pk})
+        with commit_hooks():
+            self.named.delete()
+        self.assertNotIn(self.named.pk, self.search('keyboard'))
+
+    def test_search_matches_the_query_as_a_substring(self):
+        # All the trigrams of the query are in 'Blue Keyboard', but not the query itself
+        self.assertEqual(self.search('blue keys keyboard'), [])
+        self.assertEqual(self.search('blue key'), [self.named.pk, self.described.pk])
+
+    def test_rolled_back_writes_are_not_indexed(self):
+        self.search('keyboard')
+        try:
+            with transaction.atomic():
+                Product.objects.create(name='Keyboard tray', description='Rolled back', price='1.00')
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(self.search('keyboard'), [self.named.pk, self.described.pk])
+
+    def test_search_is_paginated(self):
+        Product.objects.bulk_create(
+            [Product(name=f'Keyboard {i}', description='bulk', price='1.00') for i in range(15)])
+        call_command('rebuild_search_index', stdout=StringIO())
+        response = self.client.get(reverse('store_api:product_search', kwargs={'payload': 'keyboard'}))
+        self.assertEqual(response.data['count'], 17)
+        self.assertEqual(len(response.data['results']), 10)
+
+
+@override_settings(PRODUCT_SEARCH_BACKEND='store_api.search.InMemorySearchBackend')
+class InMemoryProductSearchTestCase(ProductSearchTestCase):
+    """Runs the product search checks against the in-process inverted index"""
+
+    def setUp(self):
+        super().setUp()
+        # The index outlives the test transactions: build it again from this test data
+        get_search_backend().rebuild()
+
+    def test_warm_up(self):
+        warm_up_search_index()
+        backend = get_search_backend()
+        self.assertEqual(len(backend.inverted_index), 3)
+        with self.assertNumQueries(1):
+            # Only the page of products is loaded
+            self.assertEqual(list(backend.search(Product.objects.all(), 'keyboard')), [self.named, self.described])
+
+    @override_settings(PRODUCT_SEARCH_INDEX_REFRESH=0)
+    def test_sync_drops_products_deleted_by_other_processes(self):
+        self.assertEqual(self.search('keyboard'), [self.named.pk, self.described.pk])
+        # A delete without the signals of this process
+        Product.objects.filter(pk=self.named.pk)._raw_delete('default')
+        response = self.client.get(reverse('store_api:product_search', kwargs={'payload': 'keyboard'}))
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual([product['id'] for product in response.data['results']], [self.described.pk])
+
+    def test_inverted_index(self):
+        index = InvertedIndex()
+        index.add(2, 'Blue keyboard', 'mechanical')
+        index.add(1, 'Chair', 'blue KEYBOARD stand')
+        self.assertEqual(index.search('keyboard'), [2, 1])
+        self.assertEqual(index.search('chai'), [1])
+        index.add(1, 'Chair', 'wooden')
+        self.assertEqual(index.search('keyboard'), [2])
+        index.remove(2)
+        self.assertEqual(index.search('keyboard'), [])
+        self.assertEqual(len(index), 1)
+        self.assertGreater(index.memory_usage(), 0)
+
+
+class CatalogCacheTestCase(TestCase):
+    """Checks the product list and detail are served from the cache and revalidated with ETag/Last-Modified"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(email='cache@test.com', password='wefcwefew2'))
+        self.product = Product.objects.create(name='product1', description='description', price='5.50')
+
+    def test_product_list_is_cached_until_a_product_changes(self):
+        url = reverse('store_api:products')
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        self.product.price = Decimal('6.50')
+        with commit_hooks():
+            self.product.save()
+        third = self.client.get(url)
+        self.assertNotEqual(third['ETag'], first['ETag'])
+        self.assertEqual(third.data['results'][0]['price'], '6.50')
+
+    def test_rolled_back_writes_keep_the_cached_catalog(self):
+        url = reverse('store_api:products')
+        first = self.client.get(url)
+        try:
+            with transaction.atomic():
+                Product.objects.create(name='product2', description='rolled back', price='1.00')
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url)['ETag'], first['ETag'])
+
+    def test_conditional_requests(self):
+        url = reverse('store_api:product', kwargs={'pk': self.product.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(not_modified.content, b'')
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(modified.status_code, status.HTTP_200_OK)
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    """Checks the tokens are resolved from the cache and revoked on token deletion or user deactivation"""
+
+    def setUp(self):
+        cache.clear()
+        CachedTokenAuthentication.token_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='token@test.com', password='wefcwefew2')
+        self.token = Token.objects.get(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('store_api:user', kwargs={'pk': self.user.pk})
+
+    def test_token_is_resolved_from_the_cache(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        hits = CachedTokenAuthentication.token_cache.stats()['hits']
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.assertEqual(len(second.captured_queries), len(first.captured_queries) - 1)
+        self.assertEqual(CachedTokenAuthentication.token_cache.stats()['hits'], hits + 1)
+
+    def test_revoked_tokens_are_not_served_from_the_cache(self):
+        # Rejected credentials answer 403, as SessionAuthentication is the first authentication class
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        with commit_hooks():
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_active = True
+        with commit_hooks():
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+        with commit_hooks():
+            self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+
+class OwnershipTestCase(TestCase):
+    """Checks the ownership is verified without extra queries and the listings only load the user rows"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(email='owner@test.com', password='wefcwefew2')
+        self.other = User.objects.create_user(email='other@test.com', password='wefcwefew2')
+        product = Product.objects.create(name='product1', description='description', price='5.50')
+        self.order = Order.objects.create(user=self.owner)
+        self.item = OrderItem.objects.create(order=self.order, product=product)
+        other_order = Order.objects.create(user=self.other)
+        OrderItem.objects.create(order=other_order, product=product)
+
+    def test_object_ownership_checks_do_not_query(self):
+        self.client.force_authenticate(user=self.owner)
+        # The order joined with its user, then the items with their products
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('store_api:order', kwargs={'pk': self.order.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The item joined with its order and product
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('store_api:order_item', kwargs={'pk': self.item.pk}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=self.other)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('store_api:order', kwargs={'pk': self.order.pk}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.get(reverse('store_api:order_item', kwargs={'pk': self.item.pk}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_listings_are_filtered_by_owner(self):
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(reverse('store_api:order_items'))
+        self.assertEqual([item['order'] for item in response.data['results']], [self.order.pk])
+
+        self.owner.is_staff = True
+        self.client.force_authenticate(user=self.owner)
+        response = self.client.get(reverse('store_api:order_items'))
+        self.assertEqual(response.data['count'], 2)
+
+
+class BulkOrderCreationTestCase(TestCase):
+    """Checks the orders are created with their items in a single request, validated in batch"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='buyer@test.com', password='wefcwefew2')
+        self.other = User.objects.create_user(email='other@test.com', password='wefcwefew2')
+        self.product1 = Product.objects.create(name='product1', description='product1', price=Decimal('5.50'))
+        self.product2 = Product.objects.create(name='product2', description='product2', price=Decimal('10.25'))
+        self.client.force_authenticate(user=self.user)
+
+    def test_bulk_creation(self):
+        orders = [
+            {'user': self.user.pk, 'items': [{'product': self.product1.pk, 'quantity': 2},
+                                             {'product': self.product2.pk}]},
+            {'user': self.user.pk, 'items': [{'product': self.product2.pk, 'quantity': 3}]},
+            {'user': self.user.pk},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('store_api:orders_bulk_create'), data=orders, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([order['order_total'] for order in response.data], [21.25, 30.75, 0])
+        self.assertEqual([len(order['items']) for order in response.data], [2, 1, 0])
+        # One product lookup for all the orders and one insert for all the items
+        statements = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(len([sql for sql in statements if sql.startswith('SELECT')
+                              and 'FROM "store_api_product"' in sql]), 1)
+        self.assertEqual(len([sql for sql in statements if sql.startswith('INSERT INTO "store_api_orderitem"')]), 1)
+        # The stored totals match the items
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 3)
+        self.assertFalse(Order.objects.stale_totals().exists())
+
+    def test_bulk_creation_is_validated_in_batch(self):
+        orders = [
+            {'user': self.user.pk, 'items': [{'product': self.product1.pk}]},
+            {'user': self.user.pk, 'items': [{'product': 999}, {'product': self.product2.pk, 'quantity': 0}]},
+            {'user': self.other.pk, 'items': [{'product': self.product2.pk}, {'product': self.product2.pk}]},
+        ]
+        response = self.client.post(reverse('store_api:orders_bulk_create'), data=orders, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertIn('quantity', response.data[1]['items'][1])
+        orders[1]['items'][1]['quantity'] = 1
+        response = self.client.post(reverse('store_api:orders_bulk_create'), data=orders, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('product', response.data[1]['items'][0])
+        self.assertIn('user', response.data[2])
+        self.assertIn('product', response.data[2]['items'][1])
+        # Nothing is created when any order is invalid
+        self.assertFalse(Order.objects.exists())
+
+        # Staff users can create orders for other users
+        self.user.is_staff = True
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse('store_api:orders_bulk_create'), data=[orders[2]], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('user', response.data[0])
+
+    def test_nested_order_creation(self):
+        self.user.is_staff = True
+        self.client.force_authenticate(user=self.user)
+        order = {'user': self.other.pk, 'items': [{'product': self.product1.pk, 'quantity': 2}]}
+        response = self.client.post(reverse('store_api:orders_create'), data=order, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['user'], self.other.pk)
+        self.assertEqual(response.data['order_total'], 11.0)
+        response = self.client.post(reverse('store_api:orders_create'), data={'user': 999}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('user', response.data)
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Checks the listings are paginated by keyset on (created, id), including rows created at the same time"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='pages@test.com', password='wefcwefew2', is_staff=True)
+        for _ in range(25):
+            Order.objects.create(user=self.user)
+        # Ties on created are ordered by id
+        Order.objects.filter(pk__lte=Order.objects.order_by('pk')[12].pk).update(created=timezone.now())
+        self.client.force_authenticate(user=self.user)
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [order['id'] for order in response.data['results']]
+            url, pages = response.data['next'], pages + 1
+        return ids, pages
+
+    def test_walk_forward_and_backward(self):
+        expected = list(Order.objects.order_by('created', 'id').values_list('pk', flat=True))
+        ids, pages = self.walk(reverse('store_api:orders'))
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+        first = self.client.get(reverse('store_api:orders'))
+        self.assertEqual(first.data['count'], 25)
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual([order['id'] for order in back.data['results']], expected[:10])
+        self.assertIsNone(back.data['previous'])
+        self.assertEqual(self.client.get(back.data['next']).data['results'], second.data['results'])
+
+    def test_page_size_and_count_options(self):
+        response = self.client.get(reverse('store_api:orders'), {'page_size': 5, 'count': 'false'})
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertNotIn('count', response.data)
+        response = self.client.get(reverse('store_api:orders'), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        # The page size of the user orders endpoint does not change the other listings
+        response = self.client.get(reverse('store_api:user_orders', kwargs={'pk': self.user.pk}))
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(self.client.get(reverse('store_api:users')).data['results']), 1)
+
+    def test_deep_pages_do_not_offset(self):
+        first = self.client.get(reverse('store_api:orders'), {'count': 'false'})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first.data['next'])
+        self.assertFalse([query for query in queries.captured_queries if 'OFFSET' in query['sql']])
+
+
+class OrderExportTestCase(TestCase):
+    """Checks the streaming export of the orders with their items"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(email='staff@test.com', password='wefcwefew2', is_staff=True)
+        self.user = User.objects.create_user(email='buyer@test.com', password='wefcwefew2')
+        product1 = Product.objects.create(name='product1', description='product1', price=Decimal('5.50'))
+        product2 = Product.objects.create(name='product2, large', description='product2', price=Decimal('10.25'))
+        self.order1 = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=self.order1, product=product1, quantity=2)
+        OrderItem.objects.create(order=self.order1, product=product2)
+        self.order2 = Order.objects.create(user=self.user)
+        self.order3 = Order.objects.create(user=self.staff)
+        OrderItem.objects.create(order=self.order3, product=product2, quantity=3)
+
+    def export(self, **params):
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.get(reverse('store_api:orders_export'), params, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_export(self):
+        orders = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([order['id'] for order in orders], [self.order1.pk, self.order2.pk, self.order3.pk])
+        self.assertEqual(orders[0]['order_total'], '21.25')
+        self.assertEqual([item['item_total'] for item in orders[0]['items']], ['11.00', '10.25'])
+        self.assertEqual(orders[1]['items'], [])
+        self.assertEqual(orders[2]['items'][0]['quantity'], 3)
+
+    def test_csv_export_and_filters(self):
+        rows = list(csv.DictReader(StringIO(self.export(output='csv'))))
+        self.assertEqual([row['order_id'] for row in rows],
+                         [str(self.order1.pk)] * 2 + [str(self.order2.pk), str(self.order3.pk)])
+        self.assertEqual(rows[1]['product_name'], 'product2, large')
+        self.assertEqual(rows[2]['item_id'], '')
+
+        Order.objects.filter(pk=self.order1.pk).update(created=timezone.now() - timezone.timedelta(days=10))
+        since = (timezone.now() - timezone.timedelta(days=1)).date().isoformat()
+        rows = list(csv.DictReader(StringIO(self.export(output='csv', created_after=since))))
+        self.assertEqual({row['order_id'] for row in rows}, {str(self.order2.pk), str(self.order3.pk)})
+
+        response = self.client.get(reverse('store_api:orders_export'), {'created_after': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse('store_api:orders_export'), {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('store_api:orders_export'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_orders_command(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command('export_orders', '--output', 'csv', '--chunk-size', '1', stdout=stdout, stderr=stderr)
+        self.assertEqual(len(stdout.getvalue().splitlines()), 5)
+        self.assertIn('rows/s', stderr.getvalue())
+
+
+class SalesRollupsTestCase(TestCase):
+    """Checks the sales rollups follow the order items writes and are exposed by the reporting endpoints"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(email='staff@test.com', password='wefcwefew2', is_staff=True)
+        self.user = User.objects.create_user(email='buyer@test.com', password='wefcwefew2')
+        self.product1 = Product.objects.create(name='product1', description='product1', price=Decimal('5.50'))
+        self.product2 = Product.objects.create(name='product2', description='product2', price=Decimal('10.25'))
+        self.order = Order.objects.create(user=self.user)
+
+    def assertSales(self, model, key, units, revenue, item_count):
+        sales = model.objects.filter(pk=key).values('units', 'revenue', 'item_count').first() or \
+            {'units': 0, 'revenue': Decimal('0.00'), 'item_count': 0}
+        self.assertEqual((sales['units'], sales['revenue'], sales['item_count']),
+                         (units, Decimal(revenue), item_count))
+
+    def test_rollups_follow_item_writes(self):
+        item = OrderItem.objects.create(order=self.order, product=self.product1, quantity=2)
+        OrderItem.objects.create(order=self.order, product=self.product2)
+        self.assertSales(ProductSales, self.product1.pk, 2, '11.00', 1)
+        self.assertSales(UserSales, self.user.pk, 3, '21.25', 2)
+        self.assertSales(DailySales, timezone.localdate(self.order.created), 3, '21.25', 2)
+
+        item = OrderItem.objects.get(pk=item.pk)
+        item.quantity = 4
+        item.save()
+        self.assertSales(ProductSales, self.product1.pk, 4, '22.00', 1)
+        self.assertSales(UserSales, self.user.pk, 5, '32.25', 2)
+        # moved to an order of another user
+        item.order = Order.objects.create(user=self.staff)
+        item.save()
+        self.assertSales(UserSales, self.user.pk, 1, '10.25', 1)
+        self.assertSales(UserSales, self.staff.pk, 4, '22.00', 1)
+        # product price change
+        product2 = Product.objects.get(pk=self.product2.pk)
+        product2.price = Decimal('20.00')
+        product2.save()
+        self.assertSales(ProductSales, self.product2.pk, 1, '20.00', 1)
+        self.assertSales(UserSales, self.user.pk, 1, '20.00', 1)
+        item.delete()
+        self.assertSales(ProductSales, self.product1.pk, 0, '0.00', 0)
+        self.assertSales(UserSales, self.staff.pk, 0, '0.00', 0)
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+    def test_bulk_orders_and_rebuild(self):
+        self.client.force_authenticate(user=self.user)
+        orders = [{'user': self.user.pk, 'items': [{'product': self.product1.pk, 'quantity': 2}]},
+                  {'user': self.user.pk, 'items': [{'product': self.product1.pk}, {'product': self.product2.pk}]}]
+        response = self.client.post(reverse('store_api:orders_bulk_create'), data=orders, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertSales(ProductSales, self.product1.pk, 3, '16.50', 2)
+        self.assertSales(UserSales, self.user.pk, 4, '26.75', 3)
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+        # Writes bypassing the signals are found by the verification and fixed by the rebuild
+        OrderItem.objects.filter(product=self.product2).update(quantity=5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', '--verify', stdout=StringIO())
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertSales(UserSales, self.user.pk, 8, '67.75', 3)
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+    def test_reporting_endpoints(self):
+        OrderItem.objects.create(order=self.order, product=self.product1, quantity=10)
+        OrderItem.objects.create(order=self.order, product=self.product2, quantity=1)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('store_api:user_sales', kwargs={'pk': self.user.pk}))
+        self.assertEqual(response.data, {'user': self.user.pk, 'units': 11, 'revenue': '65.25', 'item_count': 2})
+        response = self.client.get(reverse('store_api:user_sales', kwargs={'pk': self.staff.pk}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get(reverse('store_api:products_top')).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.get(reverse('store_api:user_sales', kwargs={'pk': self.staff.pk}))
+        self.assertEqual(response.data['revenue'], '0.00')
+        response = self.client.get(reverse('store_api:products_top'))
+        self.assertEqual([sales['product']['id'] for sales in response.data], [self.product1.pk, self.product2.pk])
+        response = self.client.get(reverse('store_api:products_top'), {'by': 'units', 'limit': 1})
+        self.assertEqual(len(response.data), 1)
+        today = timezone.localdate(self.order.created).isoformat()
+        response = self.client.get(reverse('store_api:orders_daily_sales'), {'since': today})
+        self.assertEqual(response.data, [{'day': today, 'units': 11, 'revenue': '65.25', 'item_count': 2}])
+        response = self.client.get(reverse('store_api:orders_daily_sales'), {'until': '2000-01-01'})
+        self.assertEqual(response.data, [])
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Query plans are only checked on SQLite and PostgreSQL')
+class QueryPlanTestCase(TestCase):
+    """Checks the hot query shapes are served by indexes: fails if any of them regresses to a full table scan"""
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are cheaper to scan: only fall back to a scan when no index can be used
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndexes(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+        else:
+            scans = [line for line in plan.splitlines() if re.search(r'\bSCAN\b', line) and
+                     not re.search(r'USING (COVERING )?INDEX|VIRTUAL TABLE INDEX', line)]
+            self.assertEqual(scans, [], plan)
+
+    def test_listings(self):
+        now = timezone.now()
+        after = Q(created__gt=now) | Q(created=now, id__gt=1)
+        for model in (Order, OrderItem, Product):
+            # First and following keyset pages, all rows and the active rows only
+            self.assertUsesIndexes(model.objects.order_by('created', 'id')[:11])
+            self.assertUsesIndexes(model.objects.filter(after).order_by('created', 'id')[:11])
+            self.assertUsesIndexes(model.objects.filter(active=True).order_by('created', 'id')[:11])
+
+    def test_user_orders(self):
+        self.assertUsesIndexes(Order.objects.filter(user_id=1).order_by('created', 'id')[:11])
+        self.assertUsesIndexes(Order.objects.filter(user_id=1, active=True).order_by('created', 'id')[:11])
+        self.assertUsesIndexes(OrderItem.objects.filter(order__user_id=1).order_by('created', 'id')[:11])
+        # The items prefetched for a page of orders
+        self.assertUsesIndexes(OrderItem.objects.filter(order_id__in=[1, 2]).select_related('product'))
+
+    def test_reports(self):
+        self.assertUsesIndexes(Product.objects.in_high_orders())
+        self.assertUsesIndexes(Order.objects.filter(items__product_id=1))
+        self.assertUsesIndexes(ProductSales.objects.select_related('product').order_by('-revenue')[:10])
+
+    def test_search(self):
+        if connection.vendor == 'sqlite' and 'store_api_product_fts' not in connection.introspection.table_names():
+            self.skipTest('SQLite without FTS5')
+        self.assertUsesIndexes(get_search_backend().search(Product.objects.all(), 'product'))
+
+
+class SoftDeleteTestCase(TestCase):
+    """Checks DELETE flags the rows as not active and the default managers, totals, rollups and search skip them"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(email='staff@test.com', password='wefcwefew2', is_staff=True)
+        self.user = User.objects.create_user(email='buyer@test.com', password='wefcwefew2')
+        self.product1 = Product.objects.create(name='keyboard', description='product1', price=Decimal('5.50'))
+        self.product2 = Product.objects.create(name='monitor', description='product2', price=Decimal('10.25'))
+        self.order = Order.objects.create(user=self.user)
+        self.item1 = OrderItem.objects.create(order=self.order, product=self.product1, quantity=2)
+        self.item2 = OrderItem.objects.create(order=self.order, product=self.product2)
+
+    def test_order_item_soft_delete(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(reverse('store_api:order_item', kwargs={'pk': self.item1.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(OrderItem.objects.filter(pk=self.item1.pk).exists())
+        self.assertFalse(OrderItem.all_objects.get(pk=self.item1.pk).active)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.order_total, order.item_count), (Decimal('10.25'), 1))
+        self.assertEqual(UserSales.objects.get(pk=self.user.pk).revenue, Decimal('10.25'))
+        response = self.client.get(reverse('store_api:order', kwargs={'pk': self.order.pk}))
+        self.assertEqual([item['product'] for item in response.data['items']], [self.product2.pk])
+
+        # The product can be added again to the order
+        response = self.client.post(reverse('store_api:order_items'),
+                                    data={'order': self.order.pk, 'product': self.product1.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse('store_api:order_items'),
+                                    data={'order': self.order.pk, 'product': self.product1.pk, 'quantity': 1})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).order_total, Decimal('15.75'))
+        call_command('rebuild_order_totals', '--verify', stdout=StringIO())
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+    def test_order_soft_delete(self):
+        self.client.force_authenticate(user=self.staff)
+        self.assertEqual(self.client.get(reverse('store_api:orders')).data['count'], 1)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(reverse('store_api:order', kwargs={'pk': self.order.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(reverse('store_api:order', kwargs={'pk': self.order.pk})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(user=self.staff)
+        self.assertEqual(self.client.get(reverse('store_api:orders')).data['count'], 0)
+        self.assertTrue(Order.all_objects.filter(pk=self.order.pk).exists())
+        # The items are deleted with their order
+        self.assertEqual(self.client.get(reverse('store_api:order_items')).data['results'], [])
+        self.assertEqual(self.client.get(reverse('store_api:order_item', kwargs={'pk': self.item1.pk})).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertFalse(OrderItem.all_objects.filter(order=self.order, active=True).exists())
+        # The items of deleted orders are not sales
+        self.assertFalse(UserSales.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(ProductSales.objects.filter(pk=self.product1.pk).exists())
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+
+    def test_product_soft_delete(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(reverse('store_api:product', kwargs={'pk': self.product1.pk}))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.delete(reverse('store_api:product', kwargs={'pk': self.product1.pk}))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(reverse('store_api:products'))
+        self.assertEqual([product['id'] for product in response.data['results']], [self.product2.pk])
+        response = self.client.get(reverse('store_api:product_search', kwargs={'payload': 'keyboard'}))
+        self.assertEqual(response.data['count'], 0)
+        # The orders keep the deleted product
+        response = self.client.get(reverse('store_api:order', kwargs={'pk': self.order.pk}))
+        self.assertEqual(response.data['order_total'], 21.25)
+        # It cannot be ordered anymore
+        response = self.client.post(reverse('store_api:orders_bulk_create'), format='json',
+                                    data=[{'user': self.staff.pk, 'items': [{'product': self.product1.pk}]}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DatabaseTestCase(TestCase):
+    """Checks the health endpoint reports the databases and the cache, and the SQLite pragmas are applied"""
+    # The health check queries every database, including the replicas
+    databases = '__all__'
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_health(self):
+        response = self.client.get(reverse('store_api:health'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'ok')
+        self.assertTrue(response.data['checks']['database:default']['ok'])
+        self.assertTrue(response.data['checks']['cache']['ok'])
+
+    def test_health_unavailable(self):
+        with mock.patch('store_api.database.cache.get', return_value=None):
+            response = self.client.get(reverse('store_api:health'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(response.data['checks']['cache']['ok'])
+
+    def test_health_errors_are_not_exposed(self):
+        with mock.patch('store_api.database.cache.set', side_effect=ConnectionError('redis://admin@cache-host')), \
+                self.assertLogs('store_api.database', 'ERROR') as logs:
+            response = self.client.get(reverse('store_api:health'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data['checks']['cache'], {'ok': False})
+        self.assertNotIn(b'cache-host', response.content)
+        self.assertIn('cache-host', logs.output[0])
+
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """Checks the reads of the GET requests go to the replica, except for the clients that wrote recently"""
+    # A second connection to the test database stands in for the replica
+    databases = {'default', 'replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        connections.databases['replica'] = dict(connections['default'].settings_dict, TEST={'MIRROR': 'default'})
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+
+    def setUp(self):
+        cache.clear()
+        CachedTokenAuthentication.token_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='replica@test.com', password='wefcwefew2')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=self.user).key}')
+        self.product = Product.objects.create(name='keyboard', description='product1', price=Decimal('5.50'))
+        self.order = Order.objects.create(user=self.user)
+        self.item = OrderItem.objects.create(order=self.order, product=self.product)
+        self.url = reverse('store_api:order', kwargs={'pk': self.order.pk})
+
+    def queried(self, method, url, **kwargs):
+        """
+        :return: The response and the tables queried on the primary and on the replica
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, ' '.join(query['sql'] for query in primary), \
+            ' '.join(query['sql'] for query in replica)
+
+    def test_reads_go_to_the_replica(self):
+        response, primary, replica = self.queried('get', self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('"store_api_order"', replica)
+        self.assertNotIn('"store_api_order"', primary)
+
+    def test_read_your_writes(self):
+        response, primary, replica = self.queried(
+            'put', reverse('store_api:order_item', kwargs={'pk': self.item.pk}),
+            data={'order': self.order.pk, 'product': self.product.pk, 'quantity': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(replica, '')
+        # The next reads of the client go to the primary, the reads of other clients to the replica
+        response, primary, replica = self.queried('get', self.url)
+        self.assertEqual(response.data['items'][0]['quantity'], 3)
+        self.assertIn('"store_api_order"', primary)
+        self.assertNotIn('"store_api_order"', replica)
+        cache.delete(client_key(response.wsgi_request))
+        response, primary, replica = self.queried('get', self.url)
+        self.assertIn('"store_api_order"', replica)
+
+    def test_catalog_changes_are_read_from_the_primary(self):
+        # The product was just created: the catalog cache is filled from the primary
+        response, primary, replica = self.queried('get', reverse('store_api:products'))
+        self.assertEqual(response.data['count'], 1)
+        self.assertIn('"store_api_product"', primary)
+        self.assertNotIn('"store_api_product"', replica)
+
+    def test_replica_selection(self):
+        for selection in ('round_robin', 'least_latency'):
+            with self.settings(DATABASE_REPLICA_SELECTION=selection):
+                self.assertEqual(select_replica(), 'replica')
+        with self.settings(DATABASE_REPLICAS=[]):
+            self.assertIsNone(select_replica())
+
+
+class CatalogASGIHandlerTestCase(TransactionTestCase):
+    """Checks the ASGI handler serves the catalog reads from its thread pool and the other requests as Django"""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user(email='asgi@test.com', password='wefcwefew2', is_staff=True)
+        self.token = Token.objects.get(user=self.staff)
+        self.product = Product.objects.create(name='keyboard', description='product1', price=Decimal('5.50'))
+
+    def request(self, method, path, body=b''):
+        scope = {
+            'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'root_path': '',
+            'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 0),
+            'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                        (b'content-length', str(len(body)).encode()),
+                        (b'authorization', f'Token {self.token.key}'.encode())],
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        async def main():
+            handler = CatalogASGIHandler()
+            try:
+                await handler(scope, receive, send)
+            finally:
+                handler.executor.shutdown()
+
+        asyncio.run(main())
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    def test_catalog_reads(self):
+        factory = APIRequestFactory()
+        self.assertTrue(is_catalog_read(factory.get(f'/product/{self.product.pk}')))
+        self.assertTrue(is_catalog_read(factory.get('/products/search/keyboard')))
+        self.assertFalse(is_catalog_read(factory.put(f'/product/{self.product.pk}')))
+        self.assertFalse(is_catalog_read(factory.get('/orders/')))
+
+        threads = []
+        retrieve = ProductsViewSet.retrieve
+
+        def spy(view, request, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return retrieve(view, request, *args, **kwargs)
+
+        with mock.patch.object(ProductsViewSet, 'retrieve', spy):
+            status_code, body = self.request('GET', f'/product/{self.product.pk}')
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(body)['name'], 'keyboard')
+        # Served by the catalog pool
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('catalog'))
+
+    def test_application(self):
+        application = get_asgi_application()
+        application.executor.shutdown()
+        self.assertIsInstance(application, CatalogASGIHandler)
+        with mock.patch('django.VERSION', (3, 1, 0, 'final', 0)):
+            application = get_asgi_application()
+        self.assertIs(type(application), ASGIHandler)
+
+    def test_other_requests(self):
+        threads = []
+        create = ProductsViewSet.create
+
+        def spy(view, request, *args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return create(view, request, *args, **kwargs)
+
+        with mock.patch.object(ProductsViewSet, 'create', spy):
+            status_code, body = self.request('POST', '/products/create', json.dumps(
+                {'name': 'monitor', 'description': 'product2', 'price': '10.25'}).encode())
+        self.assertEqual(status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(threads), 1)
+        self.assertFalse(threads[0].startswith('catalog'))
+        status_code, body = self.request('GET', '/products/')
+        self.assertEqual(json.loads(body)['count'], 2)
+
+
+class FastJSONTestCase(TestCase):
+    """Checks the orjson renderer and parser (or their fallback) match DRF's JSONRenderer and JSONParser"""
+
+    def test_renderer_output(self):
+        data = {
+            'price': Decimal('10.25'), 'total': Decimal('0.10'), 'name': 'Teclado ñ \u2028 \u2029 "quoted"',
+            'created': timezone.now(), 'day': timezone.localdate(), 'id': uuid.uuid4(), 'none': None,
+            'nested': [{'quantity': 3, 'ratio': 0.5, 'flag': True}], 'lazy': gettext_lazy('Not found.'),
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_parser(self):
+        body = JSONRenderer().render({'items': [{'product': 1, 'quantity': 2}], 'name': 'ñ'})
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"items": ['))
+
+    def test_responses(self):
+        staff = User.objects.create_user(email='json@test.com', password='wefcwefew2', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(user=staff)
+        response = client.post(reverse('store_api:products_create'), format='json',
+                               data={'name': 'monitor', 'description': 'ñ', 'price': '10.25'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class ValuesSerializerContractTestCase(TestCase):
+    """Checks the listings serialized from .values() rows render the same JSON as the model serializers"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.staff = User.objects.create_user(email='values@test.com', password='wefcwefew2', is_staff=True)
+        self.user = User.objects.create_user(email='buyer@test.com', password='wefcwefew2')
+        prices = ('5.5', '0.1', '10.25', '1234.99', '3')
+        self.products = [Product.objects.create(name=f'producto {number} ñ', description=f'descripción\n{number}',
+                                                price=Decimal(price)) for number, price in enumerate(prices)]
+        for user, count in ((self.user, 4), (self.staff, 8)):
+            for number in range(count):
+                order = Order.objects.create(user=user)
+                for quantity, product in enumerate(self.products[:number % 4], 1):
+                    OrderItem.objects.create(order=order, product=product, quantity=quantity)
+        # Inactive items are not listed by either serializer
+        item = OrderItem.objects.filter(order__user=self.user).first()
+        item.soft_delete()
+
+    def assertSameJSON(self, values_serializer, model_serializer, queryset):
+        rows = values_serializer.rows(queryset)
+        expected = model_serializer(queryset, many=True).data
+        for renderer in (JSONRenderer(), FastJSONRenderer()):
+            self.assertEqual(renderer.render(values_serializer.serialize(rows)), renderer.render(expected))
+
+    def assertSameResponse(self, url, model_serializer, queryset):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [row['id'] for row in json.loads(response.content)['results']]
+        self.assertTrue(ids)
+        instances = sorted(queryset.filter(pk__in=ids), key=lambda instance: ids.index(instance.pk))
+        expected = dict(response.data, results=model_serializer(instances, many=True).data)
+        self.assertEqual(response.content, FastJSONRenderer().render(expected))
+
+    def test_products(self):
+        self.assertSameJSON(ProductValuesSerializer, ProductSerializer, Product.objects.order_by('pk'))
+        self.client.force_authenticate(user=self.user)
+        self.assertSameResponse(reverse('store_api:products'), ProductSerializer, Product.objects.all())
+
+    def test_orders(self):
+        self.assertSameJSON(OrderValuesSerializer, OrderSerializer, Order.objects.with_items().order_by('pk'))
+        self.client.force_authenticate(user=self.staff)
+        self.assertSameResponse(reverse('store_api:orders'), OrderSerializer, Order.objects.with_items())
+        self.assertSameResponse(reverse('store_api:orders') + '?page_size=3', OrderSerializer,
+                                Order.objects.with_items())
+        self.client.force_authenticate(user=self.user)
+        self.assertSameResponse(reverse('store_api:user_orders', kwargs={'pk': self.user.pk}), OrderSerializer,
+                                Order.objects.with_items())
+
+
+class RouteBenchmarkTestCase(TestCase):
+    """Checks every route answers over the benchmark dataset and its query count does not grow with the data"""
+
+    def test_query_counts_do_not_grow_with_data(self):
+        probe = Probe()
+        seed_dataset(users=3, products=5, orders=6, items_per_order=2, owner=probe.user, key='small')
+        small = benchmark_routes(probe)
+        # Every url of the API is benchmarked
+        self.assertEqual({pattern.name for pattern in urlpatterns}, set(small))
+        for name, result in small.items():
+            self.assertTrue(all(200 <= code < 300 for code in result['status']), (name, result))
+
+        seed_dataset(users=15, products=25, orders=40, items_per_order=3, seed=1, owner=probe.user, key='large')
+        large = benchmark_routes(probe)
+        self.assertEqual(query_growth(small, large), {})
+        self.assertGreater(large['orders_export']['bytes'], small['orders_export']['bytes'])
+
+    def test_regressions(self):
+        baseline = {'orders': {'queries': 4, 'p95_ms': 10.0}, 'products': {'queries': 3, 'p95_ms': 10.0}}
+        results = {'orders': {'queries': 5, 'p95_ms': 9.0}, 'products': {'queries': 3, 'p95_ms': 30.0},
+                   'health': {'queries': 1, 'p95_ms': 1.0}}
+        self.assertEqual(regressions(results, baseline), [
+            'orders: 5 queries (baseline 4)', 'products: p95 30.00ms (baseline 10.00ms)'])
+
+
+class SeedStoreTestCase(TestCase):
+    """Checks the seeded store is consistent: tokens, order totals, rollups, search index and credentials"""
+
+    def test_seed_store(self):
+        existing = User.objects.create_user(email='existing@store.com', password='password')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        credentials = os.path.join(directory.name, 'credentials.csv')
+        call_command('seed_store', '--users', '12', '--products', '8', '--orders', '30', '--items', '3',
+                     '--chunk-size', '7', '--hasher', 'md5', '--password', 'seeded-password',
+                     '--credentials', credentials, stdout=StringIO())
+        self.assertEqual(User.objects.count(), 13)
+        self.assertEqual(Token.objects.count(), 13)
+        self.assertEqual(Product.objects.count(), 8)
+        self.assertEqual(Order.objects.count(), 30)
+        self.assertFalse(Order.objects.filter(user=existing).exists())
+        self.assertFalse(Order.objects.stale_totals().exists())
+        call_command('rebuild_rollups', '--verify', stdout=StringIO())
+        product = Product.objects.first()
+        self.assertIn(product, get_search_backend().search(Product.objects.all(), product.name))
+
+        seeded = User.objects.exclude(pk=existing.pk).first()
+        self.assertTrue(seeded.password.startswith('md5$'))
+        with override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']):
+            self.assertTrue(seeded.check_password('seeded-password'))
+        with open(credentials) as credentials_file:
+            rows = list(csv.DictReader(credentials_file))
+        self.assertEqual(len(rows), 12)
+        self.assertEqual(rows[0], {'email': seeded.email, 'token': seeded.auth_token.key})
+
+        # Seeding again appends: new primary keys and token keys
+        call_command('seed_store', '--users', '12', '--products', '8', '--orders', '5', stdout=StringIO())
+        self.assertEqual(Token.objects.count(), 25)
+        self.assertEqual(Order.objects.count(), 35)
+        # The primary key sequences continue after the seeded rows
+        self.assertGreater(User.objects.create_user(email='after@store.com', password='password').pk,
+                           User.objects.exclude(email='after@store.com').latest('pk').pk)
+
+    def test_seed_after_logically_deleted_rows(self):
+        Product.objects.create(name='first', description='active', price='1.00')
+        Product.objects.create(name='last', description='logically deleted', price='1.00').soft_delete()
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(email='seed@store.com', password='password'))
+        url = reverse('store_api:products')
+        self.assertEqual(client.get(url).data['count'], 1)
+        call_command('seed_store', '--users', '2', '--products', '3', '--orders', '2', '--items', '2',
+                     '--hasher', 'md5', stdout=StringIO())
+        self.assertEqual(Product.all_objects.count(), 5)
+        # The cached catalog is invalidated by the seeding
+        self.assertEqual(client.get(url).data['count'], 4)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(CommandError):
+            call_command('seed_store', '--items', '10', '--products', '5', stdout=StringIO())
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0)
+class InstrumentationTestCase(TestCase):
+    """Checks the measured requests carry a Server-Timing header and are logged, and the N+1 detection"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='instrumented@store.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        Product.objects.create(name='keyboard', description='mechanical', price=Decimal('50.00'))
+
+    def test_server_timing_and_log(self):
+        with self.assertLogs('store_api.instrumentation', 'INFO') as logs:
+            response = self.client.get(reverse('store_api:products'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(metrics), {'db', 'serialize', 'render', 'total'})
+        queries = int(re.search(r'desc="(\d+) queries"', metrics['db']).group(1))
+        self.assertGreater(queries, 0)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('route=store_api:products', logs.output[0])
+        self.assertIn(f'queries={queries} ', logs.output[0])
+        self.assertIn('status=200', logs.output[0])
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_not_sampled(self):
+        response = self.client.get(reverse('store_api:products'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_duplicated_queries(self):
+        metrics = RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for product in Product.objects.all():
+                for _ in range(3):
+                    OrderItem.objects.filter(product=product).exists()
+            Product.objects.count()
+        self.assertEqual(metrics.queries, 5)
+        duplicated, = metrics.duplicates(3)
+        self.assertIn('store_api_orderitem', duplicated)
+        self.assertEqual(metrics.duplicates(4), {})
+
+        # Every query of the request is flagged
+        with self.assertLogs('store_api.instrumentation', 'WARNING') as logs, \
+                self.settings(INSTRUMENTATION_DUPLICATE_QUERIES=1):
+            self.client.get(reverse('store_api:products'))
+        self.assertIn('Duplicated query (N+1?) on GET /products/', logs.output[0])
+
+
+class MetricsTestCase(TestCase):
+    """Checks the metrics endpoint and the multiprocess value files"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='metrics@store.com', password='password')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.user.auth_token.key}')
+
+    @staticmethod
+    def sample(text, line_start):
+        line = next((line for line in text.splitlines() if line.startswith(line_start)), None)
+        return float(line.rsplit(' ', 1)[1]) if line is not None else 0.0
+
+    @staticmethod
+    def scrape():
+        return APIClient().get(reverse('store_api:metrics'), HTTP_AUTHORIZATION='Bearer scraper-token')
+
+    @override_settings(METRICS_TOKEN='scraper-token')
+    def test_metrics_endpoint(self):
+        requests = 'store_http_requests_total{route="store_api:products",method="GET",status="200"}'
+        before = self.scrape().content.decode()
+        CachedTokenAuthentication.token_cache.clear()
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('store_api:products')).status_code, status.HTTP_200_OK)
+
+        response = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE store_http_request_duration_seconds histogram', text)
+        self.assertEqual(self.sample(text, requests) - self.sample(before, requests), 2)
+        count = 'store_http_request_duration_seconds_count{route="store_api:products",method="GET"}'
+        self.assertEqual(self.sample(text, count) - self.sample(before, count), 2)
+        infinite = 'store_http_request_duration_seconds_bucket{route="store_api:products",method="GET",le="+Inf"}'
+        self.assertEqual(self.sample(text, infinite), self.sample(text, count))
+        for result in ('hit', 'miss'):
+            line = f'store_auth_token_cache_lookups_total{{result="{result}"}}'
+            self.assertGreaterEqual(self.sample(text, line) - self.sample(before, line), 1)
+
+    @override_settings(METRICS_TOKEN='scraper-token')
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse('store_api:metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.scrape().status_code, status.HTTP_200_OK)
+        response = APIClient().get(reverse('store_api:metrics'), HTTP_AUTHORIZATION='Bearer é')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_without_token(self):
+        # Only exposed with DEBUG
+        self.assertEqual(self.client.get(reverse('store_api:metrics')).status_code, status.HTTP_403_FORBIDDEN)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('store_api:metrics')).status_code, status.HTTP_200_OK)
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=1.0)
+    def test_single_execute_wrapper(self):
+        wrappers = []
+        list_products = ProductsViewSet.list
+
+        def spy(view, request, *args, **kwargs):
+            wrappers.append(len(connection.execute_wrappers))
+            return list_products(view, request, *args, **kwargs)
+
+        with mock.patch.object(ProductsViewSet, 'list', spy):
+            self.client.get(reverse('store_api:products'))
+            with self.settings(INSTRUMENTATION_SAMPLE_RATE=0.0):
+                self.client.get(reverse('store_api:products'))
+        self.assertEqual(wrappers, [1, 1])
+
+    def test_process_files(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # Two worker processes, the second one growing its file
+        first = MmapedValues(os.path.join(directory.name, '100.metrics'))
+        first.add('requests', 2)
+        first.add('requests', 1.5)
+        second = MmapedValues(os.path.join(directory.name, '200.metrics'))
+        second.add('requests', 1)
+        for number in range(3000):
+            second.add(f'key {number}', number)
+        first.close()
+        second.close()
+        reopened = MmapedValues(os.path.join(directory.name, '100.metrics'))
+        reopened.add('requests', 1)
+        reopened.close()
+
+        store = ValueStore()
+        with self.settings(METRICS_DIR=directory.name):
+            self.assertEqual(store.collect()['requests'], 5.5)
+            self.assertEqual(store.collect()['key 2999'], 2999)
+            merge_process_values(directory.name, 100)
+            self.assertFalse(os.path.exists(os.path.join(directory.name, '100.metrics')))
+            self.assertEqual(store.collect()['requests'], 5.5)
+            merge_process_values(directory.name, 200)
+            self.assertEqual(sorted(os.listdir(directory.name)), ['archive.metrics'])
+            self.assertEqual(store.collect()['requests'], 5.5)
+            self.assertEqual(len(store.collect()), 3001)
+
+
+class SlidingWindowThrottleTestCase(TestCase):
+    """Checks the sliding window counters of the throttles and the route scopes"""
+
+    def setUp(self):
+        cache.clear()
+        # Staff, to create orders
+        self.user = User.objects.create_user(email='throttled@store.com', password='password', is_staff=True)
+        self.request = APIRequestFactory().get('/')
+        self.request.user = self.user
+        self.now = 600.0
+
+    def throttle(self, rate='3/minute'):
+        throttle_class = type('Throttle', (SlidingWindowUserThrottle,), {'rate': rate, 'timer': lambda _: self.now})
+        return throttle_class()
+
+    def allowed(self, count):
+        return [self.throttle().allow_request(self.request, None) for _ in range(count)]
+
+    def test_window(self):
+        self.assertEqual(self.allowed(4), [True, True, True, False])
+        throttle = self.throttle()
+        self.assertFalse(throttle.allow_request(self.request, None))
+        self.assertEqual(throttle.wait(), 60)
+
+        # Half of the next window: the previous counter (5, with the rejected requests) weighs 2.5
+        self.now += 90
+        self.assertEqual(self.allowed(1), [False])
+        throttle = self.throttle()
+        self.now += 10
+        self.assertFalse(throttle.allow_request(self.request, None))
+        self.assertAlmostEqual(throttle.wait(), 60 * (1 - (3 - 2) / 5) - 40)
+        # The previous window has passed
+        self.now += 120
+        self.assertEqual(self.allowed(4), [True, True, True, False])
+
+    @override_settings(METRICS_TOKEN='scraper-token')
+    def test_route_scopes(self):
+        rates = {'orders_write': '1/minute'}
+        client = APIClient()
+        client.force_authenticate(self.user)
+        rejected = 'store_throttled_requests_total{route="store_api:orders_create"}'
+        before = MetricsTestCase.sample(MetricsTestCase.scrape().content.decode(), rejected)
+        with mock.patch.object(RouteRateThrottle, 'THROTTLE_RATES', rates):
+            self.assertEqual(client.post(reverse('store_api:orders_create'), data={'user': self.user.pk},
+                                         format='json').status_code, status.HTTP_201_CREATED)
+            response = client.post(reverse('store_api:orders_create'), data={'user': self.user.pk}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertIn('Retry-After', response)
+            # The reads of the scope have no rate, the other routes no scope
+            for _ in range(3):
+                self.assertEqual(client.get(reverse('store_api:orders')).status_code, status.HTTP_200_OK)
+                self.assertEqual(client.get(reverse('store_api:products')).status_code, status.HTTP_200_OK)
+        after = MetricsTestCase.sample(MetricsTestCase.scrape().content.decode(), rejected)
+        self.assertEqual(after - before, 1)
@@ -0,0 +1,93 @@
+"""Sliding window throttles
+
+DRF's SimpleRateThrottle keeps the timestamps of the recent requests of each client in a list, read and
+written back to the cache on every request: at 500/minute, a cache get and set of up to 500 floats.
+These throttles count the requests of fixed windows (one `duration` long) instead, with an atomic cache
+increment, and estimate the rate over the sliding window from the current and the previous counters:
+
+    estimate = previous * (1 - elapsed / duration) + current
+
+So each client costs two integers in the cache, and each request an increment and, unless it is already
+rejected, a get. The rejected requests are counted too: a client exceeding its rate remains throttled
+until its rate goes down.
+
+The increments are atomic with the cache backends implementing incr atomically (local memory, Redis,
+Memcached); the file based backend may lose concurrent increments.
+"""
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import AnonRateThrottle, ScopedRateThrottle, UserRateThrottle
+
+
+class SlidingWindowMixin:
+    """
+    Throttle mixin replacing the request history of SimpleRateThrottle by the sliding window counters
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        self.elapsed = self.now - window * self.duration
+        self.current = self.increment(f'{self.key}:{window}')
+        self.previous = 0
+        if self.current > self.num_requests:
+            return self.throttle_failure()
+        self.previous = self.cache.get(f'{self.key}:{window - 1}', 0)
+        if self.previous * (1 - self.elapsed / self.duration) + self.current > self.num_requests:
+            return self.throttle_failure()
+        return True
+
+    def increment(self, key):
+        """
+        :return: The counter of the key after incrementing it, starting it when it is not in the cache
+        """
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # The counter is read as the previous window during the next one
+            if self.cache.add(key, 1, timeout=self.duration * 2):
+                return 1
+            # Started by a concurrent request meanwhile
+            return self.cache.incr(key)
+
+    def wait(self):
+        """
+        :return: The seconds until the estimated rate is below the limit again
+        """
+        if self.current > self.num_requests or not self.previous:
+            # The next window: the current counter then weighs as the previous one
+            return self.duration - self.elapsed
+        # The previous counter weighs less as the window slides
+        return max(0.0, self.duration * (1 - (self.num_requests - self.current) / self.previous) - self.elapsed)
+
+
+class SlidingWindowAnonThrottle(SlidingWindowMixin, AnonRateThrottle):
+    """Limits the rate of the anonymous requests by IP address (the 'anon' rate)"""
+
+
+class SlidingWindowUserThrottle(SlidingWindowMixin, UserRateThrottle):
+    """Limits the rate of the requests by user, or by IP address when anonymous (the 'user' rate)"""
+
+
+class RouteRateThrottle(SlidingWindowMixin, ScopedRateThrottle):
+    """
+    Limits the rate of the requests by user and route: the views declare a `throttle_scope`, and the reads
+    (safe methods) and writes of the scope have their own rates, `<scope>_read` and `<scope>_write`
+    (e.g. 'orders_write'). The requests of the views without scope, or of a scope without rate, are not limited.
+    """
+
+    def allow_request(self, request, view):
+        scope = getattr(view, self.scope_attr, None)
+        if not scope:
+            return True
+        self.scope = f"{scope}_{'read' if request.method in SAFE_METHODS else 'write'}"
+        self.rate = self.THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return super().allow_request(request, view)
@@ -9,7 +9,9 @@ from .views import (
     UserViewSet,
     ProductsViewSet,
     OrdersViewSet,
-    OrderItemViewSet
+    OrderItemViewSet,
+    HealthViewSet,
+    MetricsViewSet
 )
 
 router = SimpleRouter()
@@ -21,9 +23,13 @@ urlpatterns = format_suffix_patterns([
     path('users/', UserViewSet.users_view(), name='users'),
     path('user/<int:pk>', UserViewSet.user_view(), name='user'),
     path('user/<int:pk>/orders', UserViewSet.user_orders_view(), name='user_orders'),
+    path('user/<int:pk>/sales', UserViewSet.user_sales_view(), name='user_sales'),
 
     path('orders/', OrdersViewSet.orders_view(), name='orders'),
     path('orders/create', OrdersViewSet.orders_create_view(), name='orders_create'),
+    path('orders/bulk', OrdersViewSet.orders_bulk_create_view(), name='orders_bulk_create'),
+    path('orders/export', OrdersViewSet.orders_export_view(), name='orders_export'),
+    path('orders/daily_sales', OrdersViewSet.orders_daily_sales_view(), name='orders_daily_sales'),
     path('order/<int:pk>', OrdersViewSet.order_view(), name='order'),
 
     path('order_items/', OrderItemViewSet.order_items_view(), name='order_items'),
@@ -33,8 +39,11 @@ urlpatterns = format_suffix_patterns([
     path('products/create', ProductsViewSet.product_create_view(), name='products_create'),
     path('product/<int:pk>', ProductsViewSet.product_view(), name='product'),
     path('products/high_orders', ProductsViewSet.product_high_orders_view(), name='high_orders'),
+    path('products/top', ProductsViewSet.product_top_view(), name='products_top'),
     path('products/search/<str:payload>', ProductsViewSet.product_search_view(), name='product_search'),
-    path('get_token/', obtain_auth_token, name='get_token')
+    path('get_token/', obtain_auth_token, name='get_token'),
+    path('health/', HealthViewSet.health_view(), name='health'),
+    path('metrics', MetricsViewSet.metrics_view(), name='metrics')
 ])
 
 urlpatterns += router.urls
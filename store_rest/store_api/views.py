@@ -1,19 +1,58 @@
 import logging
 
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
-from django.db.models import Sum, F, Q, DecimalField
+from django.utils.dateparse import parse_date
 from rest_framework import viewsets, mixins
 from rest_framework.decorators import action, permission_classes
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.pagination import PageNumberPagination
 
 from rest_framework.response import Response
 from rest_framework import permissions, status
-from .models import User, Product, OrderItem, Order
-from .permissions import IsOwner
-from .serializers import UserSerializer, ProductSerializer, OrderSerializer, OrderItemSerializer
+from .caching import CatalogCacheMixin
+from .database import health
+from .export import EXPORT_FORMATS, ExportContentNegotiation, export_orders, parse_export_filters
+from .instrumentation import InstrumentedViewMixin
+from .metrics import CONTENT_TYPE, MetricsViewMixin, render_metrics
+from .models import User, Product, OrderItem, Order, ProductSales, UserSales, DailySales
+from .pagination import KeysetPagination
+from .permissions import HasMetricsToken, IsOwner, IsOwnerOrStaff, ReadOnly
+from .search import get_search_backend
+from .serializers import (
+    UserSerializer, ProductSerializer, OrderSerializer, OrderItemSerializer, OrderCreateSerializer,
+    ProductSalesSerializer, UserSalesSerializer, DailySalesSerializer, ProductValuesSerializer,
+    OrderValuesSerializer
+)
+
+
+class SoftDestroyMixin:
+    """
+    Viewset mixin deleting the rows logically on DELETE: they are flagged as not active (see Base.soft_delete)
+    and are no longer returned by the default managers. They remain reachable through `all_objects`.
+    """
 
+    def perform_destroy(self, instance):
+        instance.soft_delete()
 
-class UserRegisterAPIView(viewsets.ModelViewSet):
+
+class ValuesListMixin:
+    """
+    Viewset mixin serializing the listings from `.values()` rows with `values_serializer_class`
+    (see ValuesSerializer) instead of the model serializer, with the same output
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        rows = self.values_serializer_class.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.values_serializer_class.serialize(page))
+        return Response(self.values_serializer_class.serialize(rows))
+
+
+class UserRegisterAPIView(InstrumentedViewMixin, MetricsViewMixin, viewsets.ModelViewSet):
     """
     Class responsible to process the requests for User register
 
@@ -38,7 +77,7 @@ class UserRegisterAPIView(viewsets.ModelViewSet):
         )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(InstrumentedViewMixin, MetricsViewMixin, viewsets.ModelViewSet):
     """
     Class responsible to process the requests for User query
 
@@ -46,9 +85,11 @@ class UserViewSet(viewsets.ModelViewSet):
         users_view (get - list)
         user_view  (get - detail, put - update)
         users_order_view (get - detail)
+        user_sales_view (get - detail)
 
     Implements the following endpoints:
         orders (get): Returns all orders and respective items made by the user
+        sales (get): Returns the lifetime spend of the user, from the sales rollup
     """
     # The model object to be queried
     queryset = User.objects.all()
@@ -68,17 +109,27 @@ class UserViewSet(viewsets.ModelViewSet):
         # A simple validation (it seems for this method the validation classes are not being applied!)
         if request.user.id != pk and not request.user.is_staff:
             raise PermissionDenied('User not authorized to perform this operation', status.HTTP_403_FORBIDDEN)
-        self.pagination_class.page_size = 10
-        orders = Order.objects.filter(user_id=pk)
-        orders_items = OrderItem.objects.filter(order_id__in=orders)
-        page = self.paginate_queryset(orders)
+        orders = OrderValuesSerializer.rows(Order.objects.filter(user_id=pk))
+        # The orders are paginated by keyset, unlike the users. The paginator is created per request.
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(orders, request, view=self)
 
         if page is not None:
-            serializer = OrderSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+            return paginator.get_paginated_response(OrderValuesSerializer.serialize(page))
 
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        return Response(OrderValuesSerializer.serialize(orders))
+
+    @action(detail=True)
+    def sales(self, request, pk=None):
+        """
+        Method that implements the 'sales' endpoint, returning the lifetime spend of a user
+        :param request: The request payload
+        :param pk: The user ID
+        :return: The serialized sales rollup of the user (zeros when the user has no order items)
+        """
+        user = self.get_object()
+        sales = UserSales.objects.filter(user=user).first() or UserSales(user=user)
+        return Response(UserSalesSerializer(sales).data)
 
     """
         Specifies the userviews to be informed in the routes
@@ -92,38 +143,54 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @classmethod
     def user_view(cls):
-        cls.permission_classes = (permissions.IsAuthenticated, IsOwner,)
         return cls.as_view({
             'get': 'retrieve',
             'put': 'update'
-        })
+        }, permission_classes=(permissions.IsAuthenticated, IsOwner,))
 
     @classmethod
     def user_orders_view(cls):
-        cls.permission_classes = (permissions.IsAuthenticated, IsOwner,)
         return cls.as_view({
             'get': 'orders'
-        })
+        }, permission_classes=(permissions.IsAuthenticated, IsOwner,))
+
+    @classmethod
+    def user_sales_view(cls):
+        # The user or staff users
+        return cls.as_view({
+            'get': 'sales'
+        }, permission_classes=(permissions.IsAuthenticated, IsOwnerOrStaff,))
 
 
-class ProductsViewSet(viewsets.ModelViewSet):
+class ProductsViewSet(InstrumentedViewMixin, MetricsViewMixin, CatalogCacheMixin, ValuesListMixin, SoftDestroyMixin,
+                      viewsets.ModelViewSet):
     """
     Class responsible to process the requests for products.
+    The list and retrieve responses are cached until a product changes (see CatalogCacheMixin).
 
     Provides the following view routes and methods:
         products_view (get - list)
         product_create_view (post - create)
-        product_view (get - retrieve, put - update)
+        product_view (get - retrieve, put - update, delete - destroy)
         product_high_order_view (get - retrieve)
+        product_top_view (get - top)
 
     Implements the following endpoints:
         high_orders: return a list of products that are part of orders with
                     more than 1 product and a total greater than 100.
+        top: return the best selling products, from the sales rollup
     """
     # The model object to be queried
     queryset = Product.objects.all()
     # The serializer to process the data objects
     serializer_class = ProductSerializer
+    # The listing is serialized from .values() rows
+    values_serializer_class = ProductValuesSerializer
+    # The listing is paginated by keyset on (created, id)
+    pagination_class = KeysetPagination
+    # The rates of the reads and writes of the route (see RouteRateThrottle)
+    throttle_scope = 'catalog'
+    page_size = 10
 
     @action(detail=False)
     def high_orders(self, request):
@@ -134,25 +201,47 @@ class ProductsViewSet(viewsets.ModelViewSet):
         :param pk: Not used
         :return: A list of objects that matches the query
         """
-        try:
-            high_orders = Order.objects.annotate(
-                total=Sum(
-                    F('items__quantity') * F('items__product__price'), output_field=DecimalField()
-                )
-            ).filter(total__gt=100)
-        except TypeError:
-            return Response({})
-
-        # From the orders, select only those with more than 1 products
-        multi_products = [order for order in high_orders if order.items.count() > 1]
-
-        products = self.queryset.filter(orderitem__order__in=multi_products)
+        products = self.queryset.in_high_orders()
         serializer = self.serializer_class(products, many=True)
         return Response(serializer.data)
 
+    @action(detail=False)
+    def top(self, request):
+        """
+        Method that implements the top endpoint, returning the best selling products with their sales.
+        The query parameter `by` selects the ranking: revenue (default) or units. `limit` the number
+        of products (10 by default, up to 100).
+        :param request: The request payload
+        :return: The products sales, best selling first
+        """
+        ranking = request.query_params.get('by', 'revenue')
+        if ranking not in ('revenue', 'units'):
+            raise ValidationError({'by': ['Select one of: revenue, units.']})
+        try:
+            limit = min(max(int(request.query_params.get('limit', 10)), 1), 100)
+        except ValueError:
+            raise ValidationError({'limit': ['A valid integer is required.']})
+        sales = ProductSales.objects.filter(product__active=True).select_related('product') \
+            .order_by(f'-{ranking}', 'product_id')[:limit]
+        return Response(ProductSalesSerializer(sales, many=True).data)
+
     @action(detail=False)
     def product_search(self, request, payload):
-        search_result = self.queryset.filter(Q(name__icontains=payload) | Q(description__icontains=payload))
+        """
+        Method that implements the product_search endpoint, returning the products whose name or description
+        contains the payload, ranked by relevance. The search is delegated to the configured search backend.
+        :param request: The request payload
+        :param payload: The text to be searched
+        :return: The paginated products that match the search
+        """
+        search_result = get_search_backend().search(self.get_queryset(), payload)
+        # The results are ranked by relevance, not ordered by (created, id): they are paginated by page number
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(search_result, request, view=self)
+        if page is not None:
+            serializer = self.serializer_class(page, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
         serializer = self.serializer_class(search_result, many=True)
         return Response(serializer.data)
 
@@ -165,18 +254,18 @@ class ProductsViewSet(viewsets.ModelViewSet):
     @classmethod
     def product_create_view(cls):
         # Just create products if authenticated and staff
-        cls.permission_classes = (permissions.IsAuthenticated, permissions.IsAdminUser)
         return cls.as_view({
             'post': 'create'
-        })
+        }, permission_classes=(permissions.IsAuthenticated, permissions.IsAdminUser))
 
     @classmethod
     def product_view(cls):
-        # Due to the same name, permissions won't be applied, but TODO: should be applied to `PUT`
+        # Any authenticated user can retrieve a product, but just staff can update or delete it
         return cls.as_view({
             'get': 'retrieve',
-            'put': 'update'
-        })
+            'put': 'update',
+            'delete': 'destroy'
+        }, permission_classes=(permissions.IsAuthenticated & (ReadOnly | permissions.IsAdminUser),))
 
     @classmethod
     def product_high_orders_view(cls):
@@ -185,64 +274,175 @@ class ProductsViewSet(viewsets.ModelViewSet):
             'get': 'high_orders'
         })
 
+    @classmethod
+    def product_top_view(cls):
+        # The sales are only available to staff
+        return cls.as_view({
+            'get': 'top'
+        }, permission_classes=(permissions.IsAuthenticated, permissions.IsAdminUser,))
+
     @classmethod
     def product_search_view(cls):
-        cls.permission_classes = (permissions.AllowAny,)
         return cls.as_view({
             'get': 'product_search'
-        })
+        }, permission_classes=(permissions.AllowAny,))
 
 
-class OrdersViewSet(viewsets.ModelViewSet):
+class OrdersViewSet(InstrumentedViewMixin, MetricsViewMixin, ValuesListMixin, SoftDestroyMixin, viewsets.ModelViewSet):
     """
     Class responsible to process request to Orders
 
     Provides the following view routes and methods:
         orders_view (get - list)
         orders_create_view (post - create)
-        order_view (get - retrieve, put - update)
+        orders_bulk_create_view (post - bulk_create)
+        orders_export_view (get - export)
+        orders_daily_sales_view (get - daily_sales)
+        order_view (get - retrieve, put - update, delete - destroy)
+
+    The orders are created along with their items (see OrderCreateSerializer).
     """
-    # The model object to perform the queries
-    queryset = Order.objects.all()
+    # The model object to perform the queries. Items and products are prefetched for the nested serializer
+    queryset = Order.objects.with_items()
     # The serializer to process the data objects
     serializer_class = OrderSerializer
+    # The listing is serialized from .values() rows, the items read with one query
+    values_serializer_class = OrderValuesSerializer
+    # Non-staff users only list their own orders (see IsOwnerFilterBackend)
+    owner_field = 'user'
+    # The listing is paginated by keyset on (created, id)
+    pagination_class = KeysetPagination
+    # The rates of the reads and writes of the route (see RouteRateThrottle)
+    throttle_scope = 'orders'
+    page_size = 10
+
+    def get_serializer_class(self):
+        if self.action in ('create', 'bulk_create'):
+            return OrderCreateSerializer
+        return self.serializer_class
+
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        """
+        Method that implements the bulk creation endpoint: many orders, each with its items, validated in
+        batch and created in a single transaction
+        :param request: The request payload, a list of orders
+        :return: The created orders, with their items and totals
+        """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Method that implements the export endpoint, streaming all the orders with their items, for reporting.
+        The query parameter `output` selects the format: ndjson (one order per line, default) or csv
+        (one item per line). The orders can be filtered by created_after/created_before and
+        updated_after/updated_before (dates or datetimes).
+        :param request: The request payload
+        :return: The streamed orders
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_FORMATS:
+            raise ValidationError({'output': [f'Select one of: {", ".join(EXPORT_FORMATS)}.']})
+        try:
+            lookups = parse_export_filters(request.query_params)
+        except ValueError as error:
+            raise ValidationError({'detail': str(error)})
+
+        lines = export_orders(Order.objects.filter(**lookups), output,
+                              chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000))
+        response = StreamingHttpResponse(lines, content_type=EXPORT_FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
+
+    @action(detail=False)
+    def daily_sales(self, request):
+        """
+        Method that implements the daily sales endpoint, returning the orders items summarized by day
+        of the order, from the sales rollup. The days can be limited with the `since` and `until`
+        query parameters (dates, inclusive).
+        :param request: The request payload
+        :return: The daily sales, ordered by day
+        """
+        sales = DailySales.objects.all()
+        for name, lookup in (('since', 'day__gte'), ('until', 'day__lte')):
+            value = request.query_params.get(name)
+            if value is None:
+                continue
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValidationError({name: ['Date has wrong format. Use YYYY-MM-DD.']})
+            sales = sales.filter(**{lookup: day})
+        return Response(DailySalesSerializer(sales, many=True).data)
 
     @classmethod
     def orders_view(cls):
-        cls.permission_classes = (permissions.IsAuthenticated, permissions.IsAdminUser,)
         return cls.as_view({
             'get': 'list'
-        })
+        }, permission_classes=(permissions.IsAuthenticated, permissions.IsAdminUser,))
 
     @classmethod
     def orders_create_view(cls):
-        cls.permission_classes = (permissions.IsAuthenticated, permissions.IsAdminUser,)
         return cls.as_view({
             'post': 'create'
-        })
+        }, permission_classes=(permissions.IsAuthenticated, permissions.IsAdminUser,))
+
+    @classmethod
+    def orders_bulk_create_view(cls):
+        # Any authenticated user can create orders for themselves. Staff can create them for any user
+        return cls.as_view({
+            'post': 'bulk_create'
+        }, permission_classes=(permissions.IsAuthenticated,))
+
+    @classmethod
+    def orders_export_view(cls):
+        # Just staff can export the orders
+        return cls.as_view({
+            'get': 'export'
+        }, permission_classes=(permissions.IsAuthenticated, permissions.IsAdminUser,),
+            content_negotiation_class=ExportContentNegotiation)
+
+    @classmethod
+    def orders_daily_sales_view(cls):
+        # The sales are only available to staff
+        return cls.as_view({
+            'get': 'daily_sales'
+        }, permission_classes=(permissions.IsAuthenticated, permissions.IsAdminUser,))
 
     @classmethod
     def order_view(cls):
-        cls.permission_classes = (((permissions.IsAuthenticated & IsOwner) |
-                                   (permissions.IsAuthenticated & permissions.IsAdminUser)),)
         return cls.as_view({
             'get': 'retrieve',
-            'put': 'update'
-        })
+            'put': 'update',
+            'delete': 'destroy'
+        }, permission_classes=(permissions.IsAuthenticated, IsOwnerOrStaff,))
 
 
-class OrderItemViewSet(viewsets.ModelViewSet):
+class OrderItemViewSet(InstrumentedViewMixin, MetricsViewMixin, SoftDestroyMixin, viewsets.ModelViewSet):
     """
     Class responsible to process Order Items
     Provides the following view routes and methods:
         order_items_view (get - list, post - create)
-        order_item_view (get - retrieve, put - update)
+        order_item_view (get - retrieve, put - update, delete - destroy)
     """
-    # the model object to perform the queries
-    queryset = OrderItem.objects.all()
+    # the model object to perform the queries. The product is joined, as it is needed for the item total,
+    # and the order, as it is needed to check the ownership
+    queryset = OrderItem.objects.select_related('order', 'product')
     # The serializer to process the data objects
     serializer_class = OrderItemSerializer
-    # Only allow if authenticated and is owner or if authenticated and is admin
+    # Non-staff users only list the items of their own orders (see IsOwnerFilterBackend)
+    owner_field = 'order__user'
+    # The listing is paginated by keyset on (created, id)
+    pagination_class = KeysetPagination
+    # The rates of the reads and writes of the route (see RouteRateThrottle)
+    throttle_scope = 'orders'
+    page_size = 10
 
     @classmethod
     def order_items_view(cls):
@@ -253,7 +453,64 @@ class OrderItemViewSet(viewsets.ModelViewSet):
 
     @classmethod
     def order_item_view(cls):
+        # Only allow if authenticated and is owner or if authenticated and is admin
         return cls.as_view({
             'get': 'retrieve',
-            'put': 'update'
-        })
+            'put': 'update',
+            'delete': 'destroy'
+        }, permission_classes=(permissions.IsAuthenticated, IsOwnerOrStaff,))
+
+
+class HealthViewSet(InstrumentedViewMixin, MetricsViewMixin, viewsets.ViewSet):
+    """
+    Class responsible to report the health of the service, for load balancers and orchestrators
+
+    Provides the following view routes and methods:
+        health_view (get - check)
+
+    Responds 200 when the databases and the cache answer, and 503 otherwise, with the latency of each one.
+    It is neither authenticated nor throttled, so the probes do not query the sessions or tokens.
+    """
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+    throttle_classes = ()
+
+    def check(self, request):
+        ok, checks = health()
+        return Response({'status': 'ok' if ok else 'unavailable', 'checks': checks},
+                        status=status.HTTP_200_OK if ok else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @classmethod
+    def health_view(cls):
+        return cls.as_view(
+            {
+                'get': 'check'
+            }
+        )
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """
+    Class responsible to expose the metrics of the service (see store_api.metrics) to Prometheus
+
+    Provides the following view routes and methods:
+        metrics_view (get - scrape)
+
+    Responds with the metrics of all the worker processes in the text exposition format. It is neither
+    authenticated by the API nor throttled: the scraper sends the METRICS_TOKEN setting as a bearer token
+    (without it, the metrics are only exposed with DEBUG).
+    """
+    authentication_classes = ()
+    permission_classes = (HasMetricsToken,)
+    throttle_classes = ()
+
+    def scrape(self, request):
+        return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+    @classmethod
+    def metrics_view(cls):
+        return cls.as_view(
+            {
+                'get': 'scrape'
+            }
+        )
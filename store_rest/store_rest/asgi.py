@@ -2,6 +2,8 @@
 ASGI config for store_rest project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+On Django 3.0 the catalog reads run in a thread pool of their own (see store_api.asgi).
+The search index is prepared before the first request (see store_api.search.warm_up_search_index).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
@@ -9,8 +11,15 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'store_rest.settings')
 
+# The same setup of django.core.asgi.get_asgi_application
+django.setup(set_prefix=False)
+
+from store_api.asgi import get_asgi_application  # noqa: E402
+from store_api.search import warm_up_search_index  # noqa: E402
+
 application = get_asgi_application()
+warm_up_search_index()
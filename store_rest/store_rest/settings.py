@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -19,13 +21,26 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.0/howto/deployment/checklist/
 
-# SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 't93s*71@tqa=zfti2l(w4v$^gk93vi)!6dnxzcjnc()xr+_fzt'
+# Production deployments set DJANGO_DEBUG=false, SECRET_KEY and ALLOWED_HOSTS (comma separated) in the environment
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', 'true').lower() in ('1', 'true', 'yes')
+
+# SECURITY WARNING: keep the secret key used in production secret!
+# The committed key is only a development fallback: without DEBUG, SECRET_KEY must be set in the environment
+SECRET_KEY = os.environ.get('SECRET_KEY')
+if not SECRET_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured('Set SECRET_KEY in the environment when DJANGO_DEBUG is false')
+    SECRET_KEY = 't93s*71@tqa=zfti2l(w4v$^gk93vi)!6dnxzcjnc()xr+_fzt'
+
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get('ALLOWED_HOSTS', '').split(',') if host.strip()]
 
-ALLOWED_HOSTS = []
+if not DEBUG:
+    # Behind a proxy terminating TLS, which sets X-Forwarded-Proto
+    SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+    SESSION_COOKIE_SECURE = CSRF_COOKIE_SECURE = \
+        os.environ.get('SECURE_COOKIES', 'true').lower() in ('1', 'true', 'yes')
 
 # A new user model (expanded from AbstractUser) is used
 AUTH_USER_MODEL = 'store_api.User'
@@ -45,11 +60,15 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
 
     'corsheaders',
-    'store_api'
+    'store_api.apps.StoreApiConfig'
 ]
 
 MIDDLEWARE = [
+    # First, so the measured time includes the other middleware
+    'store_api.instrumentation.InstrumentationMiddleware',
+    'store_api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'store_api.routers.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,13 +102,98 @@ WSGI_APPLICATION = 'store_rest.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 
-DATABASES = {
+# SQLite by default. DATABASE_ENGINE=postgresql connects to PostgreSQL with the DATABASE_NAME, DATABASE_USER,
+# DATABASE_PASSWORD, DATABASE_HOST and DATABASE_PORT variables.
+# Connections are kept open between requests for DATABASE_CONN_MAX_AGE seconds (0 closes them after each request).
+# DATABASE_POOL_SIZE sets the maximum connections of a pool shared by the threads of each process instead
+# (store_api.backends.postgresql_pool): the connections are returned to the pool after each request.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 0))
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'store_api.backends.postgresql_pool' if DATABASE_POOL_SIZE
+            else 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DATABASE_NAME', 'store_rest'),
+            'USER': os.environ.get('DATABASE_USER', 'postgres'),
+            'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+            'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+            'PORT': os.environ.get('DATABASE_PORT', '5432'),
+            # The pool keeps the connections itself: Django returns them after each request
+            'CONN_MAX_AGE': 0 if DATABASE_POOL_SIZE else int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('DATABASE_CONNECT_TIMEOUT', 5)),
+            },
+        }
+    }
+    if DATABASE_POOL_SIZE:
+        DATABASES['default']['OPTIONS'].update({
+            'pool_min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 1)),
+            'pool_max_size': DATABASE_POOL_SIZE,
+            'pool_timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        })
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DATABASE_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'OPTIONS': {
+                # Seconds a write waits for the lock held by another connection
+                'timeout': 20,
+            },
+        }
+    }
+
+# Read replicas: DATABASE_REPLICAS lists the hosts (PostgreSQL) or the files (SQLite) of the replicas, separated
+# by commas. They are configured as the primary otherwise, with the aliases replica1, replica2...
+# The reads of the GET requests go to the replicas (see store_api.routers). Locally, a copy of the SQLite file
+# stands in for a replica (it is not updated: read-your-writes keeps the reads of each writer on the primary).
+
+for number, location in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = dict(
+        DATABASES['default'],
+        OPTIONS=dict(DATABASES['default']['OPTIONS']),
+        # The tests read the replicas from the test database
+        TEST={'MIRROR': 'default'},
+        **{'HOST' if DATABASE_ENGINE == 'postgresql' else 'NAME': location.strip()})
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['store_api.routers.ReplicaRouter']
+# How the replica of each GET request is chosen: round_robin or least_latency
+DATABASE_REPLICA_SELECTION = os.environ.get('DATABASE_REPLICA_SELECTION', 'round_robin')
+# Seconds between the latency probes of the replicas (least_latency)
+DATABASE_REPLICA_PROBE_INTERVAL = 10
+# Seconds the reads of a client go to the primary after it writes, longer than the replication lag
+DATABASE_REPLICA_STICKY_SECONDS = int(os.environ.get('DATABASE_REPLICA_STICKY_SECONDS', 5))
+
+# PRAGMA statements run on each new SQLite connection (see store_api.database). The write-ahead log lets the
+# reads run along with a write, and synchronous=NORMAL is safe with it (the last commits may be lost on power loss)
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'wal'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'normal'),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Local memory by default. The catalog cache is invalidated through the cache, so deployments with more than
+# one process should share it: e.g. CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache with
+# CACHE_LOCATION=/var/tmp/store_rest_cache, or a Redis backend such as django_redis.cache.RedisCache
+# (optional package) with CACHE_LOCATION=redis://host:6379/0
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'store_rest'),
     }
 }
 
+# Sessions are read from the cache, falling back to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -109,6 +213,18 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# The first hasher hashes the new passwords, the others verify the existing hashes.
+# Load test environments only (never in production) may set FAST_PASSWORD_HASHER=true: MD5 comes first, so the
+# users seeded with `manage.py seed_store --hasher md5` log in without key stretching (and are not rehashed)
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+if os.environ.get('FAST_PASSWORD_HASHER', 'false').lower() in ('1', 'true', 'yes'):
+    PASSWORD_HASHERS.insert(0, 'django.contrib.auth.hashers.MD5PasswordHasher')
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
@@ -137,27 +253,99 @@ CORS_ORIGIN_WHITELIST = [
     "http://localhost:8000",
     "http://localhost:8080",
     "http://127.0.0.1:8000"
-    ]
+    ] + [origin.strip() for origin in os.environ.get('CORS_ORIGINS', '').split(',') if origin.strip()]
 
 
 # DRF Config
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        # Tokens are resolved from an in-process cache before the database
+        'store_api.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # JSON encoded and decoded by orjson when installed (see store_api.renderers)
+    'DEFAULT_RENDERER_CLASSES': (
+        'store_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'store_api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # Sliding window counters in the cache (see store_api.throttling): by client, and by client and route
     'DEFAULT_THROTTLE_CLASSES': (
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'store_api.throttling.SlidingWindowAnonThrottle',
+        'store_api.throttling.SlidingWindowUserThrottle',
+        'store_api.throttling.RouteRateThrottle',
     ),
-    'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    'DEFAULT_FILTER_BACKENDS': [
+        'django_filters.rest_framework.DjangoFilterBackend',
+        'store_api.permissions.IsOwnerFilterBackend',
+    ],
     'DEFAULT_THROTTLE_RATES': {
         'anon': '50/minute',
-        'user': '500/minute'
+        'user': '500/minute',
+        # The routes (throttle_scope of the views) limited below the user rate: the reads of the catalog
+        # are cached and only limited by the user rate, the order listings and the writes cost more
+        'catalog_write': '60/minute',
+        'orders_read': '300/minute',
+        'orders_write': '120/minute',
     }
-}
\ No newline at end of file
+}
+
+# Store API Config
+# The high_orders endpoint reads the qualifying orders from the stored order totals.
+# Set to False to group them from the order items instead (slower, does not depend on the stored totals)
+HIGH_ORDERS_USE_STORED_TOTALS = True
+# Dotted path of the product search backend. When not defined, the backend of the database vendor is used.
+# 'store_api.search.InMemorySearchBackend' searches an in-process index, for databases that cannot be changed
+PRODUCT_SEARCH_BACKEND = os.environ.get('PRODUCT_SEARCH_BACKEND')
+# Seconds the product list and detail responses remain cached (they are also invalidated by product changes)
+CATALOG_CACHE_TIMEOUT = 300
+# Seconds between catch ups of the in-process search index with the products changed by other processes
+PRODUCT_SEARCH_INDEX_REFRESH = 60
+# Maximum number of tokens and seconds each token is kept by the cached token authentication
+AUTH_TOKEN_CACHE_SIZE = 10000
+AUTH_TOKEN_CACHE_TTL = 60
+# Maximum number of orders created by a single request to the bulk creation endpoint
+BULK_ORDERS_MAX_SIZE = 1000
+# Number of rows fetched per database round trip by the orders export
+EXPORT_CHUNK_SIZE = 2000
+# Threads running the catalog reads concurrently under ASGI (see store_api.asgi)
+ASGI_CATALOG_THREADS = int(os.environ.get('ASGI_CATALOG_THREADS', 32))
+# Share of the requests measured by the instrumentation (0 to 1): Server-Timing header and a log line each
+# (see store_api.instrumentation). SQL executed INSTRUMENTATION_DUPLICATE_QUERIES times in a request is logged
+INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 0.01))
+INSTRUMENTATION_DUPLICATE_QUERIES = 5
+# Directory of the metric files of the worker processes, summed by the /metrics endpoint (see store_api.metrics).
+# When not set, the metrics are kept in the memory of the process. METRICS_TOKEN is the bearer token of the scraper:
+# when not set, /metrics is only exposed with DEBUG
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Logging
+# https://docs.djangoproject.com/en/3.0/topics/logging/
+# The store_api warnings are written to the console. STORE_API_LOG_LEVEL=INFO adds the informational lines
+# (e.g. the instrumentation and the exports lines), as in production (see scripts/start.sh)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'store_api': {
+            'handlers': ['console'],
+            'level': os.environ.get('STORE_API_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
@@ -2,6 +2,7 @@
 WSGI config for store_rest project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+The search index is prepared before the first request (see store_api.search.warm_up_search_index).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.0/howto/deployment/wsgi/
@@ -14,3 +15,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'store_rest.settings')
 
 application = get_wsgi_application()
+
+from store_api.search import warm_up_search_index  # noqa: E402
+
+warm_up_search_index()